@@ -0,0 +1,31 @@
+"""Move the sections of plans stored as single documents into plan_sections.
+
+Connects with MONGO_URL and DB_NAME like the server (backend/.env). Safe to
+run while the server is up and to run again: plans already split are left
+alone, and a plan written during its copy is copied again. The server also
+splits a plan on its first write, so running this is only needed to shrink
+stored plans (and speed up their reads) ahead of that.
+
+Usage: python backend/migrate_plan_sections.py [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+
+import server
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help='only count the plans still to be split')
+    args = parser.parse_args()
+
+    await server.ensure_indexes()
+    count = await server.migrate_plan_sections(dry_run=args.dry_run)
+    print(f"{count} plans {'to split' if args.dry_run else 'split'}")
+    server.client.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -1,44 +1,297 @@
-from fastapi import FastAPI, APIRouter, HTTPException, File, UploadFile, Form
+from fastapi import FastAPI, APIRouter, HTTPException, File, UploadFile, Form, Header, Query, Request, Response
 from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, ReturnDocument, monitoring
+from pymongo.errors import BulkWriteError, DocumentTooLarge, DuplicateKeyError, OperationFailure
 import os
+import asyncio
+import base64
+import binascii
+import bson
+import contextvars
+import cProfile
+import json
 import logging
-from pathlib import Path
-from pydantic import BaseModel, Field
+import multiprocessing
+import queue
+import re
+import threading
+import hashlib
+import pickle
+import pstats
+import time
+import zipfile
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path, PurePosixPath
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
 import io
 import numpy as np
-from openpyxl import load_workbook
-import base64
-from PIL import Image
-import tempfile
+import orjson
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.drawing.image import Image as WorkbookImage
+from openpyxl.utils import get_column_letter
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.packaging.relationship import get_dependents, get_rels_path
+from openpyxl.reader.drawings import find_images
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from PIL import Image, features
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics
+
+# Upper bounds of the histogram buckets: seconds for latencies, rows, cells or bytes for sizes
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(10 ** exponent for exponent in range(1, 9))
+
+# Uploads sent with an "X-Profile: true" header are run under cProfile when enabled
+UPLOAD_PROFILING = os.environ.get('UPLOAD_PROFILING', 'false').lower() in ('1', 'true', 'yes')
+UPLOAD_PROFILE_FUNCTIONS = int(os.environ.get('UPLOAD_PROFILE_FUNCTIONS', '40'))
+
+class Histogram:
+    """Prometheus histogram, sampled per tuple of label values.
+
+    A sample is [count per bucket..., count above the last bucket, sum, count].
+    """
+
+    def __init__(self, name, description, labelnames, buckets):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            sample = self.samples.get(labels)
+            if sample is None:
+                sample = self.samples[labels] = [0] * (len(self.buckets) + 3)
+            sample[bisect_left(self.buckets, value)] += 1
+            sample[-2] += value
+            sample[-1] += 1
+
+    def drain(self):
+        with self.lock:
+            samples, self.samples = self.samples, {}
+        return samples
+
+    def merge(self, samples):
+        with self.lock:
+            for labels, other in samples.items():
+                sample = self.samples.setdefault(labels, [0] * len(other))
+                for index, value in enumerate(other):
+                    sample[index] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            samples = sorted((labels, list(sample)) for labels, sample in self.samples.items())
+        for labels, sample in samples:
+            pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], sample):
+                cumulative += count
+                bucket_labels = ','.join([*pairs, f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = '{' + ','.join(pairs) + '}' if pairs else ''
+            lines.append(f"{self.name}_sum{suffix} {sample[-2]}")
+            lines.append(f"{self.name}_count{suffix} {sample[-1]}")
+        return '\n'.join(lines)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class MetricsRegistry:
+    """Histograms exposed on /metrics.
+
+    Pool workers record into their own copy and hand it back with ``drain``;
+    the parent folds it in with ``merge``.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+
+    def histogram(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.histograms[name] = Histogram(name, description, tuple(labelnames), buckets)
+        return self.histograms[name]
+
+    def drain(self):
+        return {name: samples for name, histogram in self.histograms.items() if (samples := histogram.drain())}
+
+    def merge(self, drained):
+        for name, samples in drained.items():
+            self.histograms[name].merge(samples)
+
+    def reset(self):
+        """Start empty in a forked worker, which inherits the parent's samples and locks"""
+        for histogram in self.histograms.values():
+            histogram.lock = threading.Lock()
+            histogram.samples = {}
+
+    def render(self):
+        return '\n'.join(histogram.render() for histogram in self.histograms.values()) + '\n'
+
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram(
+    'plan_upload_stage_seconds', 'Time spent in each stage of the upload pipeline.', ['stage']
+)
+SHEET_ROWS = metrics.histogram('plan_sheet_rows', 'Rows per processed sheet.', buckets=SIZE_BUCKETS)
+SHEET_CELLS = metrics.histogram('plan_sheet_cells', 'Non-empty cells per processed sheet.', buckets=SIZE_BUCKETS)
+DOCUMENT_BYTES = metrics.histogram(
+    'plan_document_bytes', 'BSON size of uploaded plan sections, without image bytes.', buckets=SIZE_BUCKETS
+)
+HTTP_SECONDS = metrics.histogram(
+    'http_request_seconds', 'API request latency, including sending the body.', ['method', 'route', 'status']
+)
+MONGO_SECONDS = metrics.histogram(
+    'mongo_command_seconds', 'Mongo command latency by the API route that issued it.',
+    ['command', 'collection', 'route', 'status']
+)
+
+@contextmanager
+def timed_stage(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+
+# ASGI scope of the request being served; Motor runs commands with the caller's context
+request_scope = contextvars.ContextVar('request_scope', default=None)
+
+def route_label(scope):
+    """Route template of a request, so plan ids do not each become a label value"""
+    if scope is None:
+        return 'background'
+    route = scope.get('route')
+    return route.path if route is not None else 'unmatched'
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Time Mongo commands into MONGO_SECONDS"""
+
+    def __init__(self):
+        self.collections = {}
+
+    def started(self, event):
+        command = event.command
+        collection = command.get('collection') if event.command_name == 'getMore' else command.get(event.command_name)
+        self.collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ''
+
+    def succeeded(self, event):
+        self.observe(event, 'ok')
+
+    def failed(self, event):
+        self.observe(event, 'error')
+
+    def observe(self, event, status):
+        collection = self.collections.pop((event.connection_id, event.request_id), '')
+        MONGO_SECONDS.observe(
+            event.duration_micros / 1e6, event.command_name, collection, route_label(request_scope.get()), status
+        )
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Datetimes are stored as BSON dates and read back timezone-aware
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
+# Uploads above this size are parsed with openpyxl's streaming read-only reader
+STREAMING_THRESHOLD_BYTES = int(float(os.environ.get('EXCEL_STREAMING_THRESHOLD_MB', '25')) * 1024 * 1024)
+
+# Excel parsing runs in a bounded process pool so uploads never block the event loop.
+# UPLOAD_WORKERS=0 processes uploads inline (useful for debugging).
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', os.cpu_count() or 1))
+UPLOAD_QUEUE_LIMIT = int(os.environ.get('UPLOAD_QUEUE_LIMIT', '8'))
+UPLOAD_RETRY_AFTER_SECONDS = int(os.environ.get('UPLOAD_RETRY_AFTER_SECONDS', '10'))
+
+# Sheets of one upload are processed in parallel across this many processes
+# (per upload worker); 0 or 1 processes them one after another.
+SHEET_WORKERS = int(os.environ.get('SHEET_WORKERS', '0'))
+
+# Parse cache: in-memory LRU bounded in bytes, optionally backed by a Mongo collection
+PARSE_CACHE_MAX_BYTES = int(float(os.environ.get('PARSE_CACHE_MAX_MB', '256')) * 1024 * 1024)
+PARSE_CACHE_MONGO = os.environ.get('PARSE_CACHE_MONGO', 'false').lower() in ('1', 'true', 'yes')
+PARSE_CACHE_MONGO_MAX_DOCUMENTS = int(os.environ.get('PARSE_CACHE_MONGO_MAX_DOCUMENTS', '2000'))
+PARSE_CACHE_MONGO_MAX_ENTRY_BYTES = 15 * 1024 * 1024  # stay under the 16 MB BSON limit
+
+# Compressed renditions built for extracted images; thumbnails fit in a square of this size
+IMAGE_THUMBNAIL_SIZE = int(os.environ.get('IMAGE_THUMBNAIL_SIZE', '320'))
+IMAGE_RENDITION_QUALITY = int(os.environ.get('IMAGE_RENDITION_QUALITY', '80'))
+
+# Image variants from smallest to largest
+IMAGE_VARIANTS = ['thumbnail', 'web', 'original']
+
+# Serialized plan responses kept in memory. With the change stream enabled
+# (needs a replica set) cached entries are trusted until a write to the plan
+# is seen; otherwise each hit is checked against the plan's revision first.
+PLAN_CACHE_MAX_BYTES = int(float(os.environ.get('PLAN_CACHE_MAX_MB', '64')) * 1024 * 1024)
+PLAN_CACHE_CHANGE_STREAM = os.environ.get('PLAN_CACHE_CHANGE_STREAM', 'false').lower() in ('1', 'true', 'yes')
+
+# How extracted tables are stored: 'rows' (a dict per row) or 'columnar' (see
+# encode_table); either form is converted for clients asking for the other
+TABLE_FORMATS = ('rows', 'columnar')
+TABLE_STORAGE = os.environ.get('TABLE_STORAGE', 'rows').lower()
+if TABLE_STORAGE not in TABLE_FORMATS:
+    raise ValueError(f"TABLE_STORAGE must be 'rows' or 'columnar', not {TABLE_STORAGE!r}")
+
+# Attempts at rewriting a section with columnar tables before a PATCH gives up with 409
+SECTION_REWRITE_ATTEMPTS = int(os.environ.get('SECTION_REWRITE_ATTEMPTS', '5'))
+
+# Attempts at drawing an unused plan_id before creating a plan fails
+PLAN_ID_ATTEMPTS = int(os.environ.get('PLAN_ID_ATTEMPTS', '5'))
+
+# Plan listing page sizes
+PLAN_PAGE_SIZE = int(os.environ.get('PLAN_PAGE_SIZE', '50'))
+PLAN_PAGE_MAX = int(os.environ.get('PLAN_PAGE_MAX', '200'))
+
+# Bulk imports parse up to this many workbooks at once, as free upload slots allow, and insert plans in batches of this size
+IMPORT_CONCURRENCY = int(os.environ.get('IMPORT_CONCURRENCY', max(1, UPLOAD_WORKERS)))
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '50'))
+IMPORT_MAX_WORKBOOK_BYTES = int(float(os.environ.get('IMPORT_MAX_WORKBOOK_MB', '200')) * 1024 * 1024)
+
+# Background upload jobs not heard from for this long are failed on startup or when polled
+UPLOAD_JOB_STALE_SECONDS = int(os.environ.get('UPLOAD_JOB_STALE_SECONDS', '300'))
+
+# Plan search results per request, and the length of the text snippet shown per hit
+SEARCH_RESULTS_DEFAULT = int(os.environ.get('SEARCH_RESULTS_DEFAULT', '20'))
+SEARCH_RESULTS_MAX = int(os.environ.get('SEARCH_RESULTS_MAX', '100'))
+SEARCH_SNIPPET_CHARS = int(os.environ.get('SEARCH_SNIPPET_CHARS', '160'))
+
 # Create the main app without a prefix
 app = FastAPI()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+def generate_plan_id():
+    return str(uuid.uuid4())[:8].upper()
+
 # Define Models
 class ProjectPlan(BaseModel):
+    # Sheets outside the standard layout are kept as extra (dynamic) sections
+    model_config = ConfigDict(extra='allow')
+    
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    plan_id: str = Field(default_factory=lambda: str(uuid.uuid4())[:8].upper())
+    plan_id: str = Field(default_factory=generate_plan_id)
     title: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    revision: int = 0  # incremented on every update; plans saved before revisions count as 0
     
     # Plan sections
     title_sheet: Dict[str, Any] = Field(default_factory=dict)
@@ -76,18 +329,80 @@ class ProjectPlanUpdate(BaseModel):
     skill_matrix: Optional[Dict[str, Any]] = None
     supplier_management: Optional[Dict[str, Any]] = None
 
-def prepare_for_mongo(data):
-    """Convert datetime objects to ISO strings for MongoDB storage"""
-    if isinstance(data, dict):
-        return {k: prepare_for_mongo(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [prepare_for_mongo(item) for item in data]
-    elif isinstance(data, datetime):
-        return data.isoformat()
-    return data
+class ProjectPlanSummary(BaseModel):
+    id: str
+    plan_id: str
+    title: str
+    created_at: datetime
+    updated_at: datetime
+    section_counts: Dict[str, Dict[str, int]] = Field(default_factory=dict)
+
+class ProjectPlanPage(BaseModel):
+    plans: List[ProjectPlanSummary]
+    next_page_token: Optional[str] = None
+
+class PlanOperation(BaseModel):
+    op: str  # set_cell, set_row, insert_row, delete_row or append_content
+    section: str
+    table: Optional[int] = None
+    row: Optional[int] = None  # insert_row appends when omitted
+    column: Optional[str] = None
+    value: Any = None
+
+class PlanPatch(BaseModel):
+    operations: List[PlanOperation]
+
+class PlanPatchResult(BaseModel):
+    plan_id: str
+    revision: int
+    updated_at: datetime
+
+class ImportFileResult(BaseModel):
+    filename: str
+    status: str = 'pending'  # imported or failed
+    plan_id: Optional[str] = None
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+class ImportResult(BaseModel):
+    imported: int
+    failed: int
+    results: List[ImportFileResult]
+
+class SearchHit(BaseModel):
+    plan_id: str
+    title: str
+    section: Optional[str] = None  # None when the plan title matched
+    score: float
+    snippet: str
+
+class SearchResults(BaseModel):
+    query: str
+    results: List[SearchHit]
+
+class UploadJob(BaseModel):
+    job_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    state: str = 'queued'  # queued, running, completed or failed
+    title: str
+    filename: str
+    sheets_total: Optional[int] = None
+    sheets_done: List[str] = Field(default_factory=list)
+    plan_id: Optional[str] = None
+    id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    heartbeat_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+# Datetime fields that older documents stored as ISO strings
+DATETIME_FIELDS = {
+    'plans': ['created_at', 'updated_at'],
+    'upload_jobs': ['created_at', 'updated_at', 'heartbeat_at'],
+    'plan_images': ['created_at'],
+}
 
 def parse_from_mongo(item):
-    """Parse datetime strings back from MongoDB"""
+    """Parse datetime strings back from documents stored before datetimes were native"""
     if isinstance(item, dict):
         if 'created_at' in item and isinstance(item['created_at'], str):
             item['created_at'] = datetime.fromisoformat(item['created_at'].replace('Z', '+00:00'))
@@ -98,173 +413,592 @@ def parse_from_mongo(item):
         return [parse_from_mongo(sub_item) for sub_item in item]
     return item
 
-def detect_table_structure(df, start_row=0):
+# Top-level plan fields that are not sections
+PLAN_FIELDS = {'id', 'plan_id', 'title', 'created_at', 'updated_at', 'revision'}
+
+# Stored alongside plans but never part of the plan document returned by the API
+PLAN_INTERNAL_PROJECTION = {"_id": 0, "section_counts": 0}
+PLAN_INTERNAL_FIELDS = set(PLAN_INTERNAL_PROJECTION) | {'section_keys'}
+
+FIELD_PATH = re.compile(r'^[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*$')
+
+def plan_field_projection(fields):
+    """Turn a comma-separated ``fields`` parameter into a Mongo projection"""
+    paths = [path.strip() for path in fields.split(',') if path.strip()]
+    invalid = [path for path in paths if not FIELD_PATH.match(path) or path.split('.')[0] in PLAN_INTERNAL_FIELDS]
+    if not paths or invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid fields: {', '.join(invalid) or fields!r}")
+    projection = {"_id": 0, "plan_id": 1}
+    projection.update({path: 1 for path in paths})
+    return projection
+
+def count_plan_sections(plan):
+    """Count content items, tables and images in each section of a plan"""
+    counts = {}
+    for key, section in plan.items():
+        if isinstance(section, dict) and any(k in section for k in ('content', 'tables', 'images')):
+            counts[key] = {
+                'content': len(section.get('content') or []),
+                'tables': len(section.get('tables') or []),
+                'images': len(section.get('images') or [])
+            }
+    return counts
+
+def encode_page_token(plan):
+    """Opaque token for the page after ``plan`` in the (created_at, plan_id) order"""
+    position = json.dumps([plan['created_at'].isoformat(), plan['plan_id']])
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+def decode_page_token(token):
+    """Return the (created_at, plan_id) position encoded in a page token"""
+    try:
+        created_at, plan_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid page token")
+    if not isinstance(plan_id, str):
+        raise HTTPException(status_code=400, detail="Invalid page token")
+    return created_at, plan_id
+
+def fill_plan_defaults(plan):
+    """Add top-level fields a stored plan may predate, without re-validating the rest"""
+    for name, field in ProjectPlan.model_fields.items():
+        if name not in plan:
+            plan[name] = field.get_default(call_default_factory=True)
+    return plan
+
+def iter_json_object(document):
+    """Serialize a document with orjson one top-level field at a time.
+
+    UTC datetimes end in Z, as in the responses FastAPI serializes.
+    """
+    yield b'{'
+    for index, (key, value) in enumerate(document.items()):
+        yield (b',' if index else b'') + orjson.dumps(key) + b':' + orjson.dumps(value, option=orjson.OPT_UTC_Z)
+    yield b'}'
+
+def json_response(document, headers=None):
+    """Stream a document read from Mongo as JSON.
+
+    Stored plans were validated when written, so reads skip parse_from_mongo
+    and Pydantic and go straight to orjson.
+    """
+    return StreamingResponse(iter_json_object(document), media_type="application/json", headers=headers)
+
+def plan_etag(plan, table_format='rows'):
+    """ETag identifying a revision of a plan, and the table format when not rows"""
+    suffix = f"-{table_format}" if table_format != 'rows' else ""
+    return f'"{plan["plan_id"]}-{plan.get("revision") or 0}{suffix}"'
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header lists ``etag`` (weak comparison, as for GET)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+def revalidate_headers(etag):
+    """Let clients keep plan responses but check them with If-None-Match before reuse"""
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+def plan_revision_filter(plan_id, if_match):
+    """Mongo filter matching the plan only while its ETag is one listed in an If-Match header.
+
+    Returns None when no listed ETag can belong to the plan.
+    """
+    if if_match.strip() == '*':
+        return {"plan_id": plan_id}
+    revisions = []
+    for tag in if_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        # ETags of responses in another table format end with the format
+        head, _, table_format = tag.rpartition('-')
+        if table_format in TABLE_FORMATS:
+            tag = head
+        tagged_id, _, revision = tag.rpartition('-')
+        if tagged_id == plan_id and revision.isdigit():
+            revisions.append(int(revision))
+    if not revisions:
+        return None
+    if 0 in revisions:
+        revisions.append(None)
+    return {"plan_id": plan_id, "revision": {"$in": revisions}}
+
+PLAN_OPERATIONS = {'set_cell', 'set_row', 'insert_row', 'delete_row', 'append_content'}
+
+def plan_operation_steps(operation):
+    """Translate a PATCH operation into targeted Mongo update steps.
+
+    Each step is (update, conditions): the update touches only the addressed
+    cell, row or content item, and the conditions make it match only while
+    the addressed table or row exists. Mongo has no positional delete, so
+    delete_row is a pipeline update that rebuilds the table's rows without
+    the deleted one, in a single write.
+    """
+    op, section = operation.op, operation.section
+    if op not in PLAN_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown operation {op!r}; expected one of {', '.join(sorted(PLAN_OPERATIONS))}")
+    if section in PLAN_FIELDS or section in PLAN_INTERNAL_FIELDS or not re.fullmatch(r'[A-Za-z0-9_]+', section):
+        raise HTTPException(status_code=400, detail=f"Invalid section {section!r}")
+    value = operation.value
+    
+    if op == 'append_content':
+        return [(
+            {"$push": {f"{section}.content": value}, "$inc": {f"section_counts.{section}.content": 1}},
+            {section: {"$exists": True}}
+        )]
+    
+    if operation.table is None or operation.table < 0:
+        raise HTTPException(status_code=400, detail=f"{op} needs a table index")
+    rows = f"{section}.tables.{operation.table}.rows"
+    
+    if op == 'insert_row':
+        if not isinstance(value, dict):
+            raise HTTPException(status_code=400, detail="insert_row needs the row as an object")
+        push = {"$each": [value]}
+        conditions = {f"{section}.tables.{operation.table}": {"$exists": True}}
+        if operation.row is not None:
+            if operation.row < 0:
+                raise HTTPException(status_code=400, detail="Row index must not be negative")
+            push["$position"] = operation.row
+            if operation.row > 0:
+                conditions = {f"{rows}.{operation.row - 1}": {"$exists": True}}
+        return [({"$push": {rows: push}}, conditions)]
+    
+    if operation.row is None or operation.row < 0:
+        raise HTTPException(status_code=400, detail=f"{op} needs a row index")
+    row = f"{rows}.{operation.row}"
+    conditions = {row: {"$exists": True}}
+    
+    if op == 'delete_row':
+        return [(delete_row_pipeline(f"{section}.tables", operation.table, operation.row), conditions)]
+    if op == 'set_row':
+        if not isinstance(value, dict):
+            raise HTTPException(status_code=400, detail="set_row needs the row as an object")
+        return [({"$set": {row: value}}, conditions)]
+    
+    # set_cell
+    column = operation.column
+    if not column or '.' in column or column.startswith('$'):
+        raise HTTPException(status_code=400, detail=f"Column {column!r} cannot be addressed on its own; use set_row")
+    return [({"$set": {f"{row}.{column}": value}}, conditions)]
+
+# Past the end of any array, for $slice in pipeline updates
+SLICE_TO_END = 2 ** 31 - 1
+
+def delete_row_pipeline(tables, table, row):
+    """Pipeline update removing row ``row`` of table ``table`` from the tables array at ``tables``"""
+    rows = "$$table.rows"
+    return [{"$set": {tables: {"$let": {
+        "vars": {"table": {"$arrayElemAt": [f"${tables}", table]}},
+        "in": {"$concatArrays": [
+            {"$slice": [f"${tables}", table]},
+            [{"$mergeObjects": ["$$table", {"rows": {"$concatArrays": [
+                {"$slice": [rows, row]}, {"$slice": [rows, row + 1, SLICE_TO_END]}
+            ]}}]}],
+            {"$slice": [f"${tables}", table + 1, SLICE_TO_END]}
+        ]}
+    }}}}]
+
+def update_paths(update):
+    """Paths an update step writes; a pipeline update writes the fields its stages $set"""
+    if isinstance(update, list):
+        return [path for stage in update for path in stage["$set"]]
+    return [path for fields in update.values() for path in fields]
+
+def paths_conflict(path, other):
+    return path == other or path.startswith(other + '.') or other.startswith(path + '.')
+
+def update_section(update):
+    """Section a plan update step addresses: the root of its first path outside section_counts"""
+    return next(path.split('.')[0] for path in update_paths(update) if not path.startswith('section_counts.'))
+
+def merge_update_steps(steps):
+    """Combine consecutive update steps into as few Mongo updates as their paths allow.
+
+    Each batch addresses a single section, as sections are stored as
+    separate documents. Pipeline updates are batches of their own.
+    """
+    batches = []
+    for update, conditions in steps:
+        paths = update_paths(update)
+        section = update_section(update)
+        batch = batches[-1] if batches else None
+        if (batch is None or batch['section'] != section or isinstance(update, list)
+                or isinstance(batch['update'], list)
+                or any(paths_conflict(path, other) for path in paths for other in batch['paths'])):
+            batch = {'section': section, 'update': [] if isinstance(update, list) else {}, 'conditions': {}, 'paths': []}
+            batches.append(batch)
+        if isinstance(update, list):
+            batch['update'].extend(update)
+            batch['conditions'].update(conditions)
+            batch['paths'].extend(paths)
+            continue
+        for operator, fields in update.items():
+            batch['update'].setdefault(operator, {}).update(fields)
+        batch['conditions'].update(conditions)
+        batch['paths'].extend(paths)
+    return batches
+
+def section_document_update(batch):
+    """Rewrite a batch of plan update steps for its section's plan_sections document.
+
+    Returns the update and conditions with paths under ``data``, and the
+    section count increments, which stay on the plan header.
+    """
+    section = batch['section']
+    def section_path(path):
+        return 'data' + path[len(section):]
+    conditions = {section_path(path): condition for path, condition in batch['conditions'].items()}
+    
+    if isinstance(batch['update'], list):
+        def rebase(value):
+            """A pipeline with its section paths, and $references to them, under ``data``"""
+            if isinstance(value, dict):
+                return {section_path(key) if key.startswith(section + '.') else key: rebase(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [rebase(item) for item in value]
+            if isinstance(value, str) and value.startswith(f"${section}."):
+                return '$' + section_path(value[1:])
+            return value
+        return rebase(batch['update']), conditions, {}
+    
+    update, counts = {}, {}
+    for operator, fields in batch['update'].items():
+        for path, value in fields.items():
+            if path.startswith('section_counts.'):
+                counts[path] = value
+            else:
+                update.setdefault(operator, {})[section_path(path)] = value
+    return update, conditions, counts
+
+# Rows after a header within which two data rows must appear for a table
+TABLE_LOOKAHEAD_ROWS = 9
+
+def normalize_sheet_cells(df):
+    """Convert a sheet DataFrame into stripped cell strings in one vectorized pass.
+
+    Returns the raw object values, the non-null mask, the stripped string
+    matrix ('' for null or blank cells) and per-row content flags, so the row
+    classification and table extraction never touch ``df.iloc`` per cell.
+    """
+    values = df.to_numpy(dtype=object)
+    present = pd.notna(values)
+    cells = np.full(values.shape, '', dtype=object)
+    if present.any():
+        cells[present] = pd.Series(values[present], dtype=object).astype(str).str.strip().to_numpy(dtype=object)
+    filled = cells != ''
+    return {
+        'values': values,
+        'present': present,
+        'cells': cells,
+        'filled_counts': filled.sum(axis=1),
+    }
+
+def compute_table_layout(df, present=None):
+    """Precompute table boundaries for every row of a sheet in a single pass.
+
+    A row is a header candidate when it has at least two non-null cells and the
+    next two such rows fall inside the ``TABLE_LOOKAHEAD_ROWS`` window; the
+    table then extends over the contiguous run of data rows that follows.
+    Returns per-row arrays so callers can answer "does a table start here?"
+    in O(1) instead of rescanning the frame with ``df.iloc``.
+    """
+    n = len(df)
+    if present is None:
+        present = df.notna().to_numpy()
+    counts = present.sum(axis=1) if n else np.zeros(0, dtype=int)
+    is_data = counts >= 2
+    idx = np.arange(n)
+
+    # next_data[k]: first row >= k with 2+ values (n if none)
+    # next_gap[k]: first row >= k with fewer than 2 values (n if none)
+    next_data = np.append(np.minimum.accumulate(np.where(is_data, idx, n)[::-1])[::-1], n)
+    next_gap = np.append(np.minimum.accumulate(np.where(~is_data, idx, n)[::-1])[::-1], n)
+
+    first = next_data[np.minimum(idx + 1, n)]
+    second = next_data[np.minimum(first + 1, n)]
+    is_header = is_data & (idx < n - 1) & (second < np.minimum(idx + TABLE_LOOKAHEAD_ROWS + 1, n))
+    data_end = np.where(is_header, next_gap[np.minimum(second, n)], 0)
+
+    return {'counts': counts, 'is_header': is_header, 'data_end': data_end}
+
+def detect_table_structure(df, start_row=0, layout=None):
     """Detect if a section of DataFrame contains tabular data"""
     if len(df) < 2 or start_row >= len(df) - 1:
         return None
+    if layout is None:
+        layout = compute_table_layout(df)
     
     # Look for header-like row followed by data rows
-    for i in range(start_row, min(start_row + 5, len(df) - 1)):
-        row = df.iloc[i]
-        non_null_count = row.notna().sum()
-        
-        # Check if this could be a header row (multiple non-null values)
-        if non_null_count >= 2:
-            # Check next few rows for data
-            data_rows = []
-            for j in range(i + 1, min(i + 10, len(df))):
-                data_row = df.iloc[j]
-                if data_row.notna().sum() >= 2:
-                    data_rows.append(j)
-                elif len(data_rows) >= 2:  # Found at least 2 data rows, stop
-                    break
-            
-            if len(data_rows) >= 2:
-                return {
-                    'header_row': i,
-                    'data_start': i + 1,
-                    'data_end': data_rows[-1] + 1,
-                    'columns': row.dropna().tolist()
-                }
+    window = layout['is_header'][start_row:min(start_row + 5, len(df) - 1)]
+    hits = np.flatnonzero(window)
+    if not len(hits):
+        return None
     
-    return None
+    i = start_row + int(hits[0])
+    return {
+        'header_row': i,
+        'data_start': i + 1,
+        'data_end': int(layout['data_end'][i]),
+        'columns': df.iloc[i].dropna().tolist()
+    }
+
+def open_workbook(file_content, streaming=None, read_only=False):
+    """Parse uploaded workbook bytes once, in memory.
+
+    Returns ``(excel_data, workbook)``: a ``pd.ExcelFile`` for cell values
+    backed by the same openpyxl workbook that image extraction reads, so the
+    upload is never written to disk or parsed twice. Formats openpyxl cannot
+    read (legacy .xls) fall back to pandas alone and ``workbook`` is None.
 
-def extract_images_from_excel(file_content):
-    """Extract images from Excel file and convert to base64"""
+    Files above ``STREAMING_THRESHOLD_BYTES`` (or when ``streaming`` is True)
+    are opened read-only instead and ``excel_data`` is None; their sheets are
+    consumed row by row with ``process_sheet_rows``. ``read_only`` keeps the
+    DataFrame path but defers parsing each sheet until it is read, for
+    callers that only need some of the sheets.
+    """
+    if streaming is None:
+        streaming = len(file_content) > STREAMING_THRESHOLD_BYTES
+    
+    try:
+        workbook = load_workbook(
+            io.BytesIO(file_content), read_only=streaming or read_only, data_only=True, keep_links=False
+        )
+        if streaming:
+            return None, workbook
+    except Exception as e:
+        logger.info(f"openpyxl could not load workbook, falling back to pandas: {e}")
+        return pd.ExcelFile(io.BytesIO(file_content)), None
+    
+    return pd.ExcelFile(workbook, engine='openpyxl'), workbook
+
+def load_sheet_images(workbook, sheet):
+    """Return the openpyxl images of a sheet, reading drawings lazily in read-only mode"""
+    if not workbook.read_only:
+        return sheet._images
+    
+    # Read-only worksheets skip drawings; load just this sheet's from the archive
+    archive = workbook._archive
+    rels_path = get_rels_path(sheet._worksheet_path)
+    if rels_path not in archive.namelist():
+        return []
+    images = []
+    for rel in get_dependents(archive, rels_path).find(SpreadsheetDrawing._rel_type):
+        images.extend(find_images(archive, rel.target)[1])
+    return images
+
+def image_anchor(image):
+    """Return the top-left cell reference (e.g. 'B2') an image is anchored to"""
+    anchor = image.anchor
+    marker = getattr(anchor, '_from', None)
+    if marker is None:
+        return str(anchor)
+    return f"{get_column_letter(marker.col + 1)}{marker.row + 1}"
+
+def extract_images_from_excel(workbook):
+    """Extract images from a loaded openpyxl workbook.
+
+    Each image carries its raw bytes under ``data`` and a content hash under
+    ``image_id``; ``store_plan_images`` moves the bytes out of the plan.
+    """
     images = {}
     try:
-        # Save to temporary file for openpyxl
-        with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp_file:
-            tmp_file.write(file_content)
-            tmp_file.flush()
-            
-            wb = load_workbook(tmp_file.name)
+        for sheet_name in workbook.sheetnames:
+            sheet = workbook[sheet_name]
+            sheet_images = []
             
-            for sheet_name in wb.sheetnames:
-                sheet = wb[sheet_name]
-                sheet_images = []
-                
-                # Extract images from worksheet
-                for image in sheet._images:
-                    try:
-                        # Convert image to base64
-                        img_data = image._data()
-                        img_b64 = base64.b64encode(img_data).decode()
-                        
-                        sheet_images.append({
-                            'anchor': str(image.anchor),
-                            'data': img_b64,
-                            'format': image.format
-                        })
-                    except Exception as e:
-                        logger.warning(f"Could not extract image: {e}")
-                
-                if sheet_images:
-                    images[sheet_name] = sheet_images
+            # Extract images from worksheet
+            for image in load_sheet_images(workbook, sheet):
+                try:
+                    # openpyxl re-encodes anything but gif/jpeg/png as png
+                    img_data = image._data()
+                    img_format = image.format if image.format in ('gif', 'jpeg', 'png') else 'png'
+                    
+                    sheet_images.append({
+                        'image_id': hashlib.sha256(img_data).hexdigest(),
+                        'anchor': image_anchor(image),
+                        'format': img_format,
+                        'size': len(img_data),
+                        'width': image.width,
+                        'height': image.height,
+                        'data': img_data
+                    })
+                except Exception as e:
+                    logger.warning(f"Could not extract image: {e}")
             
-            # Clean up temporary file
-            os.unlink(tmp_file.name)
+            if sheet_images:
+                images[sheet_name] = sheet_images
             
     except Exception as e:
         logger.error(f"Error extracting images: {e}")
     
     return images
 
-def process_sheet_content(df, sheet_name):
-    """Process a single sheet with improved structure detection"""
-    if df.empty:
-        return {'content': [], 'tables': [], 'images': [], 'metadata': {}}
+def classify_row(position, row_data, filled_count):
+    """Classify a non-empty, non-table row as navigation, paragraph or row"""
+    # Check for special formatting (like "Back to TOC" links)
+    row_text = ' '.join([cell for cell in row_data if cell])
+    
+    # Identify hyperlinks or special elements
+    if 'back to toc' in row_text.lower():
+        return {'type': 'navigation', 'content': row_text, 'position': position}
+    elif filled_count == 1 and len(row_text) > 20:
+        # Likely a paragraph or description
+        return {'type': 'paragraph', 'content': row_text, 'position': position}
+    else:
+        # Regular content
+        return {'type': 'row', 'content': row_data, 'position': position}
+
+def table_rows_to_dicts(headers, rows):
+    """Map table rows onto header keys, dropping rows with no values"""
+    table_data = []
+    for row in rows:
+        table_row_data = dict(zip(headers, row))
+        if any(table_row_data.values()):  # Only add non-empty rows
+            table_data.append(table_row_data)
+    return table_data
+
+def iter_frame_content(df, stats=None):
+    """Yield content items for a DataFrame sheet using vectorized cell arrays"""
+    sheet = normalize_sheet_cells(df)
+    values, present, cells = sheet['values'], sheet['present'], sheet['cells']
+    if stats is not None:
+        stats['cells'] = int(present.sum())
+    filled_counts = sheet['filled_counts']
+    layout = compute_table_layout(df, present)
+    
+    # Tables advance ``i`` past the rows they consume
+    i = 0
+    while i < len(df):
+        if not filled_counts[i]:
+            i += 1
+            continue
+        
+        if layout['is_header'][i]:
+            headers = values[i][present[i]].tolist()
+            data_end = int(layout['data_end'][i])
+            rows = (row.tolist() for row in cells[i + 1:data_end, :len(headers)])
+            yield {
+                'type': 'table',
+                'headers': headers,
+                'rows': table_rows_to_dicts(headers, rows),
+                'position': i
+            }
+            i = data_end
+            continue
+        
+        yield classify_row(i, cells[i].tolist(), filled_counts[i])
+        i += 1
+
+def iter_sheet_content(rows, stats=None):
+    """Yield content items for a stream of row value tuples.
+
+    Streaming counterpart of ``iter_frame_content`` for openpyxl's read-only
+    ``iter_rows(values_only=True)``: only the table look-ahead window is held
+    in memory, whatever the number of rows. Cells equal to pandas' default NA
+    strings count as empty, as they do for ``pd.read_excel``.
+    ``stats['total_rows']`` and ``stats['cells']`` are filled in once the
+    stream is exhausted.
+    """
+    last_row = -1
+    cell_count = 0
+    
+    def normalize(position, values):
+        nonlocal last_row, cell_count
+        present = [v is not None and not (isinstance(v, str) and v in STR_NA_VALUES) for v in values]
+        cells = [str(v).strip() if p else '' for v, p in zip(values, present)]
+        count = sum(present)
+        if count:
+            last_row = position
+            cell_count += count
+        return position, values, present, cells, count
+    
+    source = (normalize(position, values) for position, values in enumerate(rows))
+    window = deque()
+    
+    def fill(size):
+        while len(window) < size:
+            row = next(source, None)
+            if row is None:
+                return
+            window.append(row)
+    
+    while True:
+        fill(TABLE_LOOKAHEAD_ROWS + 1)
+        if not window:
+            break
+        position, values, present, cells, count = window.popleft()
+        filled_count = sum(1 for cell in cells if cell)
+        if not filled_count:
+            continue
+        
+        # A header needs two data rows within the look-ahead window
+        upcoming = sum(1 for _, _, _, _, c in islice(window, TABLE_LOOKAHEAD_ROWS) if c >= 2)
+        if count >= 2 and upcoming >= 2:
+            headers = [v for v, p in zip(values, present) if p]
+            width = len(headers)
+            table_rows = []
+            data_rows = 0
+            while data_rows < 2:
+                row = window.popleft()
+                data_rows += row[4] >= 2
+                table_rows.append(row[3][:width])
+            # The table then runs until the first row with fewer than two values
+            while True:
+                fill(1)
+                if not window or window[0][4] < 2:
+                    break
+                table_rows.append(window.popleft()[3][:width])
+            rows = (row + [''] * (width - len(row)) for row in table_rows)
+            yield {
+                'type': 'table',
+                'headers': headers,
+                'rows': table_rows_to_dicts(headers, rows),
+                'position': position
+            }
+            continue
+        
+        yield classify_row(position, cells, filled_count)
     
+    if stats is not None:
+        stats['total_rows'] = last_row + 1
+        stats['cells'] = cell_count
+
+def assemble_sheet_content(items, sheet_name, total_rows):
+    """Group content items into the stored content/tables layout"""
     content = []
     tables = []
     current_section = []
     
-    # Process each row
-    for i in range(len(df)):
-        row = df.iloc[i]
-        row_data = []
-        has_content = False
-        
-        for j in range(len(df.columns)):
-            cell_value = row.iloc[j] if j < len(row) else None
-            if pd.notna(cell_value) and str(cell_value).strip():
-                cell_str = str(cell_value).strip()
-                row_data.append(cell_str)
-                has_content = True
-            else:
-                row_data.append('')
-        
-        if has_content:
-            # Check if this could be start of a table
-            table_structure = detect_table_structure(df, i)
-            if table_structure and i == table_structure['header_row']:
-                # Save current section
-                if current_section:
-                    content.append({
-                        'type': 'section',
-                        'content': current_section
-                    })
-                    current_section = []
-                
-                # Extract table
-                table_data = []
-                headers = table_structure['columns']
-                
-                for table_row_idx in range(table_structure['data_start'], table_structure['data_end']):
-                    if table_row_idx < len(df):
-                        table_row = df.iloc[table_row_idx]
-                        table_row_data = {}
-                        for col_idx, header in enumerate(headers):
-                            if col_idx < len(table_row):
-                                cell_val = table_row.iloc[col_idx]
-                                if pd.notna(cell_val):
-                                    table_row_data[header] = str(cell_val).strip()
-                                else:
-                                    table_row_data[header] = ''
-                        if any(table_row_data.values()):  # Only add non-empty rows
-                            table_data.append(table_row_data)
-                
-                if table_data:
-                    tables.append({
-                        'headers': headers,
-                        'rows': table_data,
-                        'position': i
-                    })
-                    content.append({
-                        'type': 'table',
-                        'table_index': len(tables) - 1,
-                        'position': i
-                    })
-                
-                # Skip to end of table
-                i = table_structure['data_end'] - 1
-                continue
-            
-            # Regular content row
-            # Check for special formatting (like "Back to TOC" links)
-            row_text = ' '.join([cell for cell in row_data if cell])
-            
-            # Identify hyperlinks or special elements
-            if 'back to toc' in row_text.lower():
+    for item in items:
+        if item['type'] == 'table':
+            # Save current section
+            if current_section:
                 content.append({
-                    'type': 'navigation',
-                    'content': row_text,
-                    'position': i
+                    'type': 'section',
+                    'content': current_section
                 })
-            elif len([cell for cell in row_data if cell]) == 1 and len(row_text) > 20:
-                # Likely a paragraph or description
-                current_section.append({
-                    'type': 'paragraph',
-                    'content': row_text,
-                    'position': i
+                current_section = []
+            
+            if item['rows']:
+                tables.append({
+                    'headers': item['headers'],
+                    'rows': item['rows'],
+                    'position': item['position']
                 })
-            else:
-                # Regular content
-                current_section.append({
-                    'type': 'row',
-                    'content': row_data,
-                    'position': i
+                content.append({
+                    'type': 'table',
+                    'table_index': len(tables) - 1,
+                    'position': item['position']
                 })
+        elif item['type'] == 'navigation':
+            content.append(item)
+        else:
+            current_section.append(item)
     
     # Add remaining section
     if current_section:
@@ -278,13 +1012,152 @@ def process_sheet_content(df, sheet_name):
         'tables': tables,
         'metadata': {
             'sheet_name': sheet_name,
-            'total_rows': len(df),
+            'total_rows': total_rows,
             'processed_items': len(content)
         }
     }
 
-def process_excel_data(excel_data, file_content=None):
-    """Process uploaded Excel file and extract data with improved structure"""
+def process_sheet_content(df, sheet_name):
+    """Process a single sheet with improved structure detection"""
+    if df.empty:
+        return {'content': [], 'tables': [], 'images': [], 'metadata': {}}
+    
+    stats = {}
+    processed = assemble_sheet_content(iter_frame_content(df, stats), sheet_name, len(df))
+    SHEET_ROWS.observe(len(df))
+    SHEET_CELLS.observe(stats['cells'])
+    return processed
+
+def process_sheet_rows(rows, sheet_name):
+    """Process a sheet streamed as row value tuples with bounded memory"""
+    stats = {}
+    processed = assemble_sheet_content(iter_sheet_content(rows, stats), sheet_name, None)
+    if not stats['total_rows']:
+        return {'content': [], 'tables': [], 'images': [], 'metadata': {}}
+    
+    SHEET_ROWS.observe(stats['total_rows'])
+    SHEET_CELLS.observe(stats['cells'])
+    processed['metadata']['total_rows'] = stats['total_rows']
+    return processed
+
+def encode_rendition(img, max_size=None):
+    """Encode a Pillow image as WebP (JPEG if WebP is unavailable), optionally shrunk"""
+    if max_size:
+        img = img.copy()
+        img.thumbnail((max_size, max_size))
+    fmt = 'webp' if features.check('webp') else 'jpeg'
+    if fmt == 'jpeg' and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, quality=IMAGE_RENDITION_QUALITY)
+    data = buffer.getvalue()
+    return {'data': data, 'format': fmt, 'width': img.width, 'height': img.height, 'size': len(data)}
+
+def build_image_renditions(img_data):
+    """Build the compressed 'web' rendition and 'thumbnail' of an image; runs in the pool.
+
+    The web rendition is only kept when it is actually smaller than the
+    original. Returns the original dimensions alongside the renditions.
+    """
+    with Image.open(io.BytesIO(img_data)) as img:
+        img.load()
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        renditions = {}
+        web = encode_rendition(img)
+        if web['size'] < len(img_data):
+            renditions['web'] = web
+        renditions['thumbnail'] = encode_rendition(img, IMAGE_THUMBNAIL_SIZE)
+        return {'width': img.width, 'height': img.height, 'renditions': renditions}
+
+class ExcelProcessingError(Exception):
+    """Picklable error carrying a processing failure out of a pool worker"""
+
+def process_workbook_sheet(excel_data, workbook, sheet_name):
+    """Parse and structure one sheet; streams rows when ``excel_data`` is None"""
+    if excel_data is None:
+        logger.info(f"Streaming sheet '{sheet_name}'")
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        # Rows are read as they are processed, so streamed sheets have no separate read stage
+        with timed_stage('process_sheet'):
+            return process_sheet_rows(rows, sheet_name)
+    
+    with timed_stage('read_sheet'):
+        df = excel_data.parse(sheet_name, header=None)
+    logger.info(f"Processing sheet '{sheet_name}' with {len(df)} rows")
+    
+    # Process with improved structure detection
+    with timed_stage('process_sheet'):
+        return process_sheet_content(df, sheet_name)
+
+def process_sheet_from_bytes(file_content, sheet_name):
+    """Sheet pool task: open the workbook read-only and process a single sheet.
+
+    Read-only workbooks parse sheet XML lazily, so each worker only pays for
+    the sheet it was given. Returns the processed sheet and the metrics
+    recorded while processing it.
+    """
+    with timed_stage('open_workbook'):
+        workbook = load_workbook(io.BytesIO(file_content), read_only=True, data_only=True, keep_links=False)
+    try:
+        excel_data = None
+        if len(file_content) <= STREAMING_THRESHOLD_BYTES:
+            excel_data = pd.ExcelFile(workbook, engine='openpyxl')
+        return process_workbook_sheet(excel_data, workbook, sheet_name), metrics.drain()
+    except Exception as e:
+        # Arbitrary library exceptions may not survive pickling back to the parent
+        raise ExcelProcessingError(str(e)) from None
+    finally:
+        workbook.close()
+
+def iter_sheet_results(excel_data, workbook, sheet_names, executor=None, file_content=None,
+                       cached_sheets=None, fresh_sheets=None):
+    """Yield ``(sheet_name, processed_data, error)`` in workbook sheet order.
+
+    With an ``executor`` every sheet is submitted up front and processed in
+    parallel from ``file_content``; results are still yielded in order.
+    Sheets found in ``cached_sheets`` are not processed again, and newly
+    processed sheets are recorded in ``fresh_sheets`` when it is given.
+    """
+    cached_sheets = cached_sheets or {}
+    pending = [name for name in sheet_names if name not in cached_sheets]
+    if executor is not None:
+        futures = {name: executor.submit(process_sheet_from_bytes, file_content, name) for name in pending}
+    
+    for sheet_name in sheet_names:
+        if sheet_name in cached_sheets:
+            yield sheet_name, cached_sheets[sheet_name], None
+            continue
+        try:
+            if executor is not None:
+                processed_data, drained = futures[sheet_name].result()
+                metrics.merge(drained)
+            else:
+                processed_data = process_workbook_sheet(excel_data, workbook, sheet_name)
+        except Exception as e:
+            yield sheet_name, None, e
+            continue
+        if fresh_sheets is not None:
+            # Shallow copy: images are attached to the yielded dict afterwards
+            fresh_sheets[sheet_name] = dict(processed_data)
+        yield sheet_name, processed_data, None
+
+def dynamic_section_key(sheet_name):
+    """Section key for a sheet outside sheet_mapping, kept clear of the plan's own fields"""
+    key = sheet_name.lower().replace(' ', '_').replace('-', '_')
+    if key in PLAN_FIELDS or key in PLAN_INTERNAL_FIELDS:
+        key += '_section'
+    return key
+
+def process_excel_data(excel_data, workbook=None, progress=None, executor=None, file_content=None,
+                       cached_sheets=None, fresh_sheets=None):
+    """Process uploaded Excel file and extract data with improved structure
+
+    ``progress(sheet_name, sheets_total)`` is called after each sheet. Passing
+    an ``executor`` together with the raw ``file_content`` fans sheets out
+    across its workers. ``cached_sheets``/``fresh_sheets`` are described in
+    ``iter_sheet_results``.
+    """
     try:
         plan_data = {
             'title_sheet': {},
@@ -303,10 +1176,11 @@ def process_excel_data(excel_data, file_content=None):
             'supplier_management': {}
         }
         
-        # Extract images if file content is provided
+        # Extract images from the already-parsed workbook if provided
         images = {}
-        if file_content:
-            images = extract_images_from_excel(file_content)
+        if workbook is not None:
+            with timed_stage('extract_images'):
+                images = extract_images_from_excel(workbook)
         
         # Map sheet names to our data structure with variations
         sheet_mapping = {
@@ -328,19 +1202,20 @@ def process_excel_data(excel_data, file_content=None):
             'Supplier Agreement Management': 'supplier_management'  # Handle typo in original
         }
         
-        available_sheets = excel_data.sheet_names
+        # Streaming mode: no DataFrames, rows come straight from the read-only workbook
+        available_sheets = workbook.sheetnames if excel_data is None else excel_data.sheet_names
         logger.info(f"Available sheets: {available_sheets}")
         
         # Process all available sheets, not just mapped ones
-        for sheet_name in available_sheets:
+        results = iter_sheet_results(
+            excel_data, workbook, available_sheets, executor, file_content, cached_sheets, fresh_sheets
+        )
+        for sheet_name, processed_data, error in results:
             data_key = sheet_mapping.get(sheet_name)
             
             try:
-                df = pd.read_excel(excel_data, sheet_name=sheet_name, header=None)
-                logger.info(f"Processing sheet '{sheet_name}' with {len(df)} rows")
-                
-                # Process with improved structure detection
-                processed_data = process_sheet_content(df, sheet_name)
+                if error is not None:
+                    raise error
                 
                 # Add images for this sheet if available
                 if sheet_name in images:
@@ -351,7 +1226,7 @@ def process_excel_data(excel_data, file_content=None):
                     plan_data[data_key] = processed_data
                 else:
                     # Create dynamic section for unmapped sheets
-                    section_key = sheet_name.lower().replace(' ', '_').replace('-', '_')
+                    section_key = dynamic_section_key(sheet_name)
                     plan_data[section_key] = processed_data
                     logger.info(f"Created dynamic section: {section_key}")
                 
@@ -367,8 +1242,11 @@ def process_excel_data(excel_data, file_content=None):
                 if data_key and data_key in plan_data:
                     plan_data[data_key] = error_data
                 else:
-                    section_key = sheet_name.lower().replace(' ', '_').replace('-', '_')
+                    section_key = dynamic_section_key(sheet_name)
                     plan_data[section_key] = error_data
+            
+            if progress:
+                progress(sheet_name, len(available_sheets))
         
         return plan_data
         
@@ -376,138 +1254,2351 @@ def process_excel_data(excel_data, file_content=None):
         logger.error(f"Error processing Excel file: {e}")
         raise HTTPException(status_code=400, detail=f"Error processing Excel file: {e}")
 
-# API Routes
 
-@api_router.get("/")
-async def root():
-    return {"message": "Project Plan Management API"}
+# Per-sheet progress of background upload jobs, as (job_id, sheet_name, sheets_total).
+# Pool workers inherit this queue through the executor initializer.
+upload_progress_queue = None
 
-@api_router.post("/plans", response_model=ProjectPlan)
-async def create_plan(plan_data: ProjectPlanCreate):
-    """Create a new project plan"""
-    plan_dict = plan_data.dict()
-    
-    # Initialize with empty structured sections for manual plans
-    for section_key in ['title_sheet', 'revision_history', 'definitions_references', 
-                       'project_introduction', 'resource_plan', 'pmc_objectives',
-                       'quality_management', 'dar_tailoring', 'risk_management',
-                       'opportunity_management', 'configuration_management',
-                       'deliverables', 'skill_matrix', 'supplier_management']:
-        plan_dict[section_key] = {
-            'content': [],
-            'tables': [],
-            'images': [],
-            'metadata': {'sheet_name': section_key.replace('_', ' ').title(), 'manual_creation': True}
-        }
-    
-    plan_obj = ProjectPlan(**plan_dict)
-    
-    # Prepare for MongoDB
-    plan_mongo = prepare_for_mongo(plan_obj.dict())
-    result = await db.plans.insert_one(plan_mongo)
-    
-    if result.inserted_id:
-        return plan_obj
-    else:
-        raise HTTPException(status_code=500, detail="Failed to create plan")
+sheet_executor = None
 
-@api_router.post("/plans/upload")
-async def upload_plan_from_excel(
-    file: UploadFile = File(...),
-    title: str = Form(...)
-):
-    """Upload and create a plan from Excel file"""
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="File must be an Excel file (.xlsx or .xls)")
-    
+def init_upload_worker(progress_queue):
+    global upload_progress_queue, sheet_executor
+    upload_progress_queue = progress_queue
+    sheet_executor = None
+    metrics.reset()
+
+# Pools start their workers from a fork server rather than by forking the
+# server itself, whose Motor, pymongo and logging threads may hold locks a
+# forked child would inherit held
+POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+def get_sheet_executor():
+    """Return this process's per-sheet pool, creating it on first use"""
+    global sheet_executor
+    if sheet_executor is None:
+        sheet_executor = ProcessPoolExecutor(max_workers=SHEET_WORKERS, mp_context=POOL_CONTEXT)
+    return sheet_executor
+
+def report_sheet_progress(job_id):
+    """Return a process_excel_data progress callback posting to the job queue"""
+    progress_queue = upload_progress_queue
+    if job_id is None or progress_queue is None:
+        return None
+    return lambda sheet_name, sheets_total: progress_queue.put((job_id, sheet_name, sheets_total))
+
+def parse_excel_upload(file_content, job_id=None, cached_sheets=None, profile=False):
+    """Open and process an uploaded workbook; runs inside the upload process pool.
+
+    Returns ``(plan_sections, fresh_sheets, report)`` where ``fresh_sheets``
+    holds the sheets that were actually processed, for the parse cache, and
+    ``report`` carries the metrics recorded here and, with ``profile``, a
+    cProfile summary of the parse.
+    """
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    fan_out = SHEET_WORKERS > 1
+    # Fan-out and cache hits leave sheets unread here, so parse them lazily
+    with timed_stage('open_workbook'):
+        excel_data, workbook = open_workbook(file_content, read_only=fan_out or bool(cached_sheets))
+    executor = get_sheet_executor() if fan_out and workbook is not None else None
+    fresh_sheets = {}
     try:
-        # Read the uploaded Excel file
-        content = await file.read()
-        excel_data = pd.ExcelFile(io.BytesIO(content))
-        
-        # Process Excel data with enhanced processing
-        plan_sections = process_excel_data(excel_data, content)
-        
-        # Create plan object
-        plan_obj = ProjectPlan(
-            title=title,
-            **plan_sections
+        plan_sections = process_excel_data(
+            excel_data, workbook, report_sheet_progress(job_id), executor, file_content,
+            cached_sheets, fresh_sheets
         )
+        if TABLE_STORAGE == 'columnar':
+            # Copies, as processed sheets are shared with the parse cache
+            plan_sections = {
+                key: convert_section_tables(dict(section), 'columnar') for key, section in plan_sections.items()
+            }
+        # Stored plans keep image references only; sizing here keeps the encode off the event loop
+        image_bytes = sum(
+            len(image.get('data') or b'') for section in plan_sections.values() for image in section.get('images') or []
+        )
+        DOCUMENT_BYTES.observe(len(bson.encode(plan_sections)) - image_bytes)
+        report = {'metrics': metrics.drain(), 'profile': None}
+        if profiler is not None:
+            profiler.disable()
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(UPLOAD_PROFILE_FUNCTIONS)
+            report['profile'] = summary.getvalue()
+        return plan_sections, fresh_sheets, report
+    except HTTPException as e:
+        # HTTPException cannot be unpickled in the parent process
+        raise ExcelProcessingError(e.detail) from None
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if workbook is not None:
+            workbook.close()
+
+# Bump when sheet processing changes so cached results from older code are ignored
+PARSE_CACHE_VERSION = '2'
+SHARED_STRING_CELL = re.compile(rb'<c\b[^>]*\bt="s"[^>]*>\s*<v>(\d+)</v>')
+
+def fingerprint_workbook(file_content):
+    """Return a content hash per sheet name for the per-sheet parse cache.
+
+    Each key covers the sheet XML plus only the shared strings that sheet
+    references, so editing one sheet does not invalidate the others even
+    though all sheets share one string table. Returns {} for files openpyxl
+    cannot read.
+    """
+    try:
+        workbook = load_workbook(io.BytesIO(file_content), read_only=True, data_only=True, keep_links=False)
+    except Exception:
+        return {}
+    
+    try:
+        archive = workbook._archive
+        strings = workbook.shared_strings
+        streaming = len(file_content) > STREAMING_THRESHOLD_BYTES
+        common = hashlib.sha256(f"{PARSE_CACHE_VERSION}|{streaming}|{workbook.epoch}".encode())
+        if 'xl/styles.xml' in archive.namelist():
+            # Number formats decide which numbers are read as dates
+            common.update(archive.read('xl/styles.xml'))
+        
+        keys = {}
+        for sheet in workbook.worksheets:
+            xml = archive.read(sheet._worksheet_path)
+            digest = common.copy()
+            digest.update(sheet.title.encode() + b'\0' + xml)
+            refs = SHARED_STRING_CELL.findall(xml)
+            if len(refs) != xml.count(b't="s"'):
+                # Unrecognised cell markup: fall back to the whole string table
+                refs = range(len(strings))
+            for ref in refs:
+                digest.update(str(strings[int(ref)]).encode() + b'\0')
+            keys[sheet.title] = digest.hexdigest()
+        return keys
+    finally:
+        workbook.close()
+
+class ParseCache:
+    """Content-addressed cache of parse results with an LRU memory tier.
+
+    Entries are pickled so cached structures can never be mutated by a
+    caller, and so the memory tier can be bounded in bytes. When
+    ``collection`` is given, entries are also kept in Mongo (written only by
+    this service) so they survive restarts and are shared between workers.
+    """
+
+    def __init__(self, max_bytes, collection=None, max_documents=0):
+        self.max_bytes = max_bytes
+        self.collection = collection
+        self.max_documents = max_documents
+        self.entries = OrderedDict()
+        self.size = 0
+        self.stats = {'hits': 0, 'misses': 0, 'memory_hits': 0, 'mongo_hits': 0, 'evictions': 0}
+
+    async def get(self, key):
+        blob = self.entries.get(key)
+        if blob is not None:
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            self.stats['memory_hits'] += 1
+            return pickle.loads(blob)
         
-        # Save to MongoDB
-        plan_mongo = prepare_for_mongo(plan_obj.dict())
-        result = await db.plans.insert_one(plan_mongo)
-        
-        if result.inserted_id:
-            return {"message": "Plan uploaded successfully", "plan_id": plan_obj.plan_id, "id": plan_obj.id}
+        if self.collection is not None:
+            doc = await self.collection.find_one_and_update(
+                {"_id": key},
+                {"$set": {"last_used": datetime.now(timezone.utc)}}
+            )
+            if doc is not None:
+                self.stats['hits'] += 1
+                self.stats['mongo_hits'] += 1
+                self._remember(key, bytes(doc['data']))
+                return pickle.loads(doc['data'])
+        
+        self.stats['misses'] += 1
+        return None
+
+    async def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, blob)
+        if self.collection is not None and len(blob) < PARSE_CACHE_MONGO_MAX_ENTRY_BYTES:
+            await self.collection.update_one(
+                {"_id": key},
+                {"$set": {"data": blob, "size": len(blob), "last_used": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+            await self._trim_collection()
+
+    def _remember(self, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = blob
+        self.size += len(blob)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.stats['evictions'] += 1
+
+    async def _trim_collection(self):
+        excess = await self.collection.count_documents({}) - self.max_documents
+        if excess > 0:
+            oldest = await self.collection.find({}, {"_id": 1}).sort("last_used", 1).limit(excess).to_list(excess)
+            await self.collection.delete_many({"_id": {"$in": [doc['_id'] for doc in oldest]}})
+            self.stats['evictions'] += len(oldest)
+
+    def snapshot(self):
+        return {**self.stats, 'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes}
+
+parse_cache = ParseCache(
+    PARSE_CACHE_MAX_BYTES,
+    db.parse_cache if PARSE_CACHE_MONGO else None,
+    PARSE_CACHE_MONGO_MAX_DOCUMENTS
+)
+
+class PlanResponseCache:
+    """LRU of serialized plan responses, bounded in bytes.
+
+    Entries are (etag, body) keyed by plan_id and table format, and also
+    findable by the plan's Mongo _id, which is all a change stream delete
+    event carries. ``trusted`` is set while a change stream keeps the cache
+    in sync.
+
+    Invalidations are numbered, and only the latest ``max_invalidations``
+    plans are remembered; a read that started before an older one is not
+    cached for any plan.
+    """
+
+    def __init__(self, max_bytes, max_invalidations=1024):
+        self.max_bytes = max_bytes
+        self.max_invalidations = max_invalidations
+        self.entries = OrderedDict()
+        self.doc_ids = {}
+        self.size = 0
+        self.trusted = False
+        self.invalidations = 0
+        self.invalidated_at = OrderedDict()
+        self.forgotten_at = 0
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'bytes_saved': 0, 'invalidations': 0, 'evictions': 0}
+
+    def get(self, plan_id, table_format='rows'):
+        entry = self.entries.get((plan_id, table_format))
+        if entry is not None:
+            self.entries.move_to_end((plan_id, table_format))
+        return entry
+
+    def generation(self, plan_id):
+        """Marker to pass to ``put`` so a response read before an invalidation is not cached"""
+        return self.invalidations
+
+    def put(self, plan_id, doc_id, etag, body, generation, table_format='rows'):
+        if len(body) > self.max_bytes or self.invalidated_at.get(plan_id, self.forgotten_at) > generation:
+            return
+        self._drop((plan_id, table_format))
+        self.entries[(plan_id, table_format)] = (etag, body, doc_id)
+        self.doc_ids[doc_id] = plan_id
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+            self.stats['evictions'] += 1
+
+    def invalidate(self, plan_id):
+        self.invalidations += 1
+        self.invalidated_at.pop(plan_id, None)
+        self.invalidated_at[plan_id] = self.invalidations
+        while len(self.invalidated_at) > self.max_invalidations:
+            _, self.forgotten_at = self.invalidated_at.popitem(last=False)
+        dropped = [self._drop((plan_id, table_format)) for table_format in TABLE_FORMATS]
+        if any(dropped):
+            self.stats['invalidations'] += 1
+
+    def invalidate_doc(self, doc_id):
+        plan_id = self.doc_ids.get(doc_id)
+        if plan_id is not None:
+            self.invalidate(plan_id)
+
+    def clear(self):
+        for plan_id in {plan_id for plan_id, _ in self.entries}:
+            self.invalidate(plan_id)
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        self.size -= len(entry[1])
+        if not any((key[0], table_format) in self.entries for table_format in TABLE_FORMATS):
+            self.doc_ids.pop(entry[2], None)
+        return True
+
+    def record(self, outcome, bytes_saved=0):
+        self.stats[outcome] += 1
+        self.stats['bytes_saved'] += bytes_saved
+
+    def tee(self, plan_id, doc_id, etag, chunks, generation, table_format='rows'):
+        """Pass response chunks through, caching the whole body once it is complete"""
+        body = []
+        for chunk in chunks:
+            body.append(chunk)
+            yield chunk
+        self.put(plan_id, doc_id, etag, b''.join(body), generation, table_format)
+
+    def snapshot(self):
+        served = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'hit_rate': self.stats['hits'] / served if served else 0.0,
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'change_stream': self.trusted
+        }
+
+plan_cache = PlanResponseCache(PLAN_CACHE_MAX_BYTES)
+
+plan_change_task = None
+
+async def watch_plan_changes():
+    """Invalidate cached plans on writes from any worker, via a Mongo change stream"""
+    while True:
+        try:
+            pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+            async with db.plans.watch(pipeline) as stream:
+                # Writes missed while not watching may have left stale entries
+                plan_cache.clear()
+                plan_cache.trusted = True
+                async for change in stream:
+                    plan_cache.invalidate_doc(change['documentKey']['_id'])
+        except asyncio.CancelledError:
+            plan_cache.trusted = False
+            raise
+        except Exception as e:
+            logger.warning(f"Plan change stream stopped, checking cached plans against Mongo: {e}")
+        plan_cache.trusted = False
+        await asyncio.sleep(10)
+
+async def parse_upload(content, job_id=None, profile=False):
+    """Process an uploaded workbook in the pool, reusing cached parse results.
+
+    A byte-identical workbook is answered from the cache without parsing; in
+    a partly changed one only sheets whose content hash is new are processed.
+    With ``profile`` the cache is bypassed and a cProfile summary of the
+    parse is logged.
+    """
+    digest = (await asyncio.to_thread(hashlib.sha256, content)).hexdigest()
+    # Whole-workbook results hold tables in the stored form; sheet results always hold rows
+    workbook_key = f"workbook:{PARSE_CACHE_VERSION}:{TABLE_STORAGE}:{digest}"
+    plan_sections = None if profile else await parse_cache.get(workbook_key)
+    if plan_sections is not None:
+        return plan_sections
+    
+    try:
+        with timed_stage('fingerprint'):
+            sheet_keys = await run_in_upload_pool(fingerprint_workbook, content)
+    except Exception as e:
+        logger.warning(f"Could not fingerprint workbook sheets: {e}")
+        sheet_keys = {}
+    cached_sheets = {}
+    for sheet_name, key in sheet_keys.items():
+        cached = None if profile else await parse_cache.get(f"sheet:{key}")
+        if cached is not None:
+            cached_sheets[sheet_name] = cached
+    
+    # Includes the wait for a free pool worker
+    with timed_stage('parse'):
+        plan_sections, fresh_sheets, report = await run_in_upload_pool(
+            parse_excel_upload, content, job_id, cached_sheets, profile
+        )
+    metrics.merge(report['metrics'])
+    if report['profile']:
+        logger.info(f"Profile of workbook parse ({len(content)} bytes):\n{report['profile']}")
+    for sheet_name, processed_data in fresh_sheets.items():
+        if sheet_name in sheet_keys and not processed_data['metadata'].get('error'):
+            await parse_cache.put(f"sheet:{sheet_keys[sheet_name]}", processed_data)
+    await parse_cache.put(workbook_key, plan_sections)
+    return plan_sections
+
+upload_executor = None
+uploads_in_flight = 0
+
+def get_upload_executor():
+    """Return the shared upload process pool, creating it on first use"""
+    global upload_executor, upload_progress_queue
+    if upload_executor is None:
+        upload_progress_queue = POOL_CONTEXT.Queue()
+        upload_executor = ProcessPoolExecutor(
+            max_workers=UPLOAD_WORKERS,
+            mp_context=POOL_CONTEXT,
+            initializer=init_upload_worker,
+            initargs=(upload_progress_queue,)
+        )
+    return upload_executor
+
+def acquire_upload_slot():
+    """Admit an upload or reject it with a 503 when the queue is full.
+
+    At most ``UPLOAD_WORKERS`` uploads run at once and ``UPLOAD_QUEUE_LIMIT``
+    more may wait; beyond that the request is rejected with a Retry-After
+    header instead of queueing unboundedly. Pair with ``release_upload_slot``.
+    """
+    global uploads_in_flight
+    if uploads_in_flight >= max(UPLOAD_WORKERS, 1) + UPLOAD_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=503,
+            detail="Upload queue is full, please retry later",
+            headers={"Retry-After": str(UPLOAD_RETRY_AFTER_SECONDS)}
+        )
+    uploads_in_flight += 1
+
+def reserve_upload_slots(wanted):
+    """Take up to ``wanted`` more slots, only while they leave no upload waiting for a worker.
+
+    Returns how many were taken; give them back with ``release_upload_slot``.
+    """
+    global uploads_in_flight
+    taken = max(0, min(wanted, max(UPLOAD_WORKERS, 1) - uploads_in_flight))
+    uploads_in_flight += taken
+    return taken
+
+def release_upload_slot(count=1):
+    global uploads_in_flight
+    uploads_in_flight -= count
+
+async def run_in_upload_pool(func, *args):
+    """Run a CPU-bound upload stage in the process pool; the caller holds a slot"""
+    global upload_progress_queue
+    try:
+        if UPLOAD_WORKERS <= 0:
+            if upload_progress_queue is None:
+                upload_progress_queue = queue.SimpleQueue()
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_upload_executor(), func, *args)
+    except ExcelProcessingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+background_tasks = set()
+
+def spawn_background(coro):
+    """Run a coroutine after the response without letting the task be garbage collected"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def take_plan_images(plan_sections):
+    """Strip extracted image bytes out of processed sections.
+
+    The section image entries are reduced to lightweight references in
+    place. Returns {image_id: (format, data)} for ``store_plan_images``.
+    """
+    images = {}
+    for section in plan_sections.values():
+        for image in section.get('images') or []:
+            data = image.pop('data', None)
+            if isinstance(data, bytes):
+                images[image['image_id']] = (image['format'], data)
+    return images
+
+async def store_plan_images(plan_id, images):
+    """Store image bytes taken from a plan in the plan_images collection.
+
+    Images are keyed by content hash, so identical images across sheets and
+    plans are stored once; each keeps the plan_ids referencing it.
+    Returns the ids of the stored images.
+    """
+    for image_id, (fmt, data) in images.items():
+        await db.plan_images.update_one(
+            {"_id": image_id},
+            {
+                "$setOnInsert": {
+                    "data": data,
+                    "format": fmt,
+                    "size": len(data),
+                    "created_at": datetime.now(timezone.utc)
+                },
+                "$addToSet": {"plan_ids": plan_id}
+            },
+            upsert=True
+        )
+    return list(images)
+
+async def build_missing_renditions(image_ids):
+    """Transcode stored images that have no renditions yet, off the event loop.
+
+    Rendition bytes go to plan_image_renditions, one document per image and
+    variant, so a large original never outgrows its document; the image
+    keeps only their format, size and dimensions. An image that fails is skipped.
+    """
+    pending = await db.plan_images.find(
+        {"_id": {"$in": image_ids}, "renditions": {"$exists": False}}
+    ).to_list(None)
+    for image in pending:
+        try:
+            if UPLOAD_WORKERS <= 0:
+                result = await asyncio.to_thread(build_image_renditions, bytes(image['data']))
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(get_upload_executor(), build_image_renditions, bytes(image['data']))
+        except Exception as e:
+            logger.warning(f"Could not build renditions for image {image['_id']}: {e}")
+            result = {'renditions': {}}
+        try:
+            renditions = {}
+            for variant, rendition in result['renditions'].items():
+                await db.plan_image_renditions.update_one(
+                    {"_id": f"{image['_id']}:{variant}"},
+                    {"$set": {"image_id": image['_id'], "variant": variant, **rendition}},
+                    upsert=True
+                )
+                renditions[variant] = {key: value for key, value in rendition.items() if key != 'data'}
+            await db.plan_images.update_one({"_id": image['_id']}, {"$set": {**result, "renditions": renditions}})
+        except Exception as e:
+            logger.warning(f"Could not store renditions for image {image['_id']}: {e}")
+
+async def release_plan_images(plan_id):
+    """Drop a deleted plan's image references and images no plan uses any more"""
+    await db.plan_images.update_many({"plan_ids": plan_id}, {"$pull": {"plan_ids": plan_id}})
+    unused = [image['_id'] async for image in db.plan_images.find({"plan_ids": {"$size": 0}}, {"_id": 1})]
+    if unused:
+        await db.plan_image_renditions.delete_many({"image_id": {"$in": unused}})
+        await db.plan_images.delete_many({"_id": {"$in": unused}, "plan_ids": {"$size": 0}})
+
+# Columnar tables
+#
+# With TABLE_STORAGE=columnar, extracted tables are stored as {headers,
+# columns, row_count, position} instead of one dict per row repeating every
+# header. Each column takes the smallest of these forms:
+#   {"text": "v1\tv2..."}            string values joined by tabs, less any
+#                                    "prefix" and "suffix" common to the non-blank ones
+#   {"list": [v1, v2, ...]}           any values
+#   {"fill": v, "at": "3,17", "values": column}   rows differing from the most common value
+#   {"levels": column, "codes": "0a1..."}         distinct values and one code character per row
+# plus "missing": "i,j" for rows that lack the column's key. "keys" is
+# stored when the row keys differ from the headers. Responses carry row
+# dicts unless a client asks for ?tables=columnar.
+
+TABLE_CODE_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def is_columnar_table(table):
+    return isinstance(table, dict) and 'columns' in table and 'rows' not in table
+
+def encode_values(values):
+    if not all(isinstance(value, str) and '\t' not in value for value in values):
+        return {"list": list(values)}
+    filled = [value for value in values if value]
+    prefix = os.path.commonprefix(filled) if len(filled) > 1 else ''
+    suffix = os.path.commonprefix([value[len(prefix):][::-1] for value in filled])[::-1] if len(filled) > 1 else ''
+    # A value that is all prefix and suffix would read back as blank
+    if not (prefix or suffix) or any(len(value) == len(prefix) + len(suffix) for value in filled):
+        return {"text": '\t'.join(values)}
+    column = {"text": '\t'.join(value[len(prefix):len(value) - len(suffix)] for value in values)}
+    if prefix:
+        column["prefix"] = prefix
+    if suffix:
+        column["suffix"] = suffix
+    return column
+
+def decode_values(column):
+    if 'text' not in column:
+        return list(column['list'])
+    values = column['text'].split('\t')
+    prefix, suffix = column.get('prefix', ''), column.get('suffix', '')
+    if prefix or suffix:
+        values = [prefix + value + suffix if value else '' for value in values]
+    return values
+
+def encode_indices(indices):
+    return ','.join(map(str, indices))
+
+def decode_indices(text):
+    return [int(index) for index in text.split(',')] if text else []
+
+def encode_column(values, missing=()):
+    """Smallest encoding of a column's values (see above)"""
+    candidates = [encode_values(values)] if values else [{"text": ""}]
+    counts = Counter(orjson.dumps(value) for value in values)
+    if counts:
+        common, _ = counts.most_common(1)[0]
+        fill = orjson.loads(common)
+        at = [index for index, value in enumerate(values) if orjson.dumps(value) != common]
+        if len(at) < len(values) / 2:
+            candidates.append({"fill": fill, "at": encode_indices(at), "values": encode_values([values[i] for i in at])})
+        if len(counts) <= len(TABLE_CODE_DIGITS) and len(counts) < len(values) / 2:
+            codes = {level: TABLE_CODE_DIGITS[index] for index, level in enumerate(counts)}
+            candidates.append({
+                "levels": encode_values([orjson.loads(level) for level in counts]),
+                "codes": ''.join(codes[orjson.dumps(value)] for value in values)
+            })
+    column = min(candidates, key=lambda candidate: len(orjson.dumps(candidate)))
+    if missing:
+        column = {**column, "missing": encode_indices(missing)}
+    return column
+
+def decode_column(column, count):
+    """Values of an encoded column, one per row"""
+    if 'fill' in column:
+        values = [column['fill']] * count
+        for index, value in zip(decode_indices(column['at']), decode_values(column['values'])):
+            values[index] = value
+        return values
+    if 'levels' in column:
+        levels = dict(zip(TABLE_CODE_DIGITS, decode_values(column['levels'])))
+        return [levels[code] for code in column['codes']]
+    return decode_values(column)[:count] if count else []
+
+def encode_table(table):
+    """Columnar form of a table of row dicts; other tables are returned as they are"""
+    rows = table.get('rows') if isinstance(table, dict) else None
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        return table
+    keys = list(dict.fromkeys(key for row in rows for key in row))
+    columns = []
+    for key in keys:
+        missing = [index for index, row in enumerate(rows) if key not in row]
+        columns.append(encode_column([row.get(key, '') for row in rows], missing))
+    # The columns take the place of the rows, so the table's fields keep their order
+    encoded = {}
+    for name, value in table.items():
+        if name == 'rows':
+            encoded.update(columns=columns, row_count=len(rows))
+            if keys != table.get('headers'):
+                encoded['keys'] = keys
         else:
-            raise HTTPException(status_code=500, detail="Failed to save plan")
+            encoded[name] = value
+    return encoded
+
+def decode_table(table):
+    """Row-dict form of a columnar table; other tables are returned as they are"""
+    if not is_columnar_table(table):
+        return table
+    count = table.get('row_count') or 0
+    keys = table['keys'] if 'keys' in table else table.get('headers') or []
+    rows = [{} for _ in range(count)]
+    for key, column in zip(keys, table['columns']):
+        missing = set(decode_indices(column.get('missing', '')))
+        for index, value in enumerate(decode_column(column, count)):
+            if index not in missing:
+                rows[index][key] = value
+    decoded = {}
+    for name, value in table.items():
+        if name == 'columns':
+            decoded['rows'] = rows
+        elif name not in ('row_count', 'keys'):
+            decoded[name] = value
+    return decoded
+
+def table_rows(table):
+    """Row dicts of a table in either form"""
+    return decode_table(table).get('rows') or []
+
+def convert_section_tables(section, table_format):
+    """Put a section's tables in ``table_format`` ('rows' or 'columnar'), in place"""
+    if isinstance(section, dict) and isinstance(section.get('tables'), list):
+        convert = encode_table if table_format == 'columnar' else decode_table
+        section['tables'] = [convert(table) for table in section['tables']]
+    return section
+
+def convert_plan_tables(plan, table_format):
+    """Put the tables of every section of a plan in ``table_format``, in place"""
+    for key in plan_section_keys(plan):
+        convert_section_tables(plan[key], table_format)
+    return plan
+
+def check_table_format(tables):
+    if tables not in TABLE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"tables must be one of {', '.join(TABLE_FORMATS)}")
+
+def section_table_format(section):
+    """'columnar' when a stored section holds a columnar table, else None"""
+    tables = section.get('tables') if isinstance(section, dict) else None
+    return 'columnar' if isinstance(tables, list) and any(map(is_columnar_table, tables)) else None
+
+# Plan storage
+#
+# A plan is stored as a header in ``plans`` (ids, title, dates, revision,
+# section_counts and the ordered ``section_keys``) and one plan_sections
+# document per section, {plan_id, id, key, revision, version, table_format,
+# data}, so no plan document approaches Mongo's 16 MB limit and a section
+# is read or written without loading the rest of the plan. ``version``
+# counts the writes to a section and ``table_format`` is 'columnar' while
+# it holds columnar tables. Section documents are written
+# before the header they belong to, and a write bumps the header revision
+# only once its sections are in place, so a reader never sees a revision
+# whose sections have not landed yet. Plans stored before the split keep
+# their sections inline in the header until migrate_plan_sections or their
+# next write moves them out; readers handle both layouts.
+
+def split_plan_document(document):
+    """Header and plan_sections documents for a plan document"""
+    keys = plan_section_keys(document)
+    header = {key: value for key, value in document.items() if key not in keys}
+    header['section_keys'] = keys
+    sections = [
+        {"plan_id": document['plan_id'], "id": document['id'], "key": key, "revision": document.get('revision') or 0,
+         "version": 0, "table_format": section_table_format(document[key]), "data": document[key]}
+        for key in keys
+    ]
+    return header, sections
+
+def section_projection(projection, keys):
+    """The sections of ``keys`` a plans projection includes, and the plan_sections projection reading them.
+
+    Returns (None, ...) for all sections when the projection only excludes
+    fields, or ({}, None) when it includes fields but no section paths.
+    """
+    included = [path for path, flag in (projection or {}).items() if flag and path != '_id']
+    if not included:
+        return None, {"_id": 0, "key": 1, "data": 1}
+    wanted = {}
+    for path in included:
+        key, _, rest = path.partition('.')
+        if key in keys:
+            wanted.setdefault(key, []).append(f"data.{rest}" if rest else "data")
+    if not wanted:
+        return {}, None
+    doc_projection = {"_id": 0, "key": 1}
+    for paths in wanted.values():
+        doc_projection.update({path: 1 for path in paths})
+    return wanted, doc_projection
+
+async def load_plan_sections(plan, projection=None):
+    """Fill a header read from ``plans`` with its sections, in plan order.
+
+    ``projection`` is the one the header was read with; only the sections
+    and section paths it includes are read. Plans whose sections are still
+    stored inline are returned as they are.
+    """
+    keys = plan.pop('section_keys', None)
+    if keys is None:
+        return plan
+    wanted, doc_projection = section_projection(projection, keys)
+    if wanted == {}:
+        return plan
+    query = {"plan_id": plan['plan_id']}
+    if wanted is not None:
+        query["key"] = {"$in": list(wanted)}
+    sections = {}
+    async for doc in db.plan_sections.find(query, doc_projection):
+        sections[doc['key']] = doc.get('data', {})
+    for key in keys:
+        # A section missing here belongs to a write that has not finished
+        if key in sections:
+            plan[key] = sections[key]
+    return plan
+
+def with_section_keys(projection):
+    """A plans projection that also reads section_keys when it lists included fields"""
+    if projection and any(flag for path, flag in projection.items() if path != '_id'):
+        return {**projection, "section_keys": 1}
+    return projection
+
+async def find_plan(query, projection=PLAN_INTERNAL_PROJECTION, table_format='rows'):
+    """Read a plan with its sections reassembled and tables in ``table_format``, or None"""
+    plan = await db.plans.find_one(query, with_section_keys(projection))
+    if plan is not None:
+        await load_plan_sections(plan, projection)
+        convert_plan_tables(plan, table_format)
+    return plan
+
+async def insert_plan_documents(document):
+    """Store a new plan: its sections first, then the header that makes it visible.
+
+    Raises DuplicateKeyError when the plan_id or id is taken, after removing
+    any section documents this call stored.
+    """
+    header, sections = split_plan_document(document)
+    try:
+        if sections:
+            await db.plan_sections.insert_many(sections)
+        return await db.plans.insert_one(header)
+    except (BulkWriteError, DuplicateKeyError, DocumentTooLarge) as e:
+        await discard_plan_sections([document])
+        errors = e.details.get('writeErrors', []) if isinstance(e, BulkWriteError) else []
+        if errors and errors[0].get('code') == 11000:
+            raise DuplicateKeyError(errors[0].get('errmsg', "Duplicate plan section"))
+        raise
+
+# Largest section PUT accepts: the BSON limit, less room for the section document's other fields
+PLAN_SECTION_MAX_BYTES = 16 * 1024 * 1024 - 64 * 1024
+
+def section_too_large():
+    return HTTPException(status_code=413, detail="A plan section is larger than MongoDB's 16 MB document limit")
+
+async def split_stored_plan(plan_id):
+    """Move the inline sections of a plan stored before the split into plan_sections.
+
+    Returns False if there is no such plan. The header is only rewritten
+    while the plan is unchanged; a concurrent write makes the copy run again.
+    """
+    copied = False
+    while True:
+        plan = await db.plans.find_one({"plan_id": plan_id}, {"_id": 0})
+        if plan is None:
+            if copied:
+                await db.plan_sections.delete_many({"plan_id": plan_id})
+            return False
+        if 'section_keys' in plan:
+            return True
+        header, sections = split_plan_document(plan)
+        for section in sections:
+            await db.plan_sections.update_one(
+                {"plan_id": plan_id, "key": section['key']}, {"$set": section}, upsert=True
+            )
+        copied = True
+        result = await db.plans.update_one(
+            {"plan_id": plan_id, "revision": plan.get('revision'), "section_keys": {"$exists": False}},
+            {"$set": {"section_keys": header['section_keys']},
+             **({"$unset": {key: "" for key in header['section_keys']}} if sections else {})}
+        )
+        if result.matched_count:
+            return True
+
+async def migrate_plan_sections(dry_run=False):
+    """Split every plan still stored as a single document; returns how many there were"""
+    plan_ids = [
+        plan['plan_id']
+        async for plan in db.plans.find({"section_keys": {"$exists": False}}, {"_id": 0, "plan_id": 1})
+    ]
+    if dry_run:
+        return len(plan_ids)
+    for index, plan_id in enumerate(plan_ids, 1):
+        await split_stored_plan(plan_id)
+        if index % 100 == 0:
+            logger.info(f"Split sections of {index}/{len(plan_ids)} plans")
+    return len(plan_ids)
+
+async def writable_plan(plan_id, query, if_match):
+    """Header of the plan a write applies to, its sections split out first if still inline.
+
+    ``query`` is the plan's filter, narrowed by If-Match (None when If-Match
+    lists no ETag of this plan). Raises 404 or 409 when it matches nothing.
+    """
+    while True:
+        plan = None
+        if query is not None:
+            plan = await db.plans.find_one(query, {"_id": 0, "id": 1, "revision": 1, "section_keys": 1})
+        if plan is None:
+            if if_match is not None and await db.plans.find_one({"plan_id": plan_id}, {"_id": 1}):
+                raise HTTPException(status_code=409, detail="Plan was changed by someone else; reload it and try again")
+            raise HTTPException(status_code=404, detail="Plan not found")
+        if 'section_keys' in plan:
+            return plan
+        await split_stored_plan(plan_id)
+
+def apply_plan_operation(section, operation):
+    """Apply a PATCH operation to a section whose tables hold row dicts, in place.
+
+    Mirrors the updates plan_operation_steps builds; returns False when the
+    addressed table or row does not exist.
+    """
+    if operation.op == 'append_content':
+        section.setdefault('content', []).append(operation.value)
+        return True
+    tables = section.get('tables')
+    if not isinstance(tables, list) or operation.table >= len(tables) or not isinstance(tables[operation.table], dict):
+        return False
+    table = tables[operation.table]
+    if operation.op == 'insert_row':
+        rows = table.setdefault('rows', [])
+        position = len(rows) if operation.row is None else operation.row
+        if position > len(rows):
+            return False
+        rows.insert(position, operation.value)
+        return True
+    rows = table.get('rows')
+    if not isinstance(rows, list) or operation.row >= len(rows):
+        return False
+    if operation.op == 'delete_row':
+        del rows[operation.row]
+    elif operation.op == 'set_row':
+        rows[operation.row] = operation.value
+    elif not isinstance(rows[operation.row], dict):
+        return False
+    else:
+        rows[operation.row][operation.column] = operation.value
+    return True
+
+async def rewrite_plan_section(plan_id, key, operations, revision, guarded):
+    """Apply PATCH operations to a section holding columnar tables by rewriting it.
+
+    Columnar tables have no per-row paths to update, so the section is read,
+    its tables decoded, edited as row dicts and encoded again. The write
+    only lands while the section's version is unchanged and is retried
+    when another write got in first. ``guarded`` applies the If-Match check
+    against ``revision`` as for targeted updates. Returns (outcome,
+    section count increments), outcome being 'applied', 'conflict' or
+    'invalid'.
+    """
+    query = {"plan_id": plan_id, "key": key}
+    if guarded:
+        query["revision"] = {"$lte": revision}
+    for attempt in range(SECTION_REWRITE_ATTEMPTS):
+        doc = await db.plan_sections.find_one(query, {"_id": 0, "data": 1, "version": 1})
+        if doc is None:
+            newer = guarded and await db.plan_sections.find_one({"plan_id": plan_id, "key": key}, {"_id": 1})
+            return ('conflict' if newer else 'invalid'), {}
+        section = doc.get('data')
+        if not isinstance(section, dict):
+            return 'invalid', {}
+        convert_section_tables(section, 'rows')
+        if not all(apply_plan_operation(section, operation) for operation in operations):
+            return 'invalid', {}
+        convert_section_tables(section, 'columnar')
+        written = await write_plan_section(
+            {"plan_id": plan_id, "key": key, "version": doc.get('version')},
+            {"$set": {"data": section, "table_format": section_table_format(section)},
+             "$inc": {"version": 1}, "$max": {"revision": revision + 1}}
+        )
+        if written:
+            added = sum(operation.op == 'append_content' for operation in operations)
+            return 'applied', {f"section_counts.{key}.content": added} if added else {}
+    return 'conflict', {}
+
+async def write_plan_section(query, update, upsert=False):
+    """Update one plan_sections document; False if none matched (or an upsert met a newer one)"""
+    try:
+        result = await db.plan_sections.update_one(query, update, upsert=upsert)
+    except DuplicateKeyError:
+        return False
+    except (DocumentTooLarge, OperationFailure) as e:
+        # 10334 and 17419: the document would outgrow the limit
+        if isinstance(e, DocumentTooLarge) or e.code in (10334, 17419):
+            raise section_too_large()
+        raise
+    return bool(result.matched_count or result.upserted_id is not None)
+
+def plan_document(plan_obj):
+    """Mongo document for a new plan, with its sections still inline"""
+    with timed_stage('build_document'):
+        plan_mongo = plan_obj.dict()
+        plan_mongo['section_counts'] = count_plan_sections(plan_mongo)
+    return plan_mongo
+
+def renew_plan_ids(plan_obj):
+    logger.warning(f"Plan id {plan_obj.plan_id} is taken, retrying with a new one")
+    plan_obj.plan_id = generate_plan_id()
+    plan_obj.id = str(uuid.uuid4())
+
+async def insert_plan(plan_obj):
+    """Insert a new plan, drawing fresh ids if the generated ones are taken"""
+    for attempt in range(PLAN_ID_ATTEMPTS):
+        document = plan_document(plan_obj)
+        try:
+            with timed_stage('insert_plan'):
+                result = await insert_plan_documents(document)
+        except DuplicateKeyError:
+            renew_plan_ids(plan_obj)
+            continue
+        except DocumentTooLarge:
+            raise section_too_large()
+        if not result.inserted_id:
+            break
+        update_search_index(document['plan_id'])
+        return plan_obj
+    raise HTTPException(status_code=500, detail="Failed to save plan")
+
+async def save_uploaded_plan(title, plan_sections):
+    """Build and insert a plan from processed workbook sections"""
+    images = take_plan_images(plan_sections)
+    plan_obj = await insert_plan(ProjectPlan(title=title, **plan_sections))
+    
+    # Images are attached once the plan id is known to be unique
+    with timed_stage('store_images'):
+        image_ids = await store_plan_images(plan_obj.plan_id, images)
+    if image_ids:
+        # Thumbnails are built after the response; originals are served until then
+        spawn_background(build_missing_renditions(image_ids))
+    return plan_obj
+
+async def insert_plans(plan_objs):
+    """Insert new plans with one insert_many of their sections and one of their headers.
+
+    Plans whose generated ids turn out to be taken are retried one by one
+    with fresh ids. Returns an error message (or None) per plan.
+    """
+    documents = [plan_document(plan_obj) for plan_obj in plan_objs]
+    headers, sections, owners = [], [], []
+    for index, document in enumerate(documents):
+        header, plan_sections = split_plan_document(document)
+        headers.append(header)
+        sections.extend(plan_sections)
+        owners.extend([index] * len(plan_sections))
+    
+    write_errors = {}
+    try:
+        if sections:
+            await db.plan_sections.insert_many(sections, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get('writeErrors', []):
+            write_errors.setdefault(owners[error['index']], error)
+    except DocumentTooLarge:
+        # pymongo rejects the whole batch; find the plans at fault one at a time
+        await discard_plan_sections(documents)
+        return [await insert_plan_or_error(plan_obj) for plan_obj in plan_objs]
+    
+    pending = [index for index in range(len(documents)) if index not in write_errors]
+    try:
+        if pending:
+            await db.plans.insert_many([headers[index] for index in pending], ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get('writeErrors', []):
+            write_errors[pending[error['index']]] = error
+    if write_errors:
+        await discard_plan_sections([documents[index] for index in write_errors])
+    
+    errors = []
+    for index, plan_obj in enumerate(plan_objs):
+        error = write_errors.get(index)
+        if error is None:
+            update_search_index(documents[index]['plan_id'])
+            errors.append(None)
+        elif error.get('code') == 11000:
+            renew_plan_ids(plan_obj)
+            errors.append(await insert_plan_or_error(plan_obj))
+        else:
+            errors.append(error.get('errmsg', "Failed to save plan"))
+    return errors
+
+async def insert_plan_or_error(plan_obj):
+    """insert_plan, returning its error message instead of raising (None once stored)"""
+    try:
+        await insert_plan(plan_obj)
+    except HTTPException as e:
+        return e.detail
+    return None
+
+async def discard_plan_sections(documents):
+    """Remove section documents stored for new plans whose headers were not inserted"""
+    await db.plan_sections.delete_many({
+        "plan_id": {"$in": [document['plan_id'] for document in documents]},
+        "id": {"$in": [document['id'] for document in documents]}
+    })
+
+def list_import_workbooks(files):
+    """Expand a batch upload into one manifest entry and reader per workbook.
+
+    Zip archives are read member by member from the spooled upload; other
+    files are taken as workbooks. Returns (results, sources): the manifest
+    in upload order, with files that cannot be imported already failed, and
+    (entry, read) pairs where ``read`` returns the workbook bytes.
+    """
+    results = []
+    sources = []
+    for upload in files:
+        if upload.filename.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(upload.file)
+            except zipfile.BadZipFile:
+                results.append(ImportFileResult(filename=upload.filename, status='failed', error="Not a valid zip archive"))
+                continue
+            for info in archive.infolist():
+                name = PurePosixPath(info.filename).name
+                if (info.is_dir() or info.filename.startswith('__MACOSX/') or name.startswith(('~$', '.'))
+                        or not name.lower().endswith(('.xlsx', '.xls'))):
+                    continue
+                entry = ImportFileResult(filename=f"{upload.filename}/{info.filename}")
+                results.append(entry)
+                if info.file_size > IMPORT_MAX_WORKBOOK_BYTES:
+                    entry.status = 'failed'
+                    entry.error = f"Workbook is larger than {IMPORT_MAX_WORKBOOK_BYTES // (1024 * 1024)} MB"
+                    continue
+                sources.append((entry, partial(archive.read, info)))
+        elif upload.filename.lower().endswith(('.xlsx', '.xls')):
+            entry = ImportFileResult(filename=upload.filename)
+            results.append(entry)
+            sources.append((entry, upload.file.read))
+        else:
+            results.append(ImportFileResult(
+                filename=upload.filename, status='failed',
+                error="File must be an Excel file (.xlsx or .xls) or a zip archive of them"
+            ))
+    return results, sources
+
+async def import_workbooks(sources):
+    """Parse workbooks concurrently in the upload pool and insert their plans in batches.
+
+    The caller holds one upload slot. Each further concurrent parse takes
+    a slot of its own, and only from workers no other upload is using.
+    """
+    extra_slots = reserve_upload_slots(min(IMPORT_CONCURRENCY, len(sources)) - 1)
+    try:
+        await import_workbooks_in(sources, 1 + extra_slots)
+    finally:
+        release_upload_slot(extra_slots)
+
+async def import_workbooks_in(sources, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    flush_lock = asyncio.Lock()
+    pending = []
+    
+    async def flush():
+        async with flush_lock:
+            batch = pending[:]
+            pending.clear()
+            if not batch:
+                return
+            try:
+                errors = await insert_plans([plan_obj for _, plan_obj, _ in batch])
+            except Exception as e:
+                logger.error(f"Error saving a batch of {len(batch)} imported plans: {e}")
+                for entry, _, _ in batch:
+                    entry.status, entry.error = 'failed', f"Failed to save plan: {e}"
+                return
+            image_ids = []
+            for (entry, plan_obj, images), error in zip(batch, errors):
+                if error:
+                    entry.status, entry.error = 'failed', error
+                    continue
+                entry.status, entry.plan_id, entry.id = 'imported', plan_obj.plan_id, plan_obj.id
+                try:
+                    image_ids.extend(await store_plan_images(plan_obj.plan_id, images))
+                except Exception as e:
+                    # The plan is saved; only its images are missing
+                    logger.error(f"Error storing images of imported plan {plan_obj.plan_id}: {e}")
+                    entry.error = f"Plan saved without its images: {e}"
+            if image_ids:
+                spawn_background(build_missing_renditions(image_ids))
+    
+    async def import_one(entry, read):
+        async with semaphore:
+            try:
+                content = await asyncio.to_thread(read)
+                plan_sections = await parse_upload(content)
+                images = take_plan_images(plan_sections)
+                plan_obj = ProjectPlan(title=PurePosixPath(entry.filename).stem, **plan_sections)
+            except HTTPException as e:
+                entry.status, entry.error = 'failed', str(e.detail)
+                return
+            except Exception as e:
+                logger.error(f"Error importing {entry.filename}: {e}")
+                entry.status, entry.error = 'failed', f"Error processing Excel file: {e}"
+                return
+        pending.append((entry, plan_obj, images))
+        if len(pending) >= IMPORT_BATCH_SIZE:
+            await flush()
+    
+    await asyncio.gather(*(import_one(entry, read) for entry, read in sources))
+    await flush()
+
+# Export
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def export_cell(value):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        value = str(value)
+    return ILLEGAL_CHARACTERS_RE.sub('', value)
+
+def export_sheet_title(section_key, section, used):
+    """Excel-safe, unique sheet title for a section, preferring its original sheet name"""
+    title = (section.get('metadata') or {}).get('sheet_name') or section_key.replace('_', ' ').title()
+    title = re.sub(r'[\[\]:*?/\\]', ' ', title).strip("' ")[:31] or 'Sheet'
+    candidate, number = title, 2
+    while candidate.lower() in used:
+        suffix = f" ({number})"
+        candidate, number = title[:31 - len(suffix)] + suffix, number + 1
+    used.add(candidate.lower())
+    return candidate
+
+def iter_section_rows(section):
+    """Rebuild sheet rows from a section's content and tables.
+
+    Items are written at their original row positions where known; rows
+    dropped while parsing (blank rows) come back as blank rows.
+    """
+    tables = section.get('tables') or []
+    for item in section.get('content') or []:
+        if item.get('type') == 'table':
+            index = item.get('table_index')
+            if not isinstance(index, int) or not 0 <= index < len(tables):
+                continue
+            table = tables[index]
+            headers = table.get('headers') or []
+            yield table.get('position', item.get('position')), [export_cell(header) for header in headers]
+            for row in table_rows(table):
+                yield None, [export_cell(row.get(header)) for header in headers]
+        elif item.get('type') == 'section':
+            for sub_item in item.get('content') or []:
+                yield from iter_section_rows({'content': [sub_item]})
+        elif isinstance(item.get('content'), list):
+            yield item.get('position'), [export_cell(cell) for cell in item['content']]
+        else:
+            yield item.get('position'), [export_cell(item.get('content'))]
+
+def write_plan_workbook(plan, images, fileobj):
+    """Write a plan as an .xlsx workbook to ``fileobj`` using openpyxl's write-only mode.
+
+    ``images`` maps image ids to their original bytes. Sheet rows are
+    written straight to temporary files, so memory does not grow with the
+    size of the plan.
+    """
+    workbook = Workbook(write_only=True)
+    used_titles = set()
+    keys = [key for key in ProjectPlan.model_fields if key not in PLAN_FIELDS]
+    keys += [key for key in plan if key not in keys and key not in PLAN_FIELDS and key not in PLAN_INTERNAL_FIELDS]
+    for key in keys:
+        section = plan.get(key)
+        if not isinstance(section, dict) or not section:
+            continue
+        sheet = workbook.create_sheet(export_sheet_title(key, section, used_titles))
+        row_number = 0
+        for position, cells in iter_section_rows(section):
+            if isinstance(position, int):
+                while row_number < position:
+                    sheet.append([])
+                    row_number += 1
+            sheet.append(cells)
+            row_number += 1
+        for image in section.get('images') or []:
+            data = images.get(image.get('image_id'))
+            if data is None and isinstance(image.get('data'), str):
+                data = base64.b64decode(image['data'])  # plans saved with inline images
+            if data:
+                sheet.add_image(WorkbookImage(io.BytesIO(data)), image.get('anchor') or 'A1')
+    if not workbook.worksheets:
+        workbook.create_sheet(export_sheet_title('title_sheet', {}, used_titles))
+    workbook.save(fileobj)
+
+async def load_plan_export(plan_id):
+    """Read a plan and the original bytes of its images, or None if there is no such plan"""
+    plan = await find_plan({"plan_id": plan_id})
+    if plan is None:
+        return None
+    image_ids = [
+        image['image_id']
+        for section in plan.values() if isinstance(section, dict)
+        for image in section.get('images') or [] if image.get('image_id')
+    ]
+    images = {}
+    if image_ids:
+        async for image in db.plan_images.find({"_id": {"$in": image_ids}}, {"data": 1}):
+            images[image['_id']] = bytes(image['data'])
+    return plan, images
+
+def export_archive_name(plan, used):
+    title = ' '.join(re.sub(r'[^\w\- ]+', ' ', plan.get('title') or '').split())[:80]
+    name = f"{plan['plan_id']} - {title}.xlsx" if title else f"{plan['plan_id']}.xlsx"
+    while name in used:
+        name = name[:-5] + ' (copy).xlsx'
+    used.add(name)
+    return name
+
+def write_plans_archive(plan_ids, load_export, fileobj):
+    """Write a zip of one workbook per plan, loading each plan only when it is written"""
+    used = set()
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for plan_id in plan_ids:
+            export = load_export(plan_id)
+            if export is None:
+                continue
+            plan, images = export
+            with archive.open(export_archive_name(plan, used), 'w', force_zip64=True) as entry:
+                write_plan_workbook(plan, images, entry)
+
+class ChunkWriter:
+    """Unseekable file object handing written bytes to a queue in chunks"""
+
+    def __init__(self, chunks, chunk_size=64 * 1024):
+        self.chunks = chunks
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.cancelled = False
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.cancelled:
+            raise ConnectionAbortedError("Client went away")
+        if self.buffer:
+            self.chunks.put(bytes(self.buffer))
+            self.buffer.clear()
+
+async def stream_from_thread(write):
+    """Run ``write(fileobj)`` in a thread and yield what it writes as it is produced.
+
+    The queue between them is bounded, so a slow client pauses the writer
+    instead of letting the output pile up in memory. The writer gets its own
+    thread rather than one from the default executor, which the reads of
+    this loop (and of concurrent exports) use.
+    """
+    chunks = queue.Queue(maxsize=16)
+    writer = ChunkWriter(chunks)
+    done = object()
+    
+    def run():
+        try:
+            write(writer)
+            writer.flush()
+            chunks.put(done)
+        except BaseException as e:
+            chunks.put(e)
+    
+    thread = threading.Thread(target=run, name="export-writer", daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = await asyncio.to_thread(chunks.get)
+            if chunk is done:
+                break
+            if isinstance(chunk, BaseException):
+                logger.error(f"Export failed: {chunk}")
+                raise chunk
+            yield chunk
+    finally:
+        # Stop a writer whose client went away, unblocking it if the queue is full
+        writer.cancelled = True
+        while thread.is_alive():
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                await asyncio.sleep(0.01)
+
+# Search
+
+# plan_search holds one entry per plan section with its paragraph, row and
+# table row text, plus one entry per plan (section None) with the title and
+# the plan revision the entries were built from. Mongo's text index on
+# ``text`` serves GET /api/search.
+
+def search_line(value):
+    """One line of searchable text from a paragraph, row or table row"""
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return ' | '.join(str(cell).strip() for cell in value if cell is not None and str(cell).strip())
+    return str(value).strip() if value is not None else ''
+
+def section_search_lines(section):
+    """Text lines of a section to index: paragraphs, content rows and table rows"""
+    items = []
+    for item in section.get('content') or []:
+        if isinstance(item, dict) and item.get('type') == 'section':
+            items.extend(item.get('content') or [])
+        else:
+            items.append(item)
+    
+    values = [item.get('content') for item in items if isinstance(item, dict) and item.get('type') in ('paragraph', 'row')]
+    for table in section.get('tables') or []:
+        if isinstance(table, dict):
+            values.append(table.get('headers'))
+            values.extend(table_rows(table))
+    return [line for line in map(search_line, values) if line]
+
+def plan_section_keys(plan):
+    return [
+        key for key, section in plan.items()
+        if key not in PLAN_FIELDS and key not in PLAN_INTERNAL_FIELDS and isinstance(section, dict)
+    ]
+
+async def index_plan_search(plan, sections=None):
+    """Rebuild a plan's search entries for ``sections`` (default: all) and its title entry"""
+    plan_id, title = plan['plan_id'], plan.get('title') or ''
+    if sections is None:
+        sections = plan_section_keys(plan)
+        stale = {"plan_id": plan_id, "section": {"$ne": None}}
+    else:
+        stale = {"plan_id": plan_id, "section": {"$in": list(sections)}}
+    
+    entries = []
+    for key in sections:
+        lines = section_search_lines(plan.get(key) or {})
+        if lines:
+            entries.append({"plan_id": plan_id, "section": key, "title": title, "text": lines})
+    
+    await db.plan_search.delete_many(stale)
+    if entries:
+        await db.plan_search.insert_many(entries)
+    await db.plan_search.update_many({"plan_id": plan_id, "section": {"$ne": None}}, {"$set": {"title": title}})
+    # Written last: a revision behind the plan's marks entries for sync_search_index to rebuild
+    await db.plan_search.update_one(
+        {"plan_id": plan_id, "section": None},
+        {"$set": {"title": title, "text": [title], "revision": plan.get('revision', 0)}},
+        upsert=True
+    )
+
+# Sections of each plan waiting to be indexed (None: all), and plans being indexed
+search_index_pending = {}
+search_index_running = set()
+
+def update_search_index(plan_id, sections=None):
+    """Index a written plan's ``sections`` (default: all) in the background.
+
+    Requests for a plan are merged and indexed one at a time from the plan
+    as then stored, so the write that asked is not held up. Failures are
+    logged and left to sync_search_index.
+    """
+    if sections is not None:
+        sections = set(sections)
+    if plan_id in search_index_pending:
+        pending = search_index_pending[plan_id]
+        sections = None if sections is None or pending is None else pending | sections
+    search_index_pending[plan_id] = sections
+    if plan_id not in search_index_running:
+        search_index_running.add(plan_id)
+        spawn_background(index_pending_search(plan_id))
+
+async def index_pending_search(plan_id):
+    try:
+        while plan_id in search_index_pending:
+            sections = search_index_pending.pop(plan_id)
+            projection = PLAN_INTERNAL_PROJECTION
+            if sections is not None:
+                projection = {"_id": 0, "plan_id": 1, "title": 1, "revision": 1, **{key: 1 for key in sections}}
+            try:
+                plan = await find_plan({"plan_id": plan_id}, projection)
+                if plan is not None:
+                    await index_plan_search(plan, sections)
+            except Exception as e:
+                logger.warning(f"Could not update search index for plan {plan_id}: {e}")
+    finally:
+        search_index_running.discard(plan_id)
+
+async def remove_from_search_index(plan_id):
+    search_index_pending.pop(plan_id, None)
+    try:
+        await db.plan_search.delete_many({"plan_id": plan_id})
+    except Exception as e:
+        logger.warning(f"Could not remove plan {plan_id} from the search index: {e}")
+
+async def sync_search_index():
+    """Index plans whose search entries are missing or behind, and drop entries of deleted plans"""
+    indexed = {}
+    async for entry in db.plan_search.find({"section": None}, {"_id": 0, "plan_id": 1, "revision": 1}):
+        indexed[entry['plan_id']] = entry.get('revision')
+    
+    stale = []
+    async for plan in db.plans.find({}, {"_id": 0, "plan_id": 1, "revision": 1}):
+        if indexed.pop(plan['plan_id'], None) != plan.get('revision', 0):
+            stale.append(plan['plan_id'])
+    
+    for plan_id in stale:
+        plan = await find_plan({"plan_id": plan_id})
+        if plan is not None:
+            await index_plan_search(plan)
+    if indexed:
+        await db.plan_search.delete_many({"plan_id": {"$in": list(indexed)}})
+    if stale or indexed:
+        logger.info(f"Search index: rebuilt {len(stale)} plans, removed {len(indexed)} deleted plans")
+
+def search_terms(q):
+    """Words of a text search query, leaving out -excluded words"""
+    return [word for word in re.findall(r'(?<![\w-])-?\w+', q) if not word.startswith('-')]
+
+def search_snippet(lines, terms):
+    """Window of the first line mentioning a query word, or the start of the text"""
+    if not lines:
+        return ''
+    # Words are matched on their start, as Mongo's stemming would ("risks" finds "risk")
+    stems = [re.escape(term[:-1] if len(term) > 3 and term.lower().endswith('s') else term) for term in terms]
+    pattern = re.compile(r'\b(?:' + '|'.join(stems) + ')', re.IGNORECASE) if stems else None
+    line, start = lines[0], 0
+    for candidate in lines:
+        match = pattern.search(candidate) if pattern else None
+        if match:
+            line, start = candidate, max(0, match.start() - SEARCH_SNIPPET_CHARS // 4)
+            break
+    end = start + SEARCH_SNIPPET_CHARS
+    return ('…' if start else '') + line[start:end].strip() + ('…' if end < len(line) else '')
+
+# Background upload jobs
+
+upload_progress_task = None
+
+async def update_upload_job(job_id, **fields):
+    now = datetime.now(timezone.utc)
+    fields.update(updated_at=now, heartbeat_at=now)
+    await db.upload_jobs.update_one({"job_id": job_id}, {"$set": fields})
+
+async def drain_upload_progress():
+    """Copy per-sheet progress reported by pool workers into the job documents"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            job_id, sheet_name, sheets_total = await loop.run_in_executor(
+                None, upload_progress_queue.get, True, 1.0
+            )
+        except queue.Empty:
+            continue
+        try:
+            now = datetime.now(timezone.utc)
+            await db.upload_jobs.update_one(
+                {"job_id": job_id},
+                {
+                    "$set": {"sheets_total": sheets_total, "updated_at": now, "heartbeat_at": now},
+                    "$push": {"sheets_done": sheet_name}
+                }
+            )
+        except Exception as e:
+            logger.warning(f"Could not record progress for upload job {job_id}: {e}")
+
+async def heartbeat_upload_job(job_id):
+    """Keep a running job from being considered stale while a sheet takes long"""
+    while True:
+        await asyncio.sleep(max(UPLOAD_JOB_STALE_SECONDS / 4, 1))
+        await db.upload_jobs.update_one(
+            {"job_id": job_id},
+            {"$set": {"heartbeat_at": datetime.now(timezone.utc)}}
+        )
+
+async def record_inline_progress(job_id):
+    """Inline mode: record the progress a job queued locally while the loop was busy.
+
+    Items of other jobs, whose parse finished but who have not drained yet,
+    are put back for them.
+    """
+    others = []
+    while not upload_progress_queue.empty():
+        item = upload_progress_queue.get()
+        if item[0] != job_id:
+            others.append(item)
+            continue
+        _, sheet_name, sheets_total = item
+        await db.upload_jobs.update_one(
+            {"job_id": job_id},
+            {"$set": {"sheets_total": sheets_total}, "$push": {"sheets_done": sheet_name}}
+        )
+    for item in others:
+        upload_progress_queue.put(item)
+
+async def run_upload_job(job_id, title, content, profile=False):
+    """Process an upload in the background and record the outcome on its job"""
+    global upload_progress_task
+    heartbeat = asyncio.create_task(heartbeat_upload_job(job_id))
+    try:
+        await update_upload_job(job_id, state='running')
+        if upload_progress_task is None and UPLOAD_WORKERS > 0:
+            get_upload_executor()
+            upload_progress_task = asyncio.create_task(drain_upload_progress())
+        try:
+            plan_sections = await parse_upload(content, job_id, profile)
+        finally:
+            if UPLOAD_WORKERS <= 0:
+                await record_inline_progress(job_id)
+        plan_obj = await save_uploaded_plan(title, plan_sections)
+        await update_upload_job(job_id, state='completed', plan_id=plan_obj.plan_id, id=plan_obj.id)
+    except HTTPException as e:
+        logger.error(f"Upload job {job_id} failed: {e.detail}")
+        await update_upload_job(job_id, state='failed', error=str(e.detail))
+    except Exception as e:
+        logger.error(f"Upload job {job_id} failed: {e}")
+        await update_upload_job(job_id, state='failed', error=f"Error uploading plan: {e}")
+    finally:
+        heartbeat.cancel()
+        release_upload_slot()
+
+async def fail_stale_upload_jobs(query=None):
+    """Fail queued/running jobs whose worker stopped reporting (e.g. after a restart)"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=UPLOAD_JOB_STALE_SECONDS)
+    stale = {
+        "state": {"$in": ["queued", "running"]},
+        "heartbeat_at": {"$lt": cutoff},
+        **(query or {})
+    }
+    now = datetime.now(timezone.utc)
+    await db.upload_jobs.update_many(
+        stale,
+        {"$set": {"state": "failed", "error": "Upload was interrupted before it finished", "updated_at": now}}
+    )
+
+# Indexes
+
+# Declared indexes per collection; ensure_indexes creates missing ones and
+# rebuilds any whose keys or options have drifted from these definitions
+INDEXES = {
+    'plans': [
+        IndexModel([("plan_id", ASCENDING)], name="plan_id_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING), ("plan_id", DESCENDING)], name="created_at_plan_id"),
+        IndexModel([("updated_at", DESCENDING)], name="updated_at"),
+    ],
+    'plan_images': [
+        IndexModel([("plan_ids", ASCENDING)], name="plan_ids"),
+    ],
+    'plan_image_renditions': [
+        IndexModel([("image_id", ASCENDING)], name="image_id"),
+    ],
+    'upload_jobs': [
+        IndexModel([("job_id", ASCENDING)], name="job_id_unique", unique=True),
+        IndexModel([("state", ASCENDING), ("heartbeat_at", ASCENDING)], name="state_heartbeat_at"),
+    ],
+    'parse_cache': [
+        IndexModel([("last_used", ASCENDING)], name="last_used"),
+    ],
+    'plan_sections': [
+        IndexModel([("plan_id", ASCENDING), ("key", ASCENDING)], name="plan_id_key_unique", unique=True),
+    ],
+    'plan_search': [
+        IndexModel([("text", TEXT)], name="text"),
+        IndexModel([("plan_id", ASCENDING), ("section", ASCENDING)], name="plan_id_section"),
+    ],
+}
+
+def index_spec(options):
+    """Keys and the options that matter when comparing an existing index to a declared one"""
+    keys = options['key']
+    keys = list(keys.items() if isinstance(keys, dict) else keys)
+    if keys and tuple(keys[0]) == ('_fts', 'text'):
+        # Mongo reports text indexes by their internal keys; the fields are in the weights
+        keys = [(field, 'text') for field in sorted(options.get('weights', {}))]
+    keys = [(field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in keys]
+    return keys, bool(options.get('unique', False))
+
+async def ensure_indexes():
+    """Create declared indexes and reconcile existing ones with their definitions"""
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        missing = []
+        for index in indexes:
+            wanted = index.document
+            spec = index_spec(wanted)
+            current = existing.get(wanted['name'])
+            if current is not None and index_spec(current) == spec:
+                continue
+            # Drop an outdated definition, or an index on the same keys under another name
+            for name, options in list(existing.items()):
+                if name == wanted['name'] or (name != '_id_' and index_spec(options)[0] == spec[0]):
+                    logger.info(f"Dropping index {collection_name}.{name} to match its declared definition")
+                    await collection.drop_index(name)
+                    del existing[name]
+            missing.append(index)
+        for index in missing:
+            try:
+                await collection.create_indexes([index])
+                logger.info(f"Created index {collection_name}.{index.document['name']}")
+            except OperationFailure as e:
+                # e.g. existing duplicate plan_ids block a unique index; keep serving
+                logger.error(f"Could not create index {collection_name}.{index.document['name']}: {e}")
+
+async def migrate_datetime_fields():
+    """Convert datetimes that older documents stored as ISO strings to BSON dates.
+
+    Mongo orders and compares values of different types separately, so the
+    plan listing needs created_at to be a date on every plan.
+    """
+    for collection_name, fields in DATETIME_FIELDS.items():
+        collection = db[collection_name]
+        legacy = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        migrated = 0
+        async for doc in collection.find(legacy, {field: 1 for field in fields}):
+            update = {
+                field: datetime.fromisoformat(doc[field].replace('Z', '+00:00'))
+                for field in fields if isinstance(doc.get(field), str)
+            }
+            await collection.update_one({"_id": doc['_id']}, {"$set": update})
+            migrated += 1
+        if migrated:
+            logger.info(f"Converted string datetimes to dates on {migrated} {collection_name} documents")
+
+# API Routes
+
+@api_router.get("/")
+async def root():
+    return {"message": "Project Plan Management API"}
+
+@api_router.post("/plans", response_model=ProjectPlan)
+async def create_plan(plan_data: ProjectPlanCreate):
+    """Create a new project plan"""
+    plan_dict = plan_data.dict()
+    
+    # Initialize with empty structured sections for manual plans
+    for section_key in ['title_sheet', 'revision_history', 'definitions_references', 
+                       'project_introduction', 'resource_plan', 'pmc_objectives',
+                       'quality_management', 'dar_tailoring', 'risk_management',
+                       'opportunity_management', 'configuration_management',
+                       'deliverables', 'skill_matrix', 'supplier_management']:
+        plan_dict[section_key] = {
+            'content': [],
+            'tables': [],
+            'images': [],
+            'metadata': {'sheet_name': section_key.replace('_', ' ').title(), 'manual_creation': True}
+        }
+    
+    return await insert_plan(ProjectPlan(**plan_dict))
+
+def profile_requested(x_profile):
+    """Whether an upload asked to be profiled and profiling is enabled"""
+    return UPLOAD_PROFILING and (x_profile or '').lower() in ('1', 'true', 'yes')
+
+@api_router.post("/plans/upload")
+async def upload_plan_from_excel(
+    file: UploadFile = File(...),
+    title: str = Form(...),
+    x_profile: Optional[str] = Header(None)
+):
+    """Upload and create a plan from Excel file"""
+    if not file.filename.endswith(('.xlsx', '.xls')):
+        raise HTTPException(status_code=400, detail="File must be an Excel file (.xlsx or .xls)")
+    
+    acquire_upload_slot()
+    try:
+        # Read the uploaded Excel file
+        content = await file.read()
+        
+        # Process Excel data with enhanced processing, off the event loop
+        plan_sections = await parse_upload(content, profile=profile_requested(x_profile))
+        
+        plan_obj = await save_uploaded_plan(title, plan_sections)
+        return {"message": "Plan uploaded successfully", "plan_id": plan_obj.plan_id, "id": plan_obj.id}
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading plan: {e}")
         raise HTTPException(status_code=500, detail=f"Error uploading plan: {e}")
+    finally:
+        release_upload_slot()
 
-@api_router.get("/plans", response_model=List[ProjectPlan])
-async def get_plans():
-    """Get all project plans"""
-    plans = await db.plans.find().to_list(1000)
-    return [ProjectPlan(**parse_from_mongo(plan)) for plan in plans]
+@api_router.post("/plans/upload/jobs", status_code=202, response_model=UploadJob)
+async def create_upload_job(
+    file: UploadFile = File(...),
+    title: str = Form(...),
+    x_profile: Optional[str] = Header(None)
+):
+    """Accept an Excel file and process it in the background"""
+    if not file.filename.endswith(('.xlsx', '.xls')):
+        raise HTTPException(status_code=400, detail="File must be an Excel file (.xlsx or .xls)")
+    
+    acquire_upload_slot()
+    try:
+        content = await file.read()
+        job = UploadJob(title=title, filename=file.filename)
+        await db.upload_jobs.insert_one(job.dict())
+    except BaseException:
+        release_upload_slot()
+        raise
+    
+    # The job releases the upload slot when it finishes
+    spawn_background(run_upload_job(job.job_id, title, content, profile_requested(x_profile)))
+    return job
 
-@api_router.get("/plans/{plan_id}", response_model=ProjectPlan)
-async def get_plan(plan_id: str):
-    """Get a specific project plan by plan_id"""
-    plan = await db.plans.find_one({"plan_id": plan_id})
-    if plan:
-        return ProjectPlan(**parse_from_mongo(plan))
+@api_router.post("/plans/import", response_model=ImportResult)
+async def import_plans(files: List[UploadFile] = File(...)):
+    """Create one plan per workbook from a batch of Excel files and/or zip archives of them.
+
+    Each plan is titled after its file name. The response lists the outcome
+    for every workbook in upload order.
+    """
+    acquire_upload_slot()
+    try:
+        results, sources = list_import_workbooks(files)
+        await import_workbooks(sources)
+    finally:
+        release_upload_slot()
+    
+    imported = sum(1 for entry in results if entry.status == 'imported')
+    return ImportResult(imported=imported, failed=len(results) - imported, results=results)
+
+@api_router.get("/plans/upload/jobs/{job_id}", response_model=UploadJob)
+async def get_upload_job(job_id: str):
+    """Report the state and per-sheet progress of a background upload"""
+    await fail_stale_upload_jobs({"job_id": job_id})
+    job = await db.upload_jobs.find_one({"job_id": job_id})
+    if job:
+        return UploadJob(**parse_from_mongo(job))
+    else:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+
+@api_router.get("/plans", response_model=ProjectPlanPage)
+async def get_plans(
+    limit: int = Query(PLAN_PAGE_SIZE, ge=1, le=PLAN_PAGE_MAX),
+    page_token: Optional[str] = None
+):
+    """List plan summaries, newest first, one page at a time.
+
+    Only the summary fields are read from Mongo; pass ``next_page_token``
+    back as ``page_token`` for the following page. Full plans are served by
+    GET /plans/{plan_id}.
+    """
+    query = {}
+    if page_token:
+        created_at, plan_id = decode_page_token(page_token)
+        query = {"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "plan_id": {"$lt": plan_id}}
+        ]}
+    
+    projection = {"_id": 0, "id": 1, "plan_id": 1, "title": 1, "created_at": 1, "updated_at": 1, "section_counts": 1}
+    plans = await db.plans.find(query, projection).sort(
+        [("created_at", -1), ("plan_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    next_page_token = encode_page_token(plans[limit - 1]) if len(plans) > limit else None
+    plans = plans[:limit]
+    
+    # Plans saved before counts were stored get them filled in once
+    for plan in plans:
+        if 'section_counts' not in plan:
+            full_plan = await find_plan({"plan_id": plan['plan_id']}, {"_id": 0})
+            plan['section_counts'] = count_plan_sections(full_plan or {})
+            await db.plans.update_one(
+                {"plan_id": plan['plan_id']}, {"$set": {"section_counts": plan['section_counts']}}
+            )
+    
+    return ProjectPlanPage(
+        plans=[ProjectPlanSummary(**parse_from_mongo(plan)) for plan in plans],
+        next_page_token=next_page_token
+    )
+
+async def current_plan_etag(plan_id, table_format='rows'):
+    """Read just a plan's revision and return its ETag, or None if the plan is gone"""
+    plan = await db.plans.find_one({"plan_id": plan_id}, {"_id": 0, "plan_id": 1, "revision": 1})
+    return plan_etag(plan, table_format) if plan else None
+
+@api_router.get("/plans/export.zip")
+async def export_plans(plan_ids: Optional[str] = None):
+    """Download a zip of plans as workbooks; ``plan_ids`` is comma-separated, all plans if omitted"""
+    if plan_ids:
+        ids = [plan_id.strip() for plan_id in plan_ids.split(',') if plan_id.strip()]
     else:
+        ids = [plan['plan_id'] async for plan in db.plans.find({}, {"_id": 0, "plan_id": 1}).sort("created_at", 1)]
+    
+    loop = asyncio.get_running_loop()
+    def load_export(plan_id):
+        # Called from the export thread; the read itself runs on the event loop
+        return asyncio.run_coroutine_threadsafe(load_plan_export(plan_id), loop).result()
+    
+    return StreamingResponse(
+        stream_from_thread(partial(write_plans_archive, ids, load_export)),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="plans.zip"'}
+    )
+
+@api_router.get("/plans/{plan_id}/export.xlsx")
+async def export_plan(plan_id: str):
+    """Download a plan rebuilt as an Excel workbook"""
+    export = await load_plan_export(plan_id)
+    if export is None:
         raise HTTPException(status_code=404, detail="Plan not found")
+    return StreamingResponse(
+        stream_from_thread(partial(write_plan_workbook, *export)),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{plan_id}.xlsx"'}
+    )
 
-@api_router.put("/plans/{plan_id}", response_model=ProjectPlan)
-async def update_plan(plan_id: str, plan_update: ProjectPlanUpdate):
-    """Update a project plan"""
-    # Get existing plan
-    existing_plan = await db.plans.find_one({"plan_id": plan_id})
-    if not existing_plan:
+@api_router.get("/plans/{plan_id}", response_model=ProjectPlan)
+async def get_plan(plan_id: str, request: Request, fields: Optional[str] = None, tables: str = "rows"):
+    """Get a specific project plan by plan_id.
+
+    ``fields`` is a comma-separated list of (dotted) fields to return, e.g.
+    ``title,risk_management``; only those are read from Mongo and the plan
+    comes back partial, always with its plan_id. ``tables=columnar`` returns
+    tables in the columnar form (see encode_table) rather than as row dicts.
+    
+    Full plans carry an ETag and answer If-None-Match with 304; their
+    serialized bodies are cached in memory.
+    """
+    check_table_format(tables)
+    if fields is not None:
+        plan = await find_plan({"plan_id": plan_id}, plan_field_projection(fields), tables)
+        if not plan:
+            raise HTTPException(status_code=404, detail="Plan not found")
+        return json_response(plan)
+    
+    if_none_match = request.headers.get("if-none-match")
+    etag = None
+    entry = plan_cache.get(plan_id, tables)
+    if entry is not None and not plan_cache.trusted:
+        etag = await current_plan_etag(plan_id, tables)
+        if etag != entry[0]:
+            plan_cache.invalidate(plan_id)
+            entry = None
+    elif entry is None and if_none_match:
+        # A revision lookup is enough to answer a conditional GET
+        etag = await current_plan_etag(plan_id, tables)
+    if entry is not None:
+        etag = entry[0]
+    
+    if etag is not None and etag_matches(if_none_match, etag):
+        plan_cache.record('not_modified', len(entry[1]) if entry else 0)
+        return Response(status_code=304, headers=revalidate_headers(etag))
+    if entry is not None:
+        plan_cache.record('hits', len(entry[1]))
+        return Response(content=entry[1], media_type="application/json", headers=revalidate_headers(etag))
+    
+    generation = plan_cache.generation(plan_id)
+    plan = await find_plan({"plan_id": plan_id}, {"section_counts": 0}, tables)
+    if not plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    plan_cache.record('misses')
+    doc_id = plan.pop('_id')
+    etag = plan_etag(plan, tables)
+    chunks = iter_json_object(fill_plan_defaults(plan))
+    return StreamingResponse(
+        plan_cache.tee(plan_id, doc_id, etag, chunks, generation, tables),
+        media_type="application/json", headers=revalidate_headers(etag)
+    )
+
+@api_router.get("/plans/{plan_id}/sections/{section_key}", response_model=Dict[str, Any])
+async def get_plan_section(plan_id: str, section_key: str, request: Request, tables: str = "rows"):
+    """Get one section of a plan without reading the rest of it"""
+    check_table_format(tables)
+    if section_key in PLAN_FIELDS or section_key in PLAN_INTERNAL_FIELDS or not re.fullmatch(r'[A-Za-z0-9_]+', section_key):
+        raise HTTPException(status_code=404, detail="Section not found")
+    
+    # The header is read first, so the section is at least as new as the revision in the ETag
+    plan = await find_plan({"plan_id": plan_id}, {"_id": 0, "plan_id": 1, "revision": 1, section_key: 1}, tables)
+    if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
+    section = plan.get(section_key)
+    if not isinstance(section, dict):
+        raise HTTPException(status_code=404, detail="Section not found")
+    
+    suffix = f"-{tables}" if tables != 'rows' else ""
+    headers = revalidate_headers(f'"{plan_id}-{plan.get("revision") or 0}-{section_key}{suffix}"')
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return json_response(section, headers)
+
+@api_router.put("/plans/{plan_id}", response_model=ProjectPlan)
+async def update_plan(
+    plan_id: str,
+    plan_update: ProjectPlanUpdate,
+    if_match: Optional[str] = Header(None),
+    tables: str = "rows"
+):
+    """Update a project plan.
+
+    With an If-Match header the update only applies while the plan is still
+    at that revision (the ETag returned by GET); otherwise it fails with 409.
+    Sections are replaced in their own documents before the header: each
+    write is checked against the revision, and the header update last. A
+    409 or 413 after some sections were written still moves the revision on
+    and says so. Tables may be sent in either form; ``tables`` picks the
+    form of the returned plan.
+    """
+    check_table_format(tables)
+    query = {"plan_id": plan_id}
+    if if_match is not None:
+        query = plan_revision_filter(plan_id, if_match)
+    plan = await writable_plan(plan_id, query, if_match)
+    revision = plan.get('revision') or 0
     
     # Update fields
     update_data = plan_update.dict(exclude_unset=True)
     update_data['updated_at'] = datetime.now(timezone.utc)
+    sections = {key: value for key, value in update_data.items() if key not in PLAN_FIELDS}
+    
+    # Every section is checked before the first one is written
+    for key, section in sections.items():
+        if section is None:
+            continue
+        try:
+            # Decoding first checks columnar tables sent by the client
+            convert_section_tables(convert_section_tables(section, 'rows'), TABLE_STORAGE)
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+            raise HTTPException(status_code=400, detail=f"Section {key!r} holds a malformed columnar table")
+        if len(bson.encode(section)) > PLAN_SECTION_MAX_BYTES:
+            raise section_too_large()
+    guard = {"revision": {"$lte": revision}} if if_match is not None else {}
+    if guard and sections and await db.plan_sections.find_one(
+        {"plan_id": plan_id, "key": {"$in": list(sections)}, "revision": {"$gt": revision}}, {"_id": 1}
+    ):
+        raise HTTPException(status_code=409, detail="Plan was changed by someone else; reload it and try again")
+    
+    async def partly_written(written, error):
+        """Move the revision past sections already written, then report ``error``"""
+        update = {"$set": {"updated_at": update_data['updated_at']}, "$inc": {"revision": 1}}
+        if written:
+            for key, counts in count_plan_sections({key: sections[key] for key in written}).items():
+                update["$set"][f'section_counts.{key}'] = counts
+            update["$addToSet"] = {"section_keys": {"$each": written}}
+        result = await db.plans.find_one_and_update(
+            {"plan_id": plan_id}, update,
+            projection={"_id": 0, "plan_id": 1, "title": 1, "revision": 1}, return_document=ReturnDocument.AFTER
+        )
+        plan_cache.invalidate(plan_id)
+        if result is None:
+            await db.plan_sections.delete_many({"plan_id": plan_id})
+            raise HTTPException(status_code=404, detail="Plan not found")
+        if written:
+            update_search_index(plan_id, written)
+        raise HTTPException(
+            status_code=error.status_code, headers={"ETag": plan_etag(result, tables)},
+            detail=f"{error.detail} (sections {', '.join(written)} were saved)" if written else error.detail
+        )
     
-    # Prepare for MongoDB
-    update_mongo = prepare_for_mongo(update_data)
+    conflict = HTTPException(status_code=409, detail="Plan was changed by someone else; reload it and try again")
+    written = []
+    for key, section in sections.items():
+        try:
+            stored = await write_plan_section(
+                {"plan_id": plan_id, "key": key, **guard},
+                {"$set": {"id": plan['id'], "data": section, "table_format": section_table_format(section)},
+                 "$inc": {"version": 1}, "$max": {"revision": revision + 1}},
+                upsert=True
+            )
+        except HTTPException as e:
+            if not written:
+                raise
+            await partly_written(written, e)
+        if not stored:
+            if not written:
+                raise conflict
+            await partly_written(written, conflict)
+        written.append(key)
     
-    result = await db.plans.update_one(
-        {"plan_id": plan_id}, 
-        {"$set": update_mongo}
+    header = {key: value for key, value in update_data.items() if key in PLAN_FIELDS}
+    for key, counts in count_plan_sections(sections).items():
+        header[f'section_counts.{key}'] = counts
+    update = {"$set": header, "$inc": {"revision": 1}}
+    if sections:
+        update["$addToSet"] = {"section_keys": {"$each": list(sections)}}
+    target = {"plan_id": plan_id, "revision": revision} if if_match is not None else {"plan_id": plan_id}
+    updated_plan = await db.plans.find_one_and_update(
+        target, update, projection={"_id": 0}, return_document=ReturnDocument.AFTER
     )
+    if updated_plan is None and if_match is not None and await db.plans.find_one({"plan_id": plan_id}, {"_id": 1}):
+        # Another write moved the plan on while the sections were written
+        if not written:
+            raise conflict
+        await partly_written(written, conflict)
+    if updated_plan is None:
+        # Deleted while the sections were written
+        await db.plan_sections.delete_many({"plan_id": plan_id})
+        raise HTTPException(status_code=404, detail="Plan not found")
+    await load_plan_sections(updated_plan)
+    convert_plan_tables(updated_plan, tables)
     
-    if result.modified_count:
-        # Fetch and return updated plan
-        updated_plan = await db.plans.find_one({"plan_id": plan_id})
-        return ProjectPlan(**parse_from_mongo(updated_plan))
-    else:
-        raise HTTPException(status_code=500, detail="Failed to update plan")
+    # Plans stored before section counts existed get a full set on their first update
+    if updated_plan.get('section_counts', {}).keys() != count_plan_sections(updated_plan).keys():
+        await db.plans.update_one(
+            {"plan_id": plan_id, "revision": updated_plan['revision']},
+            {"$set": {"section_counts": count_plan_sections(updated_plan)}}
+        )
+    
+    plan_cache.invalidate(plan_id)
+    update_search_index(plan_id, sections)
+    for field in PLAN_INTERNAL_FIELDS:
+        updated_plan.pop(field, None)
+    return json_response(fill_plan_defaults(updated_plan), {"ETag": plan_etag(updated_plan, tables)})
+
+@api_router.patch("/plans/{plan_id}", response_model=PlanPatchResult)
+async def patch_plan(
+    plan_id: str,
+    patch: PlanPatch,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
+    """Apply small edits to a plan without resending whole sections.
+
+    Operations are applied in order as targeted $set/$push/$pull updates of
+    the section documents; operations on unrelated paths of one section
+    share a single update. Sections holding columnar tables are rewritten
+    instead (see rewrite_plan_section). If-Match works as for PUT. Only the
+    new revision is returned, not the plan.
+    """
+    if not patch.operations:
+        raise HTTPException(status_code=400, detail="No operations given")
+    operation_steps = [plan_operation_steps(operation) for operation in patch.operations]
+    
+    query = {"plan_id": plan_id}
+    if if_match is not None:
+        query = plan_revision_filter(plan_id, if_match)
+    plan = await writable_plan(plan_id, query, if_match)
+    revision = plan.get('revision') or 0
+    
+    sections = {operation.section for operation in patch.operations}
+    columnar = {
+        doc['key'] async for doc in db.plan_sections.find(
+            {"plan_id": plan_id, "key": {"$in": sorted(sections)}, "table_format": "columnar"}, {"_id": 0, "key": 1}
+        )
+    }
+    
+    # Runs of operations on columnar sections are rewrites; the rest become merged update batches
+    units, steps = [], []
+    for operation, op_steps in zip(patch.operations, operation_steps):
+        if operation.section not in columnar:
+            steps.extend(op_steps)
+            continue
+        units.extend(merge_update_steps(steps))
+        steps = []
+        if units and units[-1].get('operations') is not None and units[-1]['section'] == operation.section:
+            units[-1]['operations'].append(operation)
+        else:
+            units.append({'section': operation.section, 'operations': [operation]})
+    units.extend(merge_update_steps(steps))
+    
+    result = None
+    for unit in units:
+        section = unit['section']
+        if unit.get('operations') is not None:
+            outcome, counts = await rewrite_plan_section(
+                plan_id, section, unit['operations'], revision, if_match is not None
+            )
+        else:
+            update, conditions, counts = section_document_update(unit)
+            if isinstance(update, list):
+                update.append({"$set": {
+                    "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+                    "revision": {"$max": ["$revision", revision + 1]}
+                }})
+            else:
+                update["$inc"] = {"version": 1}
+                update["$max"] = {"revision": revision + 1}
+            target = {"plan_id": plan_id, "key": section, "table_format": {"$ne": "columnar"}, **conditions}
+            if if_match is not None:
+                target["revision"] = {"$lte": revision}
+            outcome = 'applied' if await write_plan_section(target, update) else None
+            if outcome is None:
+                newer = if_match is not None and await db.plan_sections.find_one(
+                    {"plan_id": plan_id, "key": section, "revision": {"$gt": revision}}, {"_id": 1}
+                )
+                outcome = 'conflict' if newer else 'invalid'
+        
+        if outcome != 'applied':
+            headers = {"ETag": plan_etag(result)} if result else None
+            if result:
+                update_search_index(plan_id, sections)
+            applied = " (earlier operations were applied)" if result else ""
+            if outcome == 'conflict':
+                raise HTTPException(
+                    status_code=409, headers=headers,
+                    detail=f"Plan was changed by someone else; reload it and try again{applied}"
+                )
+            raise HTTPException(
+                status_code=422, headers=headers,
+                detail=f"Operations address a section, table or row that does not exist{applied}"
+            )
+        
+        # The revision moves only once the section holds the change
+        result = await db.plans.find_one_and_update(
+            {"plan_id": plan_id},
+            {"$set": {"updated_at": datetime.now(timezone.utc)}, "$inc": {"revision": 1, **counts}},
+            projection={"_id": 0, "plan_id": 1, "revision": 1, "updated_at": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        plan_cache.invalidate(plan_id)
+        if result is None:
+            await db.plan_sections.delete_many({"plan_id": plan_id})
+            raise HTTPException(status_code=404, detail="Plan not found")
+        # Later updates only apply on top of this one
+        revision = result['revision']
+    
+    update_search_index(plan_id, sections)
+    response.headers["ETag"] = plan_etag(result)
+    return PlanPatchResult(**parse_from_mongo(result))
 
 @api_router.delete("/plans/{plan_id}")
 async def delete_plan(plan_id: str):
     """Delete a project plan"""
     result = await db.plans.delete_one({"plan_id": plan_id})
+    plan_cache.invalidate(plan_id)
     if result.deleted_count:
+        await db.plan_sections.delete_many({"plan_id": plan_id})
+        await release_plan_images(plan_id)
+        await remove_from_search_index(plan_id)
         return {"message": "Plan deleted successfully"}
     else:
         raise HTTPException(status_code=404, detail="Plan not found")
 
+@api_router.get("/plans/{plan_id}/images/{image_id}")
+async def get_plan_image(plan_id: str, image_id: str, request: Request, variant: str = "thumbnail"):
+    """Serve an image embedded in a plan.
+
+    ``variant`` is 'thumbnail' (default), 'web' (compressed full size) or
+    'original'. Until a rendition exists the next larger one is served.
+    """
+    if variant not in IMAGE_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"variant must be one of {', '.join(IMAGE_VARIANTS)}")
+    
+    query = {"_id": image_id, "plan_ids": plan_id}
+    meta = await db.plan_images.find_one(
+        query, {"data": 0, "renditions.web.data": 0, "renditions.thumbnail.data": 0}
+    )
+    if not meta:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    renditions = meta.get('renditions') or {}
+    served = next(v for v in IMAGE_VARIANTS[IMAGE_VARIANTS.index(variant):] if v == 'original' or v in renditions)
+    
+    # Image ids are content hashes, so the bytes of a variant never change;
+    # a fallback is only cached until the requested rendition exists
+    etag = f'"{image_id}-{served}"'
+    cache_control = "public, max-age=31536000, immutable"
+    if served != variant and 'renditions' not in meta:
+        cache_control = "no-cache"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    image = None
+    if served != 'original':
+        image = await db.plan_image_renditions.find_one({"_id": f"{image_id}:{served}"}, {"data": 1})
+    if image is None:
+        # Originals, and renditions built before they had their own documents
+        field = 'data' if served == 'original' else f'renditions.{served}.data'
+        image = await db.plan_images.find_one(query, {field: 1})
+        if image is not None and served != 'original':
+            image = image['renditions'][served]
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    fmt = meta['format'] if served == 'original' else renditions[served]['format']
+    data = image['data']
+    return Response(content=bytes(data), media_type=f"image/{fmt}", headers=headers)
+
+@api_router.get("/search", response_model=SearchResults)
+async def search_plans(
+    q: str = Query(..., min_length=1, max_length=500),
+    sections: Optional[str] = None,
+    limit: int = Query(SEARCH_RESULTS_DEFAULT, ge=1, le=SEARCH_RESULTS_MAX)
+):
+    """Find plan sections and titles matching ``q``, best matches first.
+
+    ``q`` follows Mongo text search: words match on their stem, "quoted
+    phrases" must all appear and -words exclude a section. ``sections`` is a
+    comma-separated list of section keys to search within (titles are then
+    left out). Each hit carries a snippet of the text around the match.
+    """
+    query = {"$text": {"$search": q}}
+    if sections:
+        keys = [key.strip() for key in sections.split(',') if key.strip()]
+        query["section"] = {"$in": keys}
+    
+    projection = {"_id": 0, "plan_id": 1, "title": 1, "section": 1, "text": 1, "score": {"$meta": "textScore"}}
+    try:
+        entries = await db.plan_search.find(query, projection).sort(
+            [("score", {"$meta": "textScore"})]
+        ).limit(limit).to_list(limit)
+    except OperationFailure as e:
+        logger.error(f"Search failed: {e}")
+        raise HTTPException(status_code=503, detail="Search is not available yet; try again shortly")
+    
+    terms = search_terms(q)
+    return SearchResults(query=q, results=[
+        SearchHit(
+            plan_id=entry['plan_id'],
+            title=entry.get('title') or '',
+            section=entry.get('section'),
+            score=entry['score'],
+            snippet=search_snippet(entry.get('text') or [], terms)
+        )
+        for entry in entries
+    ])
+
+@api_router.get("/admin/indexes")
+async def get_index_stats():
+    """Report declared indexes and how often each has been used since the server started"""
+    report = {}
+    for collection_name in INDEXES:
+        stats = await db[collection_name].aggregate([{"$indexStats": {}}]).to_list(None)
+        report[collection_name] = [
+            {
+                "name": stat['name'],
+                "key": dict(stat['key']),
+                "ops": stat['accesses']['ops'],
+                "since": stat['accesses']['since']
+            }
+            for stat in stats
+        ]
+    return report
+
+@api_router.get("/admin/plan-cache")
+async def get_plan_cache_stats():
+    """Report plan response cache hit rate, bytes saved and memory usage"""
+    return plan_cache.snapshot()
+
+@api_router.get("/admin/parse-cache")
+async def get_parse_cache_stats():
+    """Report parse cache hit/miss counters and memory tier usage"""
+    return parse_cache.snapshot()
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Served outside /api so Prometheus can scrape the backend directly
+# Cache snapshot fields exposed on /metrics: (field, metric type, description)
+PLAN_CACHE_METRICS = [
+    ('hits', 'counter', 'Plan reads answered from the response cache.'),
+    ('misses', 'counter', 'Plan reads that went to Mongo.'),
+    ('not_modified', 'counter', 'Conditional plan reads answered with 304 Not Modified.'),
+    ('bytes_saved', 'counter', 'Plan response bytes served from the cache or not sent thanks to a 304.'),
+    ('invalidations', 'counter', 'Cached plan responses dropped after a write.'),
+    ('evictions', 'counter', 'Cached plan responses dropped to stay within the size limit.'),
+    ('hit_rate', 'gauge', 'Share of full plan reads answered from the cache.'),
+    ('entries', 'gauge', 'Plan responses held in the cache.'),
+    ('bytes', 'gauge', 'Bytes of plan responses held in the cache.'),
+    ('max_bytes', 'gauge', 'Size limit of the plan response cache.'),
+    ('change_stream', 'gauge', '1 while a change stream keeps the plan response cache in sync.'),
+]
+PARSE_CACHE_METRICS = [
+    ('hits', 'counter', 'Workbook and sheet parses answered from the parse cache.'),
+    ('memory_hits', 'counter', 'Parse cache hits from the in-memory tier.'),
+    ('mongo_hits', 'counter', 'Parse cache hits from Mongo.'),
+    ('misses', 'counter', 'Workbook and sheet parses not found in the parse cache.'),
+    ('evictions', 'counter', 'Parse results dropped to stay within the size limits.'),
+    ('entries', 'gauge', 'Parse results held in memory.'),
+    ('bytes', 'gauge', 'Bytes of parse results held in memory.'),
+    ('max_bytes', 'gauge', 'Size limit of the in-memory parse cache.'),
+]
+
+def render_snapshot_metrics(prefix, snapshot, fields):
+    """Prometheus text for the fields of a cache snapshot"""
+    lines = []
+    for field, kind, description in fields:
+        name = f"{prefix}_{field}_total" if kind == 'counter' else f"{prefix}_{field}"
+        value = snapshot[field]
+        if isinstance(value, bool):
+            value = int(value)
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return '\n'.join(lines) + '\n'
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Metrics in the Prometheus text format"""
+    gauges = (
+        "# HELP plan_uploads_in_flight Uploads being parsed or waiting for a worker.\n"
+        "# TYPE plan_uploads_in_flight gauge\n"
+        f"plan_uploads_in_flight {uploads_in_flight}\n"
+    )
+    caches = (
+        render_snapshot_metrics('plan_response_cache', plan_cache.snapshot(), PLAN_CACHE_METRICS)
+        + render_snapshot_metrics('parse_cache', parse_cache.snapshot(), PARSE_CACHE_METRICS)
+    )
+    return Response(metrics.render() + gauges + caches, media_type="text/plain; version=0.0.4")
+
+class RequestMetricsMiddleware:
+    """Time every request into HTTP_SECONDS and expose its scope to the Mongo listener"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+        
+        token = request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_scope.reset(token)
+            HTTP_SECONDS.observe(time.perf_counter() - start, scope['method'], route_label(scope), str(status))
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+app.add_middleware(RequestMetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -518,4 +3609,55 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+
+@app.on_event("startup")
+async def create_indexes():
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        logger.warning(f"Could not reconcile indexes: {e}")
+
+@app.on_event("startup")
+async def migrate_datetimes():
+    try:
+        await migrate_datetime_fields()
+    except Exception as e:
+        logger.warning(f"Could not convert string datetimes: {e}")
+
+@app.on_event("startup")
+async def start_search_index_sync():
+    # Runs in the background: a first sync indexes every existing plan
+    async def sync():
+        try:
+            await sync_search_index()
+        except Exception as e:
+            logger.warning(f"Could not sync the search index: {e}")
+    spawn_background(sync())
+
+@app.on_event("startup")
+async def start_plan_change_stream():
+    global plan_change_task
+    if PLAN_CACHE_CHANGE_STREAM:
+        plan_change_task = asyncio.create_task(watch_plan_changes())
+
+@app.on_event("startup")
+async def recover_upload_jobs():
+    try:
+        await fail_stale_upload_jobs()
+    except Exception as e:
+        logger.warning(f"Could not check for interrupted upload jobs: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_upload_executor():
+    if upload_progress_task is not None:
+        upload_progress_task.cancel()
+    if upload_executor is not None:
+        upload_executor.shutdown(wait=False, cancel_futures=True)
+    if sheet_executor is not None:
+        sheet_executor.shutdown(wait=False, cancel_futures=True)
+
+@app.on_event("shutdown")
+async def stop_plan_change_stream():
+    if plan_change_task is not None:
+        plan_change_task.cancel()
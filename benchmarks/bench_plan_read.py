@@ -0,0 +1,86 @@
+"""Compare the validated and the fast read path for GET /api/plans/{plan_id}.
+
+Both paths start from the raw BSON Mongo would return: the validated path
+with ISO string datetimes, run through parse_from_mongo, ProjectPlan and
+FastAPI's response_model re-validation and stdlib JSON; the fast path with
+native dates, straight to orjson.
+
+Usage: python benchmarks/bench_plan_read.py [--size-mb 5]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import bson
+from bson.codec_options import CodecOptions
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'backend'))
+
+from server import (  # noqa: E402
+    PLAN_FIELDS, ProjectPlan, fill_plan_defaults, iter_json_object, parse_from_mongo
+)
+
+CODEC_OPTIONS = CodecOptions(tz_aware=True)
+
+
+def make_plan(size_mb):
+    """Plan whose JSON is about ``size_mb`` MB, spread over every standard section"""
+    sections = [name for name in ProjectPlan.model_fields if name not in PLAN_FIELDS]
+    row = {f'Column {j}': f'value {j} with some text' for j in range(8)}
+    rows_per_section = int(size_mb * 1024 * 1024 / len(json.dumps(row)) / len(sections))
+    plan = ProjectPlan(title='Benchmark plan')
+    for name in sections:
+        setattr(plan, name, {
+            'content': [{'type': 'table', 'table_index': 0, 'position': 0}],
+            'tables': [{'headers': list(row), 'rows': [dict(row) for _ in range(rows_per_section)], 'position': 0}],
+            'images': [],
+            'metadata': {'sheet_name': name, 'total_rows': rows_per_section, 'processed_items': 1}
+        })
+    # BSON keeps datetimes to the millisecond
+    plan.created_at = plan.updated_at = plan.created_at.replace(microsecond=plan.created_at.microsecond // 1000 * 1000)
+    return plan.model_dump()
+
+
+def validated_read(raw):
+    plan = ProjectPlan(**parse_from_mongo(bson.decode(raw, CODEC_OPTIONS)))
+    # response_model validates the returned model again before encoding it
+    content = jsonable_encoder(ProjectPlan.model_validate(plan.model_dump()))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode()
+
+
+def fast_read(raw):
+    return b''.join(iter_json_object(fill_plan_defaults(bson.decode(raw, CODEC_OPTIONS))))
+
+
+def timed(fn, *args, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=float, default=5)
+    args = parser.parse_args()
+
+    plan = make_plan(args.size_mb)
+    legacy = dict(plan, created_at=plan['created_at'].isoformat(), updated_at=plan['updated_at'].isoformat())
+    legacy_raw, native_raw = bson.encode(legacy), bson.encode(plan)
+
+    validated, validated_body = timed(validated_read, legacy_raw)
+    fast, fast_body = timed(fast_read, native_raw)
+    assert json.loads(fast_body) == json.loads(validated_body)
+
+    print(f"plan: {len(native_raw) / 1e6:.1f} MB BSON, {len(fast_body) / 1e6:.1f} MB JSON")
+    print(f"validated read (parse_from_mongo + 2x Pydantic + json): {validated:8.3f}s")
+    print(f"fast read (native dates + orjson):                       {fast:8.3f}s  ({validated / fast:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
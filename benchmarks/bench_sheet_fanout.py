@@ -0,0 +1,65 @@
+"""Benchmark per-sheet fan-out in process_excel_data against sequential processing.
+
+Builds workbooks with a growing number of sheets and reports the wall time
+of parse_excel_upload with SHEET_WORKERS=0 and with the given worker count.
+
+Usage: python benchmarks/bench_sheet_fanout.py [--sheets 1 2 4 8 16] [--rows 3000] [--workers 4]
+"""
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+from openpyxl import Workbook
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'backend'))
+
+import server  # noqa: E402
+
+
+def make_workbook(sheets, rows):
+    wb = Workbook(write_only=True)
+    for index in range(sheets):
+        ws = wb.create_sheet(f'Sheet {index}')
+        ws.append(['ID', 'Description', 'Owner', 'Status', 'Due', 'Notes'])
+        for r in range(rows):
+            ws.append([f'{index}-{r}', f'Item {r} description', 'Owner', 'Open', '2024-01-01', 'n/a'])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def timed(content, workers):
+    server.SHEET_WORKERS = workers
+    start = time.perf_counter()
+    server.parse_excel_upload(content)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sheets', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--rows', type=int, default=3000)
+    parser.add_argument('--workers', type=int, default=min(os.cpu_count() or 1, 8))
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    workers = max(args.workers, 2)
+    print(f"cpus={os.cpu_count()} sheet workers={workers} rows/sheet={args.rows}")
+    print(f"{'sheets':>6} {'sequential':>11} {'fan-out':>9} {'speedup':>8}")
+    # Warm the pool so process start-up is not attributed to the first row
+    timed(make_workbook(2, 10), workers)
+    for sheets in args.sheets:
+        content = make_workbook(sheets, args.rows)
+        sequential = timed(content, 0)
+        fanned_out = timed(content, workers)
+        print(f"{sheets:>6} {sequential:>10.2f}s {fanned_out:>8.2f}s {sequential / fanned_out:>7.2f}x")
+    if server.sheet_executor is not None:
+        server.sheet_executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
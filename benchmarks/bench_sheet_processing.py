@@ -0,0 +1,70 @@
+"""Benchmark cell normalization and sheet processing on a wide synthetic sheet.
+
+Usage: python benchmarks/bench_sheet_processing.py [--rows 10000] [--cols 50]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'backend'))
+
+from server import normalize_sheet_cells, process_sheet_content  # noqa: E402
+
+
+def make_wide_sheet(rows, cols, seed=0):
+    """Skill-matrix shaped sheet: mostly short strings with sparse blanks"""
+    rng = np.random.default_rng(seed)
+    words = np.array(['Python', ' Java ', 'SQL', 'Expert', 'Novice', '3', '4.5', None, None])
+    return pd.DataFrame(rng.choice(words, size=(rows, cols)))
+
+
+def iloc_normalize(df):
+    """Per-cell normalization as process_sheet_content used to do it"""
+    out = []
+    for i in range(len(df)):
+        row = df.iloc[i]
+        row_data = []
+        for j in range(len(df.columns)):
+            cell_value = row.iloc[j] if j < len(row) else None
+            if pd.notna(cell_value) and str(cell_value).strip():
+                row_data.append(str(cell_value).strip())
+            else:
+                row_data.append('')
+        out.append(row_data)
+    return out
+
+
+def timed(fn, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--cols', type=int, default=50)
+    args = parser.parse_args()
+
+    df = make_wide_sheet(args.rows, args.cols)
+    assert normalize_sheet_cells(df)['cells'].tolist() == iloc_normalize(df)
+
+    baseline = timed(iloc_normalize, df, repeat=1)
+    vectorized = timed(normalize_sheet_cells, df)
+    end_to_end = timed(process_sheet_content, df, 'Skill Matrix')
+
+    print(f"sheet: {args.rows} rows x {args.cols} cols")
+    print(f"per-cell iloc normalization: {baseline:8.3f}s")
+    print(f"vectorized normalization:    {vectorized:8.3f}s  ({baseline / vectorized:.1f}x)")
+    print(f"process_sheet_content:       {end_to_end:8.3f}s")
+
+
+if __name__ == '__main__':
+    main()
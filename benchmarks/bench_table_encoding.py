@@ -0,0 +1,115 @@
+"""Size benchmark: plan sections with tables as row dicts vs the columnar form.
+
+Processes a generated workbook (see workbook_generator.py) and, for every
+section with tables, reports the size of the section as stored (BSON) and
+as returned (JSON) with its tables as row dicts and as encoded by
+server.encode_table, and the time taken to encode and decode them. Every
+table is checked to decode back to its rows. Exits non-zero when
+deliverables or skill_matrix shrink by less than --min-reduction.
+
+Usage: python benchmarks/bench_table_encoding.py [--rows 200] [--cols 8] [--tables 2]
+       [--min-reduction 0.5] [--output sizes.json]
+"""
+import argparse
+import copy
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import bson
+import orjson
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / 'backend'))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+import server  # noqa: E402
+from workbook_generator import make_plan_workbook  # noqa: E402
+
+CHECKED_SECTIONS = ['deliverables', 'skill_matrix']
+
+
+def process_workbook(content):
+    excel_data, workbook = server.open_workbook(content)
+    try:
+        plan = server.process_excel_data(excel_data, workbook)
+    finally:
+        workbook.close()
+    # Stored sections keep image references, not the image bytes
+    server.take_plan_images(plan)
+    return plan
+
+
+def measure_section(section):
+    """Sizes of a section in both table forms, and the encode/decode times"""
+    start = time.perf_counter()
+    encoded = server.convert_section_tables(copy.deepcopy(section), 'columnar')
+    encode_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    decoded = server.convert_section_tables(copy.deepcopy(encoded), 'rows')
+    decode_ms = (time.perf_counter() - start) * 1000
+    if decoded != section:
+        raise AssertionError("columnar tables did not decode back to their rows")
+
+    sizes = {
+        'rows_bson': len(bson.encode(section)),
+        'columnar_bson': len(bson.encode(encoded)),
+        'rows_json': len(orjson.dumps(section)),
+        'columnar_json': len(orjson.dumps(encoded)),
+    }
+    return {
+        **sizes,
+        'bson_reduction': 1 - sizes['columnar_bson'] / sizes['rows_bson'],
+        'json_reduction': 1 - sizes['columnar_json'] / sizes['rows_json'],
+        'encode_ms': encode_ms,
+        'decode_ms': decode_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200, help='data rows per table')
+    parser.add_argument('--cols', type=int, default=8)
+    parser.add_argument('--tables', type=int, default=2, help='tables per sheet')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-reduction', type=float, default=0.5,
+                        help=f"smallest size reduction accepted for {' and '.join(CHECKED_SECTIONS)}")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    plan = process_workbook(make_plan_workbook(args.rows, args.cols, args.tables, images=1, seed=args.seed))
+    results = {
+        key: measure_section(section) for key, section in plan.items()
+        if isinstance(section, dict) and section.get('tables')
+    }
+
+    print(f"{'section':<26} {'BSON rows':>10} {'columnar':>10} {'saved':>6} {'JSON rows':>10} {'columnar':>10} "
+          f"{'saved':>6} {'encode':>9} {'decode':>9}")
+    for key, stats in results.items():
+        print(f"{key:<26} {stats['rows_bson']:>10} {stats['columnar_bson']:>10} {stats['bson_reduction']:>6.0%} "
+              f"{stats['rows_json']:>10} {stats['columnar_json']:>10} {stats['json_reduction']:>6.0%} "
+              f"{stats['encode_ms']:>7.1f}ms {stats['decode_ms']:>7.1f}ms")
+    totals = {name: sum(stats[name] for stats in results.values())
+              for name in ('rows_bson', 'columnar_bson', 'rows_json', 'columnar_json')}
+    print(f"{'all sections':<26} {totals['rows_bson']:>10} {totals['columnar_bson']:>10} "
+          f"{1 - totals['columnar_bson'] / totals['rows_bson']:>6.0%} {totals['rows_json']:>10} "
+          f"{totals['columnar_json']:>10} {1 - totals['columnar_json'] / totals['rows_json']:>6.0%}")
+
+    if args.output:
+        report = {'workbook': {'rows': args.rows, 'cols': args.cols, 'tables': args.tables, 'seed': args.seed},
+                  'sections': results, 'totals': totals}
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"results written to {args.output}")
+
+    short = [key for key in CHECKED_SECTIONS if key in results and
+             min(results[key]['bson_reduction'], results[key]['json_reduction']) < args.min_reduction]
+    if short:
+        print(f"reduction below {args.min_reduction:.0%} for {', '.join(short)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""Concurrent load test for the plans API.
+
+Starts the app from backend/server.py under uvicorn in a child process (one
+worker, in-memory database stand-in, parse cache off so every upload is
+parsed) or targets a running stack with --base-url. Seeds plans from
+generated workbooks, then runs a closed-loop mix of listing, reads, section
+reads, updates, searches and uploads at each concurrency level in turn and
+reports throughput, p50/p95/p99 latency and error rates per endpoint. The
+level after which throughput stops growing is where the worker saturates.
+
+Usage: python benchmarks/load_test.py [--concurrency 1 4 16 64] [--duration 20]
+       [--mix list=20,read=50,update=20,upload=10] [--seed-plans 20] [--rows 100]
+       [--upload-workers 2] [--mongo-url mongodb://localhost:27017 | --base-url http://localhost:8001]
+       [--output load.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / 'backend'))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+from workbook_generator import make_plan_workbook  # noqa: E402
+
+OPERATIONS = ['list', 'read', 'section', 'update', 'search', 'upload']
+SECTIONS = ['risk_management', 'deliverables', 'skill_matrix', 'resource_plan']
+SEARCH_TERMS = ['vendor', 'audit delay', 'Priya', 'budget review', '"release baseline"']
+UPLOAD_WORKBOOKS = 8
+
+
+def parse_mix(text):
+    """'list=20,read=50' -> {'list': 20.0, 'read': 50.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}; expected {', '.join(OPERATIONS)}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def serve(port, memory):
+    """Child process: the app on uvicorn, with the in-memory database stand-in unless ``memory`` is false"""
+    import uvicorn
+    import server
+    from memory_db import MemoryDatabase
+
+    logging.disable(logging.INFO)
+    if memory:
+        server.db = MemoryDatabase()
+    uvicorn.run(server.app, host='127.0.0.1', port=port, log_level='warning')
+
+
+def start_local_server(args):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ)
+    env.setdefault('MONGO_URL', args.mongo_url or 'mongodb://localhost:27017')
+    env.setdefault('DB_NAME', 'plan_load_test')
+    if args.mongo_url:
+        env['MONGO_URL'] = args.mongo_url
+    env['UPLOAD_WORKERS'] = str(args.upload_workers)
+    if not args.parse_cache:
+        env['PARSE_CACHE_MAX_MB'] = '0'
+    database = 'mongodb' if args.mongo_url else 'memory'
+    process = subprocess.Popen([sys.executable, __file__, '--serve', str(port), database], env=env)
+    return process, f'http://127.0.0.1:{port}'
+
+
+async def wait_until_ready(client, process=None, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            if (await client.get('/api/')).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+class Workload:
+    """The operations of the mix, against a set of seeded plans"""
+
+    def __init__(self, client, plan_ids, workbooks, rows, rng):
+        self.client = client
+        self.plan_ids = plan_ids
+        self.workbooks = workbooks
+        self.rows = rows
+        self.rng = rng
+        self.uploads = 0
+
+    async def list(self):
+        return await self.client.get('/api/plans')
+
+    async def read(self):
+        return await self.client.get(f'/api/plans/{self.rng.choice(self.plan_ids)}')
+
+    async def section(self):
+        plan_id, section = self.rng.choice(self.plan_ids), self.rng.choice(SECTIONS)
+        return await self.client.get(f'/api/plans/{plan_id}/sections/{section}')
+
+    async def update(self):
+        operation = {
+            'op': 'set_cell', 'section': self.rng.choice(SECTIONS), 'table': 0,
+            'row': self.rng.randrange(self.rows), 'column': 'Status', 'value': self.rng.choice(['Open', 'Closed'])
+        }
+        return await self.client.patch(f'/api/plans/{self.rng.choice(self.plan_ids)}', json={'operations': [operation]})
+
+    async def search(self):
+        return await self.client.get('/api/search', params={'q': self.rng.choice(SEARCH_TERMS)})
+
+    async def upload(self):
+        self.uploads += 1
+        content = self.workbooks[self.uploads % len(self.workbooks)]
+        files = {'file': ('plan.xlsx', content)}
+        return await self.client.post('/api/plans/upload', files=files, data={'title': f'Load test {self.uploads}'})
+
+
+ENDPOINTS = {
+    'list': 'GET /api/plans',
+    'read': 'GET /api/plans/{plan_id}',
+    'section': 'GET /api/plans/{plan_id}/sections/{section}',
+    'update': 'PATCH /api/plans/{plan_id}',
+    'search': 'GET /api/search',
+    'upload': 'POST /api/plans/upload',
+}
+
+
+async def run_level(workload, mix, concurrency, duration):
+    """Run ``concurrency`` closed-loop clients for ``duration`` seconds"""
+    names, weights = list(mix), list(mix.values())
+    latencies = defaultdict(list)
+    errors = defaultdict(lambda: defaultdict(int))
+    deadline = time.perf_counter() + duration
+
+    async def client_loop():
+        while time.perf_counter() < deadline:
+            name = workload.rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await getattr(workload, name)()
+                outcome = response.status_code
+                # Drain streamed bodies so the latency covers the whole response
+                await response.aread()
+            except httpx.HTTPError as e:
+                outcome = type(e).__name__
+            latencies[name].append(time.perf_counter() - start)
+            if not isinstance(outcome, int) or outcome >= 400:
+                errors[name][str(outcome)] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for name in names:
+        samples = sorted(latencies[name])
+        if not samples:
+            continue
+        failed = sum(errors[name].values())
+        endpoints[ENDPOINTS[name]] = {
+            'requests': len(samples),
+            'throughput_rps': len(samples) / elapsed,
+            'error_rate': failed / len(samples),
+            'errors': dict(errors[name]),
+            'p50_ms': percentile(samples, 50) * 1000,
+            'p95_ms': percentile(samples, 95) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000,
+            'max_ms': samples[-1] * 1000,
+        }
+    total = sum(len(samples) for samples in latencies.values())
+    failed = sum(sum(kinds.values()) for kinds in errors.values())
+    return {
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'requests': total,
+        'throughput_rps': total / elapsed,
+        'error_rate': failed / total if total else 0.0,
+        'endpoints': endpoints,
+    }
+
+
+def print_level(level):
+    print(f"\nconcurrency {level['concurrency']}: {level['requests']} requests, "
+          f"{level['throughput_rps']:.1f} req/s, {level['error_rate']:.1%} errors")
+    print(f"  {'endpoint':<46} {'req/s':>8} {'err%':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, stats in level['endpoints'].items():
+        print(f"  {endpoint:<46} {stats['throughput_rps']:>8.1f} {stats['error_rate'] * 100:>6.1f} "
+              f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+        if stats['errors']:
+            print(f"  {'':<46} errors: {stats['errors']}")
+
+
+def saturation_point(levels, gain=1.1):
+    """First concurrency level whose throughput grew less than ``gain`` over the previous one"""
+    for previous, level in zip(levels, levels[1:]):
+        if level['throughput_rps'] < previous['throughput_rps'] * gain:
+            return previous['concurrency']
+    return None
+
+
+async def main(args):
+    process = None
+    base_url = args.base_url
+    if base_url is None:
+        process, base_url = start_local_server(args)
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 1)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            await wait_until_ready(client, process)
+            rng = random.Random(args.seed)
+            workbooks = [make_plan_workbook(args.rows, images=1, seed=seed) for seed in range(UPLOAD_WORKBOOKS)]
+            workload = Workload(client, [], workbooks, args.rows, rng)
+
+            print(f"seeding {args.seed_plans} plans on {base_url}")
+            for _ in range(args.seed_plans):
+                response = await workload.upload()
+                response.raise_for_status()
+                workload.plan_ids.append(response.json()['plan_id'])
+
+            levels = []
+            for concurrency in args.concurrency:
+                level = await run_level(workload, args.mix, concurrency, args.duration)
+                print_level(level)
+                levels.append(level)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    knee = saturation_point(levels)
+    if knee is not None:
+        print(f"\nthroughput stops scaling beyond concurrency {knee}")
+    if args.output:
+        report = {'base_url': base_url if args.base_url else 'local', 'mix': args.mix, 'duration': args.duration,
+                  'rows': args.rows, 'upload_workers': args.upload_workers, 'saturates_after': knee, 'levels': levels}
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"results written to {args.output}")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--serve']:
+        serve(int(sys.argv[2]), sys.argv[3] == 'memory')
+        sys.exit()
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--duration', type=float, default=20, help='seconds per concurrency level')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('list=20,read=50,update=20,upload=10'))
+    parser.add_argument('--seed-plans', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=100, help='data rows per table in uploaded workbooks')
+    parser.add_argument('--upload-workers', type=int, default=2, help='UPLOAD_WORKERS for the local server')
+    parser.add_argument('--parse-cache', action='store_true', help='keep the parse cache on in the local server')
+    parser.add_argument('--mongo-url', help='run the local server against this mongod (database DB_NAME, '
+                        'default plan_load_test) instead of the in-memory stand-in')
+    parser.add_argument('--base-url', help='load an already running server instead of starting one')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output')
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parser.parse_args()))
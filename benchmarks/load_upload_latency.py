@@ -0,0 +1,108 @@
+"""Measure GET /api/plans/{plan_id} latency while Excel uploads are in flight.
+
+Runs the app in-process against the in-memory database stand-in, once with
+uploads processed inline on the event loop and once through the upload
+process pool, and prints read latency percentiles for each mode.
+
+Usage: python benchmarks/load_upload_latency.py [--uploads 4] [--rows 20000]
+"""
+import argparse
+import asyncio
+import io
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from openpyxl import Workbook
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'backend'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import server  # noqa: E402
+from memory_db import MemoryDatabase  # noqa: E402
+
+PROBE_INTERVAL = 0.01
+
+
+def make_workbook(rows, tag):
+    """Workbook whose cells carry ``tag``, so no two uploads share a parse cache entry"""
+    wb = Workbook(write_only=True)
+    for name in ('Risk Management', 'List of Deliverables', 'Skill Matrix'):
+        ws = wb.create_sheet(name)
+        ws.append(['ID', 'Description', 'Owner', 'Status', 'Due'])
+        for r in range(rows):
+            ws.append([f'{name[:1]}{r}', f'Item {r} description', f'Owner {tag}', 'Open', '2024-01-01'])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run_mode(workers, contents):
+    server.UPLOAD_WORKERS = workers
+    server.db = MemoryDatabase()
+    hits = server.parse_cache.stats['hits']
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://local', timeout=None) as client:
+        plan = (await client.post('/api/plans', json={'title': 'Latency probe'})).json()
+        url = f"/api/plans/{plan['plan_id']}"
+
+        async def upload(index):
+            files = {'file': ('plan.xlsx', contents[index])}
+            response = await client.post('/api/plans/upload', files=files, data={'title': f'Upload {index}'})
+            return response.status_code
+
+        async def probe(stop):
+            # Latency counts from when the read was due, so time spent waiting
+            # for a blocked event loop shows up in the samples
+            samples = []
+            while not stop.is_set():
+                due = time.perf_counter() + PROBE_INTERVAL
+                await asyncio.sleep(PROBE_INTERVAL)
+                await client.get(url)
+                samples.append((time.perf_counter() - due) * 1000)
+            return samples
+
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(stop))
+        await asyncio.sleep(0.5)
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(upload(i) for i in range(len(contents))))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        samples = await probe_task
+
+    label = 'inline' if workers <= 0 else f'pool({workers})'
+    if server.parse_cache.stats['hits'] != hits:
+        raise AssertionError(f"{label}: uploads were answered from the parse cache instead of parsed")
+    print(f"{label:>10}: uploads {statuses} in {elapsed:6.2f}s | read latency ms "
+          f"p50={statistics.median(samples):7.1f} p99={percentile(samples, 99):7.1f} "
+          f"max={max(samples):7.1f} (n={len(samples)})")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uploads', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    modes = (0, args.workers)
+    # Distinct workbooks for every upload of every mode, so each one is parsed
+    contents = iter(make_workbook(args.rows, tag) for tag in range(len(modes) * args.uploads))
+    for workers in modes:
+        await run_mode(workers, [next(contents) for _ in range(args.uploads)])
+    if server.upload_executor is not None:
+        server.upload_executor.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
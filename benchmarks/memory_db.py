@@ -0,0 +1,493 @@
+"""In-memory stand-in for the parts of Motor's async API that server.py uses.
+
+Benchmarks and load tests swap it in for ``server.db`` so they can run
+against a local app without a mongod.
+"""
+import asyncio
+import copy
+import itertools
+import re
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import bson
+from pymongo.errors import BulkWriteError, DocumentTooLarge, DuplicateKeyError, OperationFailure
+
+# Mongo's document size limit, which pymongo checks before sending an insert
+MAX_BSON_SIZE = 16 * 1024 * 1024
+
+
+def _get(doc, path):
+    for part in path.split('.'):
+        if isinstance(doc, dict) and part in doc:
+            doc = doc[part]
+        elif isinstance(doc, list) and part.isdigit() and int(part) < len(doc):
+            doc = doc[int(part)]
+        else:
+            return None
+    return doc
+
+
+_BSON_TYPES = {'string': str, 'date': datetime, 'object': dict, 'array': list}
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        if key == '$or':
+            if not any(_matches(doc, sub) for sub in cond):
+                return False
+            continue
+        value = _get(doc, key)
+        if isinstance(cond, dict) and any(k.startswith('$') for k in cond):
+            for op, arg in cond.items():
+                if op == '$in' and value not in arg:
+                    return False
+                if op == '$nin' and value in arg:
+                    return False
+                if op == '$ne' and value == arg:
+                    return False
+                if op == '$type' and not isinstance(value, _BSON_TYPES[arg]):
+                    return False
+                if op == '$size' and not (isinstance(value, list) and len(value) == arg):
+                    return False
+                if op == '$exists' and (value is not None) != bool(arg):
+                    return False
+                if op == '$lt' and not (value is not None and value < arg):
+                    return False
+                if op == '$lte' and not (value is not None and value <= arg):
+                    return False
+                if op == '$gt' and not (value is not None and value > arg):
+                    return False
+                if op == '$gte' and not (value is not None and value >= arg):
+                    return False
+        elif value != cond and not (isinstance(value, list) and cond in value):
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    include = {k for k, v in projection.items() if v and k != '_id'}
+    if include:
+        out = {}
+        for path in include:
+            value = _get(doc, path)
+            if value is None and not _has(doc, path):
+                continue
+            target = out
+            parts = path.split('.')
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = copy.deepcopy(value)
+        if projection.get('_id', 1) and '_id' in doc:
+            out['_id'] = doc['_id']
+        return out
+    out = copy.deepcopy(doc)
+    for path, flag in projection.items():
+        if not flag:
+            _unset(out, path)
+    return out
+
+
+def _has(doc, path):
+    for part in path.split('.'):
+        if not isinstance(doc, dict) or part not in doc:
+            return False
+        doc = doc[part]
+    return True
+
+
+def _set(doc, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if isinstance(doc, list):
+            doc = doc[int(part)]
+        else:
+            doc = doc.setdefault(part, {})
+    if isinstance(doc, list):
+        doc[int(parts[-1])] = value
+    else:
+        doc[parts[-1]] = value
+
+
+def _unset(doc, path):
+    parts = path.split('.')
+    doc = _get(doc, '.'.join(parts[:-1])) if len(parts) > 1 else doc
+    if isinstance(doc, dict):
+        doc.pop(parts[-1], None)
+    elif isinstance(doc, list) and parts[-1].isdigit() and int(parts[-1]) < len(doc):
+        # Like Mongo, unsetting an array element leaves a null in its place
+        doc[int(parts[-1])] = None
+
+
+def _evaluate(expr, doc, variables):
+    """Value of an aggregation expression, for the operators pipeline updates use"""
+    if isinstance(expr, str) and expr.startswith('$$'):
+        name, _, path = expr[2:].partition('.')
+        return _get(variables[name], path) if path else variables[name]
+    if isinstance(expr, str) and expr.startswith('$'):
+        return _get(doc, expr[1:])
+    if isinstance(expr, list):
+        return [_evaluate(item, doc, variables) for item in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) != 1 or not next(iter(expr)).startswith('$'):
+        return {key: _evaluate(value, doc, variables) for key, value in expr.items()}
+    
+    op, args = next(iter(expr.items()))
+    if op == '$let':
+        scope = {name: _evaluate(value, doc, variables) for name, value in args['vars'].items()}
+        return _evaluate(args['in'], doc, {**variables, **scope})
+    args = _evaluate(args, doc, variables)
+    if op == '$arrayElemAt':
+        array, index = args
+        return array[index] if isinstance(array, list) and -len(array) <= index < len(array) else None
+    if op == '$slice':
+        array, position, *count = args
+        if array is None:
+            return None
+        if count:
+            return array[position:position + count[0]]
+        return array[:position] if position >= 0 else array[position:]
+    if op == '$concatArrays':
+        return None if any(array is None for array in args) else [item for array in args for item in array]
+    if op == '$mergeObjects':
+        merged = {}
+        for value in args:
+            merged.update(value or {})
+        return merged
+    if op == '$ifNull':
+        return next((value for value in args[:-1] if value is not None), args[-1])
+    if op == '$add':
+        return sum(args)
+    if op == '$max':
+        values = [value for value in args if value is not None]
+        return max(values) if values else None
+    raise NotImplementedError(op)
+
+
+def _apply_update(doc, update, inserting=False):
+    if isinstance(update, list):
+        # A pipeline update: each stage sees the document the previous one left
+        for stage in update:
+            values = {path: copy.deepcopy(_evaluate(expr, doc, {})) for path, expr in stage['$set'].items()}
+            for path, value in values.items():
+                _set(doc, path, value)
+        return
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == '$setOnInsert':
+                if inserting:
+                    _set(doc, path, copy.deepcopy(value))
+            elif op == '$set':
+                _set(doc, path, copy.deepcopy(value))
+            elif op == '$unset':
+                _unset(doc, path)
+            elif op == '$inc':
+                _set(doc, path, (_get(doc, path) or 0) + value)
+            elif op == '$max':
+                current = _get(doc, path)
+                if current is None or value > current:
+                    _set(doc, path, copy.deepcopy(value))
+            elif op == '$push':
+                target = _get(doc, path)
+                if target is None:
+                    target = []
+                    _set(doc, path, target)
+                if isinstance(value, dict) and '$each' in value:
+                    items = copy.deepcopy(value['$each'])
+                    position = value.get('$position', len(target))
+                    target[position:position] = items
+                else:
+                    target.append(copy.deepcopy(value))
+            elif op == '$addToSet':
+                target = _get(doc, path)
+                if target is None:
+                    target = []
+                    _set(doc, path, target)
+                items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                for item in items:
+                    if item not in target:
+                        target.append(copy.deepcopy(item))
+            elif op == '$pull':
+                target = _get(doc, path) or []
+                target[:] = [item for item in target if item != value]
+            else:
+                raise NotImplementedError(op)
+
+
+def _upsert_seed(query):
+    """Fields an upsert copies from its filter: equality conditions only"""
+    return {
+        k: copy.deepcopy(v) for k, v in query.items()
+        if not k.startswith('$') and not (isinstance(v, dict) and any(op.startswith('$') for op in v))
+    }
+
+
+def _words(text):
+    # A crude stand-in for Mongo's stemming: plural words count as singular
+    return [word[:-1] if len(word) > 3 and word.endswith('s') else word for word in re.findall(r'\w+', text.lower())]
+
+
+def _text_score(doc, fields, search):
+    """Score of a document for a $text search: matched word count, or 0"""
+    values = []
+    for field in fields:
+        value = _get(doc, field)
+        values.extend(value if isinstance(value, list) else [value])
+    text = ' '.join(value for value in values if isinstance(value, str))
+    words = _words(text)
+    phrases = re.findall(r'"([^"]*)"', search)
+    terms = re.sub(r'"[^"]*"', ' ', search).split()
+    if any(set(_words(term[1:])) & set(words) for term in terms if term.startswith('-')):
+        return 0
+    if not all(phrase.lower() in text.lower() for phrase in phrases):
+        return 0
+    wanted = {word for term in terms if not term.startswith('-') for word in _words(term)}
+    return sum(word in wanted for word in words) or len(phrases)
+
+
+class MemoryCursor:
+    def __init__(self, docs, projection=None, scores=None):
+        self._docs = docs
+        self._projection = projection
+        self._scores = scores or {}
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        self._sort = [(key, direction)] if isinstance(key, str) else list(key)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def _results(self):
+        docs = list(self._docs)
+        for key, direction in reversed(self._sort):
+            if isinstance(direction, dict):
+                docs.sort(key=lambda d: self._scores.get(id(d), 0), reverse=True)
+            else:
+                docs.sort(key=lambda d: (_get(d, key) is None, _get(d, key)), reverse=direction < 0)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        projection = self._projection or {}
+        meta = [key for key, value in projection.items() if isinstance(value, dict)]
+        projection = {key: value for key, value in projection.items() if key not in meta}
+        results = []
+        for doc in docs:
+            result = _project(doc, projection)
+            for key in meta:
+                result[key] = self._scores.get(id(doc), 0)
+            results.append(result)
+        return results
+
+    async def to_list(self, length=None):
+        results = self._results()
+        return results if length is None else results[:length]
+
+    def __aiter__(self):
+        self._iter = iter(self._results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MemoryCollection:
+    def __init__(self, name):
+        self.name = name
+        self.docs = []
+        self._ids = itertools.count(1)
+        self._created = datetime.now(timezone.utc)
+        self.indexes = {'_id_': {'key': [('_id', 1)], 'ops': 0}}
+        self._watchers = []
+
+    def _notify(self, operation, doc):
+        for watcher in self._watchers:
+            watcher.put_nowait({'operationType': operation, 'documentKey': {'_id': doc['_id']}})
+
+    def watch(self, pipeline=None):
+        """Change stream of update and delete events (the pipeline is ignored)"""
+        collection = self
+
+        class ChangeStream:
+            async def __aenter__(self):
+                self.events = asyncio.Queue()
+                collection._watchers.append(self.events)
+                return self
+
+            async def __aexit__(self, *exc):
+                collection._watchers.remove(self.events)
+
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                return await self.events.get()
+
+        return ChangeStream()
+
+    async def insert_one(self, document):
+        if len(bson.encode(document)) > MAX_BSON_SIZE:
+            raise DocumentTooLarge(f"BSON document too large for {self.name}; the limit is {MAX_BSON_SIZE} bytes")
+        document.setdefault('_id', next(self._ids))
+        for name, index in self.indexes.items():
+            if name == '_id_' or index.get('unique'):
+                fields = [field for field, _ in index['key']]
+                values = [_get(document, field) for field in fields]
+                if any([_get(d, field) for field in fields] == values for d in self.docs):
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}")
+        self.docs.append(copy.deepcopy(document))
+        return SimpleNamespace(inserted_id=document['_id'])
+
+    async def insert_many(self, documents, ordered=True):
+        inserted, errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                inserted.append((await self.insert_one(document)).inserted_id)
+            except DuplicateKeyError as e:
+                errors.append({'index': index, 'code': 11000, 'errmsg': str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(inserted)})
+        return SimpleNamespace(inserted_ids=inserted)
+
+    def find(self, query=None, projection=None):
+        query = dict(query or {})
+        for index in self.indexes.values():
+            if index['key'][0][0] in query or ('weights' in index and '$text' in query):
+                index['ops'] += 1
+        scores = None
+        if '$text' in query:
+            search = query.pop('$text')['$search']
+            text_index = next((index for index in self.indexes.values() if 'weights' in index), None)
+            if text_index is None:
+                raise OperationFailure('text index required for $text query', code=27)
+            scores = {id(d): _text_score(d, text_index['weights'], search) for d in self.docs}
+            docs = [d for d in self.docs if scores[id(d)] and _matches(d, query)]
+        else:
+            docs = [d for d in self.docs if _matches(d, query)]
+        return MemoryCursor(docs, projection, scores)
+
+    async def index_information(self):
+        return {name: {k: v for k, v in index.items() if k != 'ops'} for name, index in self.indexes.items()}
+
+    async def create_indexes(self, indexes):
+        for index in indexes:
+            document = index.document
+            key = list(document['key'].items())
+            if any(direction == 'text' for _, direction in key):
+                # Reported the way Mongo does, by internal keys with the fields as weights
+                self.indexes[document['name']] = {
+                    'key': [('_fts', 'text'), ('_ftsx', 1)],
+                    'weights': {field: 1 for field, direction in key if direction == 'text'},
+                    'ops': 0
+                }
+                continue
+            self.indexes[document['name']] = {
+                'key': key,
+                **({'unique': True} if document.get('unique') else {}),
+                'ops': 0
+            }
+        return [index.document['name'] for index in indexes]
+
+    async def drop_index(self, name):
+        del self.indexes[name]
+
+    def aggregate(self, pipeline):
+        if pipeline != [{'$indexStats': {}}]:
+            raise NotImplementedError(pipeline)
+        stats = [
+            {'name': name, 'key': dict(index['key']), 'accesses': {'ops': index['ops'], 'since': self._created}}
+            for name, index in self.indexes.items()
+        ]
+        return MemoryCursor(stats)
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        cursor = self.find(query, projection)
+        if sort:
+            cursor.sort(sort)
+        results = await cursor.limit(1).to_list(1)
+        return results[0] if results else None
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if _matches(doc, query):
+                before = copy.deepcopy(doc)
+                _apply_update(doc, update)
+                self._notify('update', doc)
+                return SimpleNamespace(matched_count=1, modified_count=int(doc != before), upserted_id=None)
+        if upsert:
+            doc = _upsert_seed(query)
+            _apply_update(doc, update, inserting=True)
+            result = await self.insert_one(doc)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=result.inserted_id)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=False, upsert=False):
+        for doc in self.docs:
+            if _matches(doc, query):
+                before = _project(doc, projection)
+                _apply_update(doc, update)
+                self._notify('update', doc)
+                return _project(doc, projection) if return_document else before
+        if upsert:
+            doc = _upsert_seed(query)
+            _apply_update(doc, update, inserting=True)
+            await self.insert_one(doc)
+            return _project(doc, projection) if return_document else None
+        return None
+
+    async def update_many(self, query, update):
+        count = 0
+        for doc in self.docs:
+            if _matches(doc, query):
+                _apply_update(doc, update)
+                self._notify('update', doc)
+                count += 1
+        return SimpleNamespace(matched_count=count, modified_count=count)
+
+    async def delete_many(self, query):
+        before = len(self.docs)
+        for doc in self.docs:
+            if _matches(doc, query):
+                self._notify('delete', doc)
+        self.docs = [d for d in self.docs if not _matches(d, query)]
+        return SimpleNamespace(deleted_count=before - len(self.docs))
+
+    async def delete_one(self, query):
+        for index, doc in enumerate(self.docs):
+            if _matches(doc, query):
+                self._notify('delete', doc)
+                del self.docs[index]
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
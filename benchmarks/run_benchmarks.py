@@ -0,0 +1,238 @@
+"""Benchmark suite: sheet processing functions and the API endpoints.
+
+Times detect_table_structure, process_sheet_content and process_excel_data
+on generated workbooks (see workbook_generator.py), then the main API
+endpoints in-process against the in-memory database stand-in, or against a
+mongod with --mongo-url (a scratch database is created and dropped).
+Results are written as JSON; --compare reports the change against an
+earlier run and exits non-zero when a benchmark slowed past --threshold.
+
+Usage: python benchmarks/run_benchmarks.py [--rows 200] [--cols 8] [--tables 2] [--images 1]
+       [--repeat 5] [--mongo-url mongodb://localhost:27017] [--output results.json]
+       [--compare baseline.json] [--threshold 1.25]
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / 'backend'))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+import server  # noqa: E402
+from memory_db import MemoryDatabase  # noqa: E402
+from workbook_generator import SECTION_SHEETS, make_plan_workbook  # noqa: E402
+
+
+def summarize(samples):
+    """Timing statistics in milliseconds"""
+    ordered = sorted(samples)
+    return {
+        'repeat': len(ordered),
+        'min_ms': ordered[0] * 1000,
+        'median_ms': statistics.median(ordered) * 1000,
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+    }
+
+
+def bench(fn, repeat, setup=None):
+    """Time ``fn(*setup())`` ``repeat`` times, after one untimed warm-up run"""
+    samples = []
+    for index in range(repeat + 1):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        if index:
+            samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def bench_async(fn, repeat, setup=None):
+    samples = []
+    for index in range(repeat + 1):
+        args = (await setup()) if setup else ()
+        start = time.perf_counter()
+        await fn(*args)
+        if index:
+            samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_processing(content, repeat):
+    """Sheet- and workbook-level processing, outside the API"""
+    frames = pd.read_excel(io.BytesIO(content), sheet_name=SECTION_SHEETS, header=None)
+    results = {}
+    results['detect_table_structure'] = bench(
+        lambda: [server.detect_table_structure(df) for df in frames.values()], repeat
+    )
+    results['process_sheet_content'] = bench(
+        lambda: [server.process_sheet_content(df, name) for name, df in frames.items()], repeat
+    )
+
+    def process(streaming):
+        excel_data, workbook = server.open_workbook(content, streaming=streaming)
+        try:
+            server.process_excel_data(excel_data, workbook)
+        finally:
+            workbook.close()
+
+    results['process_excel_data'] = bench(lambda: process(False), repeat)
+    results['process_excel_data_streaming'] = bench(lambda: process(True), repeat)
+    return results
+
+
+def checked(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.method} {response.request.url} -> {response.status_code}: {response.text[:200]}")
+    return response
+
+
+async def bench_endpoints(args, repeat):
+    """API endpoints in-process, through httpx's ASGI transport"""
+    results = {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        seeds = iter(range(1, 10 ** 6))
+
+        async def new_workbook():
+            # A new seed per run, so uploads are parsed rather than served from the parse cache
+            return (make_plan_workbook(args.rows, args.cols, args.tables, args.images, seed=next(seeds)),)
+
+        async def upload(content):
+            files = {'file': ('plan.xlsx', content)}
+            return checked(await client.post('/api/plans/upload', files=files, data={'title': 'Benchmark plan'}))
+
+        results['POST /api/plans/upload'] = await bench_async(upload, repeat, new_workbook)
+        plan_id = (await upload((await new_workbook())[0])).json()['plan_id']
+        url = f'/api/plans/{plan_id}'
+
+        async def get(path, **params):
+            return checked(await client.get(path, params=params))
+
+        async def get_uncached():
+            server.plan_cache.clear()
+            return await get(url)
+
+        results['GET /api/plans'] = await bench_async(lambda: get('/api/plans'), repeat)
+        results['GET /api/plans/{plan_id}'] = await bench_async(get_uncached, repeat)
+        results['GET /api/plans/{plan_id} (cached)'] = await bench_async(lambda: get(url), repeat)
+        results['GET /api/plans/{plan_id}/sections/{section}'] = await bench_async(
+            lambda: get(f'{url}/sections/risk_management'), repeat
+        )
+
+        async def patch():
+            operation = {'op': 'set_cell', 'section': 'risk_management', 'table': 0, 'row': 0,
+                         'column': 'Status', 'value': 'Closed'}
+            return checked(await client.patch(url, json={'operations': [operation]}))
+
+        results['PATCH /api/plans/{plan_id}'] = await bench_async(patch, repeat)
+        results['GET /api/search'] = await bench_async(lambda: get('/api/search', q='vendor delay'), repeat)
+        results['GET /api/plans/{plan_id}/export.xlsx'] = await bench_async(lambda: get(f'{url}/export.xlsx'), repeat)
+    return results
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True)
+        status = subprocess.run(['git', 'status', '--porcelain'], cwd=ROOT, capture_output=True, text=True, check=True)
+        return commit.stdout.strip(), bool(status.stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def compare(results, baseline, threshold):
+    """Print median changes against a baseline run; return the names that regressed"""
+    regressions = []
+    print(f"\n{'benchmark':<48} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current in results.items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            print(f"{name:<48} {'-':>10} {current['median_ms']:>9.1f}ms")
+            continue
+        ratio = current['median_ms'] / previous['median_ms'] if previous['median_ms'] else float('inf')
+        flag = '  REGRESSION' if ratio > threshold else ''
+        print(f"{name:<48} {previous['median_ms']:>9.1f}ms {current['median_ms']:>9.1f}ms {ratio:>7.2f}x{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200, help='data rows per table')
+    parser.add_argument('--cols', type=int, default=8)
+    parser.add_argument('--tables', type=int, default=2, help='tables per sheet')
+    parser.add_argument('--images', type=int, default=1, help='images per sheet')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--mongo-url', help='benchmark against this mongod instead of the in-memory stand-in')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='median slowdown counted as a regression')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    # Uploads are parsed inline so the timings do not depend on pool start-up
+    server.UPLOAD_WORKERS = 0
+    client = None
+    if args.mongo_url:
+        client = server.AsyncIOMotorClient(args.mongo_url, tz_aware=True)
+        server.db = client[f'plan_benchmark_{uuid.uuid4().hex[:8]}']
+    else:
+        server.db = MemoryDatabase()
+    await server.ensure_indexes()
+
+    content = make_plan_workbook(args.rows, args.cols, args.tables, args.images)
+    commit, dirty = git_revision()
+    report = {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'commit': commit,
+            'dirty': dirty,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'database': 'mongodb' if args.mongo_url else 'memory',
+            'workbook': {'rows': args.rows, 'cols': args.cols, 'tables': args.tables, 'images': args.images,
+                         'sheets': len(SECTION_SHEETS), 'bytes': len(content)},
+        },
+        'results': {},
+    }
+    try:
+        report['results'].update(bench_processing(content, args.repeat))
+        report['results'].update(await bench_endpoints(args, args.repeat))
+    finally:
+        if client is not None:
+            await client.drop_database(server.db.name)
+            client.close()
+
+    for name, stats in report['results'].items():
+        print(f"{name:<48} median {stats['median_ms']:9.1f}ms  p95 {stats['p95_ms']:9.1f}ms")
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        for key in ('workbook', 'database'):
+            if baseline['meta'].get(key) != report['meta'][key]:
+                print(f"note: baseline {key} was {baseline['meta'].get(key)}, not {report['meta'][key]}")
+        if compare(report['results'], baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
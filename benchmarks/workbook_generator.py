@@ -0,0 +1,142 @@
+"""Generate synthetic project-plan workbooks shaped like the real uploads.
+
+Every sheet process_excel_data maps to a plan section is present, plus a
+TOC sheet. Each section sheet starts with its title and a "Back to TOC"
+link, then alternates description paragraphs with tables of mixed text,
+numbers, dates and blanks, and carries embedded PNG images. Sheet content
+is the same for a given seed; only the file timestamps differ.
+
+Usage: python benchmarks/workbook_generator.py plan.xlsx [--rows 200] [--cols 8]
+       [--tables 2] [--images 1] [--extra-sheets 0] [--seed 0]
+"""
+import argparse
+import io
+import random
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+from openpyxl.drawing.image import Image as WorkbookImage
+from PIL import Image
+
+# The sheet names sheet_mapping in server.process_excel_data maps to sections
+SECTION_SHEETS = [
+    'Title Sheet',
+    'Revision History',
+    'Definitions and References',
+    'Project Introduction',
+    'Resource Plan and Estimation',
+    'PMC and Project Objectives',
+    'Quality Management',
+    'DAR, Tailoring and Release Plan',
+    'Risk Management',
+    'Opportunity Management',
+    'Configuration Management',
+    'List of Deliverables',
+    'Skill Matrix',
+    'Supplier Agreement Management',
+]
+
+COLUMNS = ['ID', 'Description', 'Owner', 'Status', 'Start Date', 'Effort (days)', 'Probability', 'Impact',
+           'Mitigation', 'Remarks', 'Version', 'Reviewer']
+WORDS = ['vendor', 'delay', 'scope', 'release', 'review', 'baseline', 'audit', 'training', 'hardware',
+         'integration', 'customer', 'approval', 'budget', 'schedule', 'quality', 'defect', 'backup', 'license']
+PEOPLE = ['Priya Sharma', 'Omar Haddad', 'Lena Fischer', 'Kenji Sato', 'Ana Costa', 'Ravi Iyer']
+STATUSES = ['Open', 'Closed', 'In Progress', 'On Hold']
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def cell_value(rng, column, row):
+    """A value for ``column`` of data row ``row``; some cells are left blank"""
+    name = COLUMNS[column % len(COLUMNS)]
+    if column > 1 and rng.random() < 0.1:
+        return None
+    if name == 'ID':
+        return f'ID-{row + 1:04d}'
+    if name in ('Description', 'Mitigation', 'Remarks'):
+        return sentence(rng, rng.randint(3, 12))
+    if name in ('Owner', 'Reviewer'):
+        return rng.choice(PEOPLE)
+    if name == 'Status':
+        return rng.choice(STATUSES)
+    if name == 'Start Date':
+        return datetime(2024, 1, 1) + timedelta(days=rng.randint(0, 700))
+    if name == 'Effort (days)':
+        return rng.randint(1, 120)
+    if name in ('Probability', 'Impact'):
+        return round(rng.random(), 2)
+    return f'{rng.randint(1, 9)}.{rng.randint(0, 9)}'
+
+
+def image_bytes(rng, width=64, height=48):
+    """A small PNG in a random colour, so every generated image is distinct"""
+    png = io.BytesIO()
+    Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3))).save(png, format='PNG')
+    return png.getvalue()
+
+
+def fill_section_sheet(ws, rng, rows, cols, tables, images):
+    headers = [COLUMNS[j % len(COLUMNS)] + (f' {j // len(COLUMNS) + 1}' if j >= len(COLUMNS) else '')
+               for j in range(cols)]
+    ws.append([ws.title])
+    ws.append(['Back to TOC'])
+    ws.append([])
+    for table in range(tables):
+        ws.append([sentence(rng, 14)])
+        ws.append([])
+        ws.append(headers)
+        for row in range(rows):
+            ws.append([cell_value(rng, column, row) for column in range(cols)])
+        ws.append([])
+    ws.append(['Back to TOC'])
+
+    # Images sit to the right of the tables, spread down the sheet
+    for index in range(images):
+        row = 1 + index * max(1, ws.max_row // max(images, 1))
+        ws.add_image(WorkbookImage(io.BytesIO(image_bytes(rng))), f'{chr(ord("A") + min(cols + 1, 25))}{row}')
+
+
+def make_plan_workbook(rows=200, cols=8, tables=2, images=1, extra_sheets=0, seed=0):
+    """Return the bytes of a synthetic plan workbook.
+
+    ``rows`` data rows in each of ``tables`` tables per section sheet, ``cols``
+    columns wide, with ``images`` images per sheet. ``extra_sheets`` adds
+    sheets outside the mapping, which become dynamic sections.
+    """
+    rng = random.Random(seed)
+    wb = Workbook()
+    toc = wb.active
+    toc.title = 'TOC'
+    toc.append(['Table of Contents'])
+
+    names = SECTION_SHEETS + [f'Appendix {index + 1}' for index in range(extra_sheets)]
+    for name in names:
+        toc.append([name])
+        fill_section_sheet(wb.create_sheet(name[:31]), rng, rows, cols, tables, images)
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output')
+    parser.add_argument('--rows', type=int, default=200)
+    parser.add_argument('--cols', type=int, default=8)
+    parser.add_argument('--tables', type=int, default=2)
+    parser.add_argument('--images', type=int, default=1)
+    parser.add_argument('--extra-sheets', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    content = make_plan_workbook(args.rows, args.cols, args.tables, args.images, args.extra_sheets, args.seed)
+    with open(args.output, 'wb') as f:
+        f.write(content)
+    print(f"wrote {args.output}: {len(content) / 1e6:.2f} MB, {len(SECTION_SHEETS) + args.extra_sheets} section sheets")
+
+
+if __name__ == '__main__':
+    main()
@@ -42,6 +42,11 @@ const PlanCard = ({ plan, onView, onEdit, onDelete }) => {
             <Button size="sm" variant="outline" onClick={() => onEdit(plan)}>
               <Edit className="h-4 w-4" />
             </Button>
+            <Button size="sm" variant="outline" asChild>
+              <a href={`${API}/plans/${plan.plan_id}/export.xlsx`} title="Export to Excel">
+                <Download className="h-4 w-4" />
+              </a>
+            </Button>
             <Button size="sm" variant="destructive" onClick={() => onDelete(plan)}>
               <Trash2 className="h-4 w-4" />
             </Button>
@@ -308,7 +313,7 @@ const TableRenderer = ({ tables }) => {
   );
 };
 
-const ImageRenderer = ({ images }) => {
+const ImageRenderer = ({ images, planId }) => {
   if (!images || images.length === 0) {
     return null;
   }
@@ -325,12 +330,24 @@ const ImageRenderer = ({ images }) => {
             <div className="text-xs text-gray-500 mb-2">
               Format: {image.format} | Position: {image.anchor}
             </div>
-            <img
-              src={`data:image/${image.format};base64,${image.data}`}
-              alt={`Excel Image ${index + 1}`}
-              className="max-w-full h-auto rounded"
-              style={{ maxHeight: '200px' }}
-            />
+            {image.data ? (
+              <img
+                src={`data:image/${image.format};base64,${image.data}`}
+                alt={`Excel Image ${index + 1}`}
+                className="max-w-full h-auto rounded"
+                style={{ maxHeight: '200px' }}
+              />
+            ) : (
+              <a href={`${API}/plans/${planId}/images/${image.image_id}?variant=original`} target="_blank" rel="noreferrer">
+                <img
+                  src={`${API}/plans/${planId}/images/${image.image_id}`}
+                  loading="lazy"
+                  alt={`Excel Image ${index + 1}`}
+                  className="max-w-full h-auto rounded"
+                  style={{ maxHeight: '200px' }}
+                />
+              </a>
+            )}
           </div>
         ))}
       </div>
@@ -476,7 +493,7 @@ const PlanEditor = ({ plan, isOpen, onClose, onSave }) => {
               )}
 
               {editedPlan[activeSection]?.images && editedPlan[activeSection].images.length > 0 && (
-                <ImageRenderer images={editedPlan[activeSection].images} />
+                <ImageRenderer images={editedPlan[activeSection].images} planId={editedPlan.plan_id} />
               )}
 
               {(!editedPlan[activeSection] || (!editedPlan[activeSection].content?.length && !editedPlan[activeSection].tables?.length)) && (
@@ -496,6 +513,21 @@ const PlanEditor = ({ plan, isOpen, onClose, onSave }) => {
 
 const PlanViewer = ({ plan, isOpen, onClose, onEdit }) => {
   const [activeSection, setActiveSection] = useState('title_sheet');
+  const [loadedSections, setLoadedSections] = useState({});
+
+  // Plans opened from the listing are summaries; fetch each section when it is shown
+  useEffect(() => {
+    setLoadedSections({});
+  }, [plan?.plan_id]);
+
+  useEffect(() => {
+    if (!plan || plan[activeSection] || loadedSections[activeSection]) return;
+    axios.get(`${API}/plans/${plan.plan_id}/sections/${activeSection}`)
+      .then(response => setLoadedSections(loaded => ({ ...loaded, [activeSection]: response.data })))
+      .catch(() => setLoadedSections(loaded => ({ ...loaded, [activeSection]: {} })));
+  }, [plan, activeSection, loadedSections]);
+
+  const section = plan?.[activeSection] || loadedSections[activeSection];
 
   const sections = [
     { key: 'title_sheet', name: 'Title Sheet', icon: '📋' },
@@ -515,11 +547,11 @@ const PlanViewer = ({ plan, isOpen, onClose, onEdit }) => {
   ];
 
   // Include dynamic sections from the plan
-  const dynamicSections = plan ? Object.keys(plan).filter(key => 
+  const sectionKeys = plan ? [...Object.keys(plan), ...Object.keys(plan.section_counts || {})] : [];
+  const dynamicSections = [...new Set(sectionKeys)].filter(key => 
     !sections.some(s => s.key === key) && 
-    typeof plan[key] === 'object' && 
-    plan[key] !== null &&
-    !['id', 'plan_id', 'title', 'created_at', 'updated_at'].includes(key)
+    (plan.section_counts?.[key] || (typeof plan[key] === 'object' && plan[key] !== null)) &&
+    !['id', 'plan_id', 'title', 'created_at', 'updated_at', 'section_counts'].includes(key)
   ).map(key => ({
     key,
     name: key.replace(/_/g, ' ').replace(/\b\w/g, l => l.toUpperCase()),
@@ -583,16 +615,16 @@ const PlanViewer = ({ plan, isOpen, onClose, onEdit }) => {
               </h3>
               
               {/* Metadata */}
-              {plan?.[activeSection]?.metadata && (
+              {section?.metadata && (
                 <div className="text-sm text-gray-600 mb-4">
-                  {plan[activeSection].metadata.sheet_name && (
-                    <span>Sheet: {plan[activeSection].metadata.sheet_name} • </span>
+                  {section.metadata.sheet_name && (
+                    <span>Sheet: {section.metadata.sheet_name} • </span>
                   )}
-                  {plan[activeSection].metadata.total_rows && (
-                    <span>Rows: {plan[activeSection].metadata.total_rows} • </span>
+                  {section.metadata.total_rows && (
+                    <span>Rows: {section.metadata.total_rows} • </span>
                   )}
-                  {plan[activeSection].metadata.processed_items && (
-                    <span>Items: {plan[activeSection].metadata.processed_items}</span>
+                  {section.metadata.processed_items && (
+                    <span>Items: {section.metadata.processed_items}</span>
                   )}
                 </div>
               )}
@@ -600,26 +632,26 @@ const PlanViewer = ({ plan, isOpen, onClose, onEdit }) => {
 
             {/* Content */}
             <div className="space-y-6">
-              {plan?.[activeSection]?.content && (
-                <ContentRenderer content={plan[activeSection].content} />
+              {section?.content && (
+                <ContentRenderer content={section.content} />
               )}
 
-              {plan?.[activeSection]?.tables && plan[activeSection].tables.length > 0 && (
-                <TableRenderer tables={plan[activeSection].tables} />
+              {section?.tables && section.tables.length > 0 && (
+                <TableRenderer tables={section.tables} />
               )}
 
-              {plan?.[activeSection]?.images && plan[activeSection].images.length > 0 && (
-                <ImageRenderer images={plan[activeSection].images} />
+              {section?.images && section.images.length > 0 && (
+                <ImageRenderer images={section.images} planId={plan.plan_id} />
               )}
 
-              {plan?.[activeSection]?.metadata?.error && (
+              {section?.metadata?.error && (
                 <div className="bg-red-50 border border-red-200 rounded-lg p-4">
                   <h4 className="text-red-800 font-semibold mb-2">Error Processing Section</h4>
-                  <p className="text-red-700 text-sm">{plan[activeSection].metadata.error}</p>
+                  <p className="text-red-700 text-sm">{section.metadata.error}</p>
                 </div>
               )}
 
-              {(!plan?.[activeSection] || (!plan[activeSection].content?.length && !plan[activeSection].tables?.length)) && !plan?.[activeSection]?.metadata?.error && (
+              {(!section || (!section.content?.length && !section.tables?.length)) && !section?.metadata?.error && (
                 <div className="text-center py-12">
                   <FileText className="h-16 w-16 text-gray-300 mx-auto mb-4" />
                   <h3 className="text-lg font-semibold text-gray-900 mb-2">No content available</h3>
@@ -636,19 +668,25 @@ const PlanViewer = ({ plan, isOpen, onClose, onEdit }) => {
 
 const Home = () => {
   const [plans, setPlans] = useState([]);
+  const [nextPageToken, setNextPageToken] = useState(null);
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState("");
+  const [searchHits, setSearchHits] = useState([]);
   const [showCreateDialog, setShowCreateDialog] = useState(false);
   const [isUploading, setIsUploading] = useState(false);
   const [selectedPlan, setSelectedPlan] = useState(null);
+  const [planEtag, setPlanEtag] = useState(null);
   const [showViewer, setShowViewer] = useState(false);
   const [showEditor, setShowEditor] = useState(false);
   const { toast } = useToast();
 
-  const loadPlans = async () => {
+  const loadPlans = async (pageToken = null) => {
     try {
-      const response = await axios.get(`${API}/plans`);
-      setPlans(response.data);
+      const response = await axios.get(`${API}/plans`, {
+        params: pageToken ? { page_token: pageToken } : {}
+      });
+      setPlans(pageToken ? [...plans, ...response.data.plans] : response.data.plans);
+      setNextPageToken(response.data.next_page_token);
     } catch (error) {
       console.error("Error loading plans:", error);
       toast({
@@ -665,6 +703,25 @@ const Home = () => {
     loadPlans();
   }, []);
 
+  // Plan contents are searched on the server once the term is long enough
+  useEffect(() => {
+    const q = searchTerm.trim();
+    if (q.length < 3) {
+      setSearchHits([]);
+      return;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get(`${API}/search`, { params: { q } });
+        setSearchHits(response.data.results);
+      } catch (error) {
+        console.error("Error searching plans:", error);
+        setSearchHits([]);
+      }
+    }, 300);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
   const handleCreatePlan = async (title, file = null) => {
     setIsUploading(true);
     try {
@@ -707,9 +764,13 @@ const Home = () => {
 
   const handleSavePlan = async (editedPlan) => {
     try {
-      const { id, plan_id, created_at, ...updateData } = editedPlan;
+      const { id, plan_id, created_at, revision, ...updateData } = editedPlan;
       
-      const response = await axios.put(`${API}/plans/${plan_id}`, updateData);
+      // If-Match makes the save fail with 409 if someone else saved the plan meanwhile
+      const response = await axios.put(`${API}/plans/${plan_id}`, updateData, {
+        headers: planEtag ? { 'If-Match': planEtag } : {}
+      });
+      setPlanEtag(response.headers.etag || null);
       
       toast({
         title: "Success",
@@ -721,7 +782,7 @@ const Home = () => {
     } catch (error) {
       console.error("Error saving plan:", error);
       toast({
-        title: "Error",
+        title: error.response?.status === 409 ? "Plan changed" : "Error",
         description: error.response?.data?.detail || "Failed to save plan",
         variant: "destructive"
       });
@@ -749,18 +810,50 @@ const Home = () => {
     }
   };
 
-  const handleViewPlan = (plan) => {
-    setSelectedPlan(plan);
-    setShowViewer(true);
-    setShowEditor(false);
+  // The listing only carries plan summaries; the viewer loads sections as they
+  // are shown, while the editor needs the full plan
+  const openPlan = async (plan, edit) => {
+    try {
+      const response = edit ? await axios.get(`${API}/plans/${plan.plan_id}`) : { data: plan, headers: {} };
+      setSelectedPlan(response.data);
+      setPlanEtag(response.headers.etag || null);
+      setShowEditor(edit);
+      setShowViewer(!edit);
+    } catch (error) {
+      console.error("Error loading plan:", error);
+      toast({
+        title: "Error",
+        description: "Failed to load plan",
+        variant: "destructive"
+      });
+    }
   };
 
-  const handleEditPlan = (plan) => {
-    setSelectedPlan(plan);
-    setShowEditor(true);
-    setShowViewer(false);
+  const handleViewPlan = (plan) => openPlan(plan, false);
+
+  const handleOpenSearchHit = async (hit) => {
+    const plan = plans.find(p => p.plan_id === hit.plan_id);
+    if (plan) {
+      openPlan(plan, false);
+      return;
+    }
+    try {
+      const response = await axios.get(`${API}/plans/${hit.plan_id}`, {
+        params: { fields: 'id,plan_id,title,created_at,updated_at' }
+      });
+      openPlan(response.data, false);
+    } catch (error) {
+      console.error("Error loading plan:", error);
+      toast({
+        title: "Error",
+        description: "Failed to load plan",
+        variant: "destructive"
+      });
+    }
   };
 
+  const handleEditPlan = (plan) => openPlan(plan, true);
+
   const filteredPlans = plans.filter(plan =>
     plan.title?.toLowerCase().includes(searchTerm.toLowerCase()) ||
     plan.plan_id?.toLowerCase().includes(searchTerm.toLowerCase())
@@ -784,7 +877,7 @@ const Home = () => {
           <div className="flex-1 relative">
             <Search className="absolute left-3 top-1/2 transform -translate-y-1/2 text-gray-400 h-4 w-4" />
             <Input
-              placeholder="Search plans by title or ID..."
+              placeholder="Search plans by title, ID or content..."
               value={searchTerm}
               onChange={(e) => setSearchTerm(e.target.value)}
               className="pl-10"
@@ -796,6 +889,30 @@ const Home = () => {
           </Button>
         </div>
 
+        {/* Content search results */}
+        {searchHits.length > 0 && (
+          <Card className="mb-8">
+            <CardHeader>
+              <CardTitle className="text-base">Matches in plan content</CardTitle>
+            </CardHeader>
+            <CardContent className="space-y-3">
+              {searchHits.map((hit) => (
+                <button
+                  key={`${hit.plan_id}-${hit.section}`}
+                  onClick={() => handleOpenSearchHit(hit)}
+                  className="block w-full text-left p-3 rounded border hover:bg-gray-50"
+                >
+                  <div className="font-medium text-gray-900">
+                    {hit.title || 'Untitled Plan'}{' '}
+                    <Badge variant="secondary">{hit.section ? hit.section.replace(/_/g, ' ') : 'title'}</Badge>
+                  </div>
+                  <div className="text-sm text-gray-600 mt-1">{hit.snippet}</div>
+                </button>
+              ))}
+            </CardContent>
+          </Card>
+        )}
+
         {/* Plans Grid */}
         {loading ? (
           <div className="flex justify-center items-center py-12">
@@ -836,6 +953,14 @@ const Home = () => {
           </div>
         )}
 
+        {!loading && nextPageToken && (
+          <div className="flex justify-center mt-6">
+            <Button variant="outline" onClick={() => loadPlans(nextPageToken)}>
+              Load more plans
+            </Button>
+          </div>
+        )}
+
         {/* Guidelines Section */}
         <div className="mt-12">
           <Separator className="mb-6" />
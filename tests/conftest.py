@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# server.py is run from the backend directory (``uvicorn server:app``)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'backend'))
+# The in-memory database stand-in lives with the benchmarks
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'benchmarks'))
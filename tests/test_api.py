@@ -0,0 +1,706 @@
+import asyncio
+import io
+import zipfile
+from datetime import datetime, timezone
+
+import httpx
+import orjson
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+from openpyxl import Workbook
+from PIL import Image
+
+import server
+from memory_db import MemoryDatabase
+
+
+@pytest.fixture
+def client():
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def memory_db(monkeypatch):
+    """Run the app against the in-memory database stand-in, with an empty response cache"""
+    monkeypatch.setattr(server, 'db', MemoryDatabase())
+    monkeypatch.setattr(server, 'plan_cache', server.PlanResponseCache(server.PLAN_CACHE_MAX_BYTES))
+    return server.db
+
+
+def section_with_rows(*values):
+    return {'content': [], 'tables': [{'headers': ['A'], 'rows': [{'A': value} for value in values]}], 'images': []}
+
+
+def test_upload_rejected_with_retry_after_when_queue_full(client, monkeypatch):
+    monkeypatch.setattr(server, 'uploads_in_flight', server.UPLOAD_WORKERS + server.UPLOAD_QUEUE_LIMIT)
+    response = client.post(
+        '/api/plans/upload',
+        files={'file': ('plan.xlsx', b'not parsed')},
+        data={'title': 'Busy'}
+    )
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(server.UPLOAD_RETRY_AFTER_SECONDS)
+
+
+def test_invalid_page_token_rejected(client):
+    response = client.get('/api/plans', params={'page_token': 'not-a-token'})
+    assert response.status_code == 400
+
+
+def test_page_token_round_trip():
+    plan = {'created_at': datetime(2024, 5, 1, 10, tzinfo=timezone.utc), 'plan_id': 'AB12CD34'}
+    token = server.encode_page_token(plan)
+    assert server.decode_page_token(token) == (plan['created_at'], plan['plan_id'])
+
+
+def test_count_plan_sections_skips_non_sections():
+    plan = {
+        'title': 'Plan',
+        'risk_management': {'content': [{}, {}], 'tables': [{}], 'images': []},
+        'skill_matrix': {'content': [], 'tables': [], 'images': [{}], 'metadata': {}},
+    }
+    assert server.count_plan_sections(plan) == {
+        'risk_management': {'content': 2, 'tables': 1, 'images': 0},
+        'skill_matrix': {'content': 0, 'tables': 0, 'images': 1},
+    }
+
+
+def test_declared_indexes_match_their_server_form():
+    # index_information() reports keys as (field, direction) pairs, sometimes as floats
+    for index in server.INDEXES['plans']:
+        document = index.document
+        reported = {'key': [(field, float(direction)) for field, direction in document['key'].items()]}
+        if document.get('unique'):
+            reported['unique'] = True
+        assert server.index_spec(reported) == server.index_spec(document)
+
+
+def test_text_index_matches_its_server_form():
+    # Mongo reports text indexes by their internal _fts/_ftsx keys
+    document = server.INDEXES['plan_search'][0].document
+    reported = {'key': [('_fts', 'text'), ('_ftsx', 1)], 'weights': {'text': 1}}
+    assert server.index_spec(reported) == server.index_spec(document)
+
+
+def test_plan_field_projection():
+    assert server.plan_field_projection('title, risk_management.tables') == {
+        '_id': 0, 'plan_id': 1, 'title': 1, 'risk_management.tables': 1
+    }
+
+
+@pytest.mark.parametrize('fields', ['', '$where', 'a..b', 'section_counts', '_id'])
+def test_plan_field_projection_rejects_invalid_fields(fields):
+    with pytest.raises(server.HTTPException) as excinfo:
+        server.plan_field_projection(fields)
+    assert excinfo.value.status_code == 400
+
+
+def test_plan_keeps_dynamic_sections():
+    plan = server.ProjectPlan(title='Plan', custom_notes={'content': [], 'tables': [], 'images': []})
+    assert 'custom_notes' in plan.dict()
+
+
+def test_plan_revision_filter_from_if_match():
+    assert server.plan_etag({'plan_id': 'AB12CD34', 'revision': 3}) == '"AB12CD34-3"'
+    assert server.plan_revision_filter('AB12CD34', 'W/"AB12CD34-3", "OTHER-4"') == {
+        'plan_id': 'AB12CD34', 'revision': {'$in': [3]}
+    }
+    # Plans saved before revisions existed have no revision field
+    assert server.plan_revision_filter('AB12CD34', '"AB12CD34-0"')['revision'] == {'$in': [0, None]}
+    assert server.plan_revision_filter('AB12CD34', '*') == {'plan_id': 'AB12CD34'}
+    assert server.plan_revision_filter('AB12CD34', '"OTHER-1"') is None
+    assert server.plan_etag({'plan_id': 'AB12CD34', 'revision': 3}, 'columnar') == '"AB12CD34-3-columnar"'
+    assert server.plan_revision_filter('AB12CD34', '"AB12CD34-3-columnar"')['revision'] == {'$in': [3]}
+
+
+def operation_steps(*operations):
+    steps = []
+    for operation in operations:
+        steps.extend(server.plan_operation_steps(server.PlanOperation(**operation)))
+    return steps
+
+
+def test_set_cell_targets_only_the_cell():
+    steps = operation_steps({'op': 'set_cell', 'section': 'deliverables', 'table': 0, 'row': 12, 'column': 'Owner', 'value': 'Ana'})
+    assert steps == [(
+        {'$set': {'deliverables.tables.0.rows.12.Owner': 'Ana'}},
+        {'deliverables.tables.0.rows.12': {'$exists': True}}
+    )]
+
+
+def test_operations_on_unrelated_paths_share_an_update():
+    batches = server.merge_update_steps(operation_steps(
+        {'op': 'set_cell', 'section': 'deliverables', 'table': 0, 'row': 1, 'column': 'Owner', 'value': 'Ana'},
+        {'op': 'set_cell', 'section': 'deliverables', 'table': 0, 'row': 2, 'column': 'Owner', 'value': 'Bo'},
+        {'op': 'delete_row', 'section': 'deliverables', 'table': 0, 'row': 5},
+        {'op': 'append_content', 'section': 'risk_management', 'value': {'type': 'paragraph', 'content': 'x'}},
+    ))
+    # Sections are separate documents, so a batch never spans two of them; a delete is a pipeline of its own
+    assert [(batch['section'], sorted(batch['update']) if isinstance(batch['update'], dict) else 'pipeline')
+            for batch in batches] == [
+        ('deliverables', ['$set']), ('deliverables', 'pipeline'), ('risk_management', ['$inc', '$push'])
+    ]
+
+
+def test_section_document_update_moves_paths_under_data():
+    batch, = server.merge_update_steps(operation_steps(
+        {'op': 'append_content', 'section': 'risk_management', 'value': {'type': 'paragraph', 'content': 'x'}},
+    ))
+    update, conditions, counts = server.section_document_update(batch)
+    assert update == {'$push': {'data.content': {'type': 'paragraph', 'content': 'x'}}}
+    assert conditions == {'data': {'$exists': True}}
+    assert counts == {'section_counts.risk_management.content': 1}
+
+
+def test_split_plan_document_keeps_section_order():
+    document = server.plan_document(server.ProjectPlan(title='Plan', custom_notes={'content': [], 'tables': []}))
+    header, sections = server.split_plan_document(document)
+    assert header['section_keys'] == [section['key'] for section in sections]
+    assert header['section_keys'][0] == 'title_sheet' and header['section_keys'][-1] == 'custom_notes'
+    assert not set(header['section_keys']) & set(header)
+    assert server.section_projection({'_id': 0, 'plan_id': 1, 'title': 1, 'custom_notes.tables': 1}, header['section_keys']) == (
+        {'custom_notes': ['data.tables']}, {'_id': 0, 'key': 1, 'data.tables': 1}
+    )
+
+
+@pytest.mark.parametrize('operation', [
+    {'op': 'rename', 'section': 'deliverables'},
+    {'op': 'append_content', 'section': 'plan_id', 'value': 'x'},
+    {'op': 'set_cell', 'section': 'deliverables', 'table': 0, 'row': 0, 'column': 'S.No.', 'value': 1},
+    {'op': 'delete_row', 'section': 'deliverables', 'table': 0},
+])
+def test_invalid_operations_rejected(operation):
+    with pytest.raises(server.HTTPException) as excinfo:
+        operation_steps(operation)
+    assert excinfo.value.status_code == 400
+
+
+def test_fast_read_path_matches_model_fields():
+    stored = server.ProjectPlan(title='Plan', custom_notes={'content': [{'type': 'paragraph', 'content': 'é'}]}).dict()
+    del stored['revision']  # saved before revisions existed
+    body = b''.join(server.iter_json_object(server.fill_plan_defaults(stored)))
+    parsed = server.ProjectPlan.model_validate_json(body)
+    assert parsed.revision == 0
+    assert parsed.dict() == {**stored, 'revision': 0}
+    # Dates are formatted as in the responses FastAPI serializes
+    assert orjson.loads(body)['created_at'] == orjson.loads(parsed.model_dump_json())['created_at']
+    assert orjson.loads(body)['created_at'].endswith('Z')
+
+
+def test_etag_matches_if_none_match():
+    assert server.etag_matches('"A-1", W/"A-2"', '"A-2"')
+    assert server.etag_matches('*', '"A-2"')
+    assert not server.etag_matches('"A-1"', '"A-2"')
+    assert not server.etag_matches(None, '"A-2"')
+
+
+def test_plan_cache_evicts_and_invalidates():
+    cache = server.PlanResponseCache(max_bytes=10)
+    cache.put('A', 1, '"A-0"', b'aaaaaa', cache.generation('A'))
+    cache.put('B', 2, '"B-0"', b'bbbbbb', cache.generation('B'))
+    assert cache.get('A') is None and cache.get('B')[1] == b'bbbbbb'
+    
+    cache.invalidate_doc(2)
+    assert cache.get('B') is None
+    assert cache.snapshot()['bytes'] == 0
+
+
+def test_plan_cache_skips_responses_read_before_an_invalidation():
+    cache = server.PlanResponseCache(max_bytes=1024)
+    generation = cache.generation('A')
+    cache.invalidate('A')  # a write lands while the old revision is being served
+    assert b''.join(cache.tee('A', 1, '"A-0"', iter([b'{', b'}']), generation)) == b'{}'
+    assert cache.get('A') is None
+    
+    # Only the latest invalidations are remembered, reads from before older ones are not cached
+    cache = server.PlanResponseCache(max_bytes=1024, max_invalidations=2)
+    generation = cache.generation('A')
+    for plan_id in ['A', 'B', 'C', 'B']:
+        cache.invalidate(plan_id)
+    assert list(cache.invalidated_at) == ['C', 'B']
+    cache.put('A', 1, '"A-0"', b'{}', generation)
+    assert cache.get('A') is None
+    cache.put('A', 1, '"A-1"', b'{}', cache.generation('A'))
+    assert cache.get('A')[0] == '"A-1"'
+
+
+def test_import_lists_workbooks_in_zip_archives():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('plans/a.xlsx', b'a')
+        zf.writestr('plans/~$a.xlsx', b'lock file')
+        zf.writestr('__MACOSX/plans/._a.xlsx', b'resource fork')
+        zf.writestr('plans/readme.txt', b'not a workbook')
+    archive.seek(0)
+    files = [
+        UploadFile(file=archive, filename='batch.zip'),
+        UploadFile(file=io.BytesIO(b'b'), filename='b.xls'),
+        UploadFile(file=io.BytesIO(b'c'), filename='c.csv'),
+    ]
+    results, sources = server.list_import_workbooks(files)
+    
+    assert [entry.filename for entry in results] == ['batch.zip/plans/a.xlsx', 'b.xls', 'c.csv']
+    assert [entry.status for entry in results] == ['pending', 'pending', 'failed']
+    assert [read() for _, read in sources] == [b'a', b'b']
+
+
+def test_import_reports_failures_after_parsing_per_workbook(client, memory_db, monkeypatch):
+    async def parse_upload(content):
+        # A sheet whose section key clashes with a plan field
+        return {'title': {'content': []}} if content == b'clash' else {'risk_management': section_with_rows('1')}
+    monkeypatch.setattr(server, 'parse_upload', parse_upload)
+    files = [('files', ('good.xlsx', b'good')), ('files', ('clash.xlsx', b'clash'))]
+    
+    response = client.post('/api/plans/import', files=files)
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert [entry['status'] for entry in results] == ['imported', 'failed']
+    assert client.get(f"/api/plans/{results[0]['plan_id']}").status_code == 200
+    
+    async def insert_plans(plan_objs):
+        raise RuntimeError('database unavailable')
+    monkeypatch.setattr(server, 'insert_plans', insert_plans)
+    response = client.post('/api/plans/import', files=files[:1])
+    assert response.status_code == 200
+    assert response.json()['results'][0]['status'] == 'failed'
+    assert 'database unavailable' in response.json()['results'][0]['error']
+
+
+def test_import_parses_concurrently_only_on_free_upload_slots(client, memory_db, monkeypatch):
+    monkeypatch.setattr(server, 'UPLOAD_WORKERS', 3)
+    monkeypatch.setattr(server, 'IMPORT_CONCURRENCY', 3)
+    observed, active = [], []
+    async def parse_upload(content):
+        active.append(content)
+        observed.append((server.uploads_in_flight, len(active)))
+        await asyncio.sleep(0.01)
+        active.remove(content)
+        return {'risk_management': section_with_rows('1')}
+    monkeypatch.setattr(server, 'parse_upload', parse_upload)
+    files = [('files', (f'plan{index}.xlsx', b'workbook')) for index in range(6)]
+    
+    # Every concurrent parse counts against the upload limit
+    assert client.post('/api/plans/import', files=files).status_code == 200
+    assert max(observed) == (3, 3) and server.uploads_in_flight == 0
+    
+    # With two workers busy, the import parses on its own slot, one workbook at a time
+    observed.clear()
+    monkeypatch.setattr(server, 'uploads_in_flight', 2)
+    assert client.post('/api/plans/import', files=files).status_code == 200
+    assert set(observed) == {(3, 1)} and server.uploads_in_flight == 2
+
+
+def test_section_search_lines_cover_paragraphs_rows_and_tables():
+    section = {
+        'content': [
+            {'type': 'section', 'content': [
+                {'type': 'paragraph', 'content': 'Risks are reviewed weekly', 'position': 0},
+                {'type': 'row', 'content': ['Owner', '', 'Priya'], 'position': 1},
+            ]},
+            {'type': 'navigation', 'content': 'Back to TOC', 'position': 2},
+            {'type': 'table', 'table_index': 0, 'position': 3},
+        ],
+        'tables': [{'headers': ['Risk', 'Owner'], 'rows': [{'Risk': 'Vendor delay', 'Owner': None}], 'position': 3}],
+    }
+    assert server.section_search_lines(section) == [
+        'Risks are reviewed weekly', 'Owner | Priya', 'Risk | Owner', 'Vendor delay'
+    ]
+
+
+def test_search_finds_sections_indexed_after_their_writes(memory_db):
+    async def scenario():
+        await server.ensure_indexes()
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            plan_id = (await client.post('/api/plans', json={'title': 'Rollout'})).json()['plan_id']
+            section = {'risk_management': section_with_rows('Vendor delay', 'Budget overrun')}
+            assert (await client.put(f'/api/plans/{plan_id}', json=section)).status_code == 200
+            patch = {'operations': [{'op': 'set_cell', 'section': 'risk_management', 'table': 0, 'row': 1,
+                                     'column': 'A', 'value': 'Staffing gap'}]}
+            assert (await client.patch(f'/api/plans/{plan_id}', json=patch)).status_code == 200
+            # Indexing runs after the response
+            assert plan_id in server.search_index_running
+            await asyncio.gather(*server.background_tasks)
+            return plan_id, [(await client.get('/api/search', params=params)).json()['results'] for params in (
+                {'q': 'staffing'}, {'q': 'budget'}, {'q': 'vendor', 'sections': 'skill_matrix'}, {'q': 'rollout'}
+            )]
+    
+    plan_id, (staffing, budget, elsewhere, title) = asyncio.run(scenario())
+    assert [(hit['plan_id'], hit['section'], hit['snippet']) for hit in staffing] == [
+        (plan_id, 'risk_management', 'Staffing gap')
+    ]
+    assert budget == [] and elsewhere == []
+    assert [(hit['section'], hit['title']) for hit in title] == [(None, 'Rollout')]
+
+
+def test_search_snippet_centres_on_the_first_match():
+    lines = ['Introduction', 'x' * 200 + ' vendor risks ' + 'y' * 200]
+    snippet = server.search_snippet(lines, server.search_terms('risk -kubernetes'))
+    assert snippet.startswith('…') and snippet.endswith('…')
+    assert 'vendor risks' in snippet
+    assert len(snippet) <= server.SEARCH_SNIPPET_CHARS + 2
+    assert server.search_snippet(lines, ['absent']) == 'Introduction'
+
+
+def test_histogram_buckets_are_cumulative_and_merge_across_processes():
+    worker = server.Histogram('stage_seconds', 'Stage time.', ('stage',), (0.1, 1))
+    worker.observe(0.05, 'parse')
+    worker.observe(5, 'parse')
+    parent = server.Histogram('stage_seconds', 'Stage time.', ('stage',), (0.1, 1))
+    parent.observe(0.5, 'parse')
+    parent.merge(worker.drain())
+    
+    assert worker.samples == {}
+    lines = parent.render().splitlines()
+    assert 'stage_seconds_bucket{stage="parse",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="parse",le="1"} 2' in lines
+    assert 'stage_seconds_bucket{stage="parse",le="+Inf"} 3' in lines
+    assert 'stage_seconds_count{stage="parse"} 3' in lines
+
+
+def test_metrics_label_requests_by_route(client):
+    client.get('/api/plans', params={'page_token': 'not-a-token'})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert 'http_request_seconds_count{method="GET",route="/api/plans",status="400"}' in response.text
+
+
+def test_metrics_expose_the_cache_counters(client, memory_db):
+    plan_id = client.post('/api/plans', json={'title': 'Plan'}).json()['plan_id']
+    etag = client.get(f'/api/plans/{plan_id}').headers['ETag']
+    body = client.get(f'/api/plans/{plan_id}').content
+    assert client.get(f'/api/plans/{plan_id}', headers={'If-None-Match': etag}).status_code == 304
+    lines = client.get('/metrics').text.splitlines()
+    assert 'plan_response_cache_hits_total 1' in lines and 'plan_response_cache_misses_total 1' in lines
+    assert f'plan_response_cache_bytes_saved_total {2 * len(body)}' in lines
+    assert 'plan_response_cache_hit_rate 0.5' in lines and 'plan_response_cache_change_stream 0' in lines
+    assert '# TYPE parse_cache_hits_total counter' in lines and '# TYPE parse_cache_bytes gauge' in lines
+
+
+def test_columnar_tables_decode_back_to_their_rows():
+    rows = [
+        {'ID': 'ID-0001', 'Start': '2024-01-01 00:00:00', 'Level': '', 'Note': 'a\tb'},
+        {'ID': 'ID-0002', 'Start': '', 'Level': 3, 'Note': None},
+        {'ID': 'ID-', 'Start': '2024-02-01 00:00:00', 'Level': '', 'Extra': True},
+        {'ID': 'ID-0004', 'Level': ''},
+    ]
+    table = {'headers': ['ID', 'Start', 'Level', 'Note'], 'rows': rows, 'position': 7}
+    encoded = server.encode_table(table)
+    assert list(encoded) == ['headers', 'columns', 'row_count', 'keys', 'position']
+    assert server.decode_table(encoded) == table
+    assert server.table_rows(encoded) == rows == server.table_rows(table)
+    
+    empty = {'headers': ['A'], 'rows': [], 'position': 0}
+    assert server.decode_table(server.encode_table(empty)) == empty
+    section = {'content': [], 'tables': [table, {'type': 'image'}], 'images': []}
+    assert server.section_table_format(server.convert_section_tables(section, 'columnar')) == 'columnar'
+    assert server.convert_section_tables(section, 'rows')['tables'] == [table, {'type': 'image'}]
+
+
+def test_columnar_tables_halve_sparse_skill_matrices():
+    skills = ['Python', 'React', 'MongoDB', 'Docker', 'Kubernetes', 'Excel', 'Testing', 'Design']
+    headers = ['Name', 'Role'] + skills
+    rows = [
+        {'Name': f'Member {i}', 'Role': 'Developer' if i % 3 else 'Lead',
+         **{skill: ('Expert' if (i + j) % 7 == 0 else '') for j, skill in enumerate(skills)}}
+        for i in range(60)
+    ]
+    table = {'headers': headers, 'rows': rows, 'position': 3}
+    encoded = server.encode_table(table)
+    assert len(server.orjson.dumps(encoded)) < len(server.orjson.dumps(table)) / 2
+    assert len(server.bson.encode(encoded)) < len(server.bson.encode(table)) / 2
+    assert server.decode_table(encoded) == table
+
+
+def test_apply_plan_operation_edits_rows_or_reports_missing_targets():
+    section = {'content': [], 'tables': [{'headers': ['A'], 'rows': [{'A': '1'}, {'A': '2'}]}]}
+    
+    def apply(**operation):
+        return server.apply_plan_operation(section, server.PlanOperation(section='s', **operation))
+    
+    assert apply(op='set_cell', table=0, row=1, column='A', value='x')
+    assert apply(op='insert_row', table=0, row=0, value={'A': '0'})
+    assert apply(op='insert_row', table=0, value={'A': 'end'})
+    assert apply(op='delete_row', table=0, row=2)
+    assert apply(op='append_content', value={'type': 'paragraph', 'content': 'note'})
+    assert section['tables'][0]['rows'] == [{'A': '0'}, {'A': '1'}, {'A': 'end'}]
+    assert section['content'] == [{'type': 'paragraph', 'content': 'note'}]
+    
+    assert not apply(op='set_cell', table=0, row=3, column='A', value='x')
+    assert not apply(op='insert_row', table=0, row=5, value={'A': 'x'})
+    assert not apply(op='delete_row', table=1, row=0)
+
+
+def test_put_with_a_stale_if_match_is_rejected(client, memory_db, monkeypatch):
+    plan_id = client.post('/api/plans', json={'title': 'Plan'}).json()['plan_id']
+    assert client.put(f'/api/plans/{plan_id}', json={'title': 'First'}, headers={'If-Match': f'"{plan_id}-0"'}).status_code == 200
+    stale = client.put(f'/api/plans/{plan_id}', json={'title': 'Second'}, headers={'If-Match': f'"{plan_id}-0"'})
+    assert stale.status_code == 409
+    
+    # A title-only write landing between the revision check and the header update
+    writable_plan = server.writable_plan
+    async def racing_writable_plan(*args):
+        plan = await writable_plan(*args)
+        await server.db.plans.update_one({'plan_id': plan_id}, {'$set': {'title': 'Racing'}, '$inc': {'revision': 1}})
+        return plan
+    monkeypatch.setattr(server, 'writable_plan', racing_writable_plan)
+    raced = client.put(f'/api/plans/{plan_id}', json={'title': 'Lost'}, headers={'If-Match': f'"{plan_id}-1"'})
+    assert raced.status_code == 409
+    assert client.get(f'/api/plans/{plan_id}').json()['title'] == 'Racing'
+
+
+def test_columnar_responses_carry_their_own_etag(client, memory_db):
+    plan_id = client.post('/api/plans', json={'title': 'Plan', 'skill_matrix': section_with_rows('x')}).json()['plan_id']
+    rows_etag = client.get(f'/api/plans/{plan_id}').headers['ETag']
+    columnar = client.get(f'/api/plans/{plan_id}?tables=columnar')
+    assert columnar.headers['ETag'] == f'"{plan_id}-0-columnar"' != rows_etag
+    assert client.get(f'/api/plans/{plan_id}?tables=columnar', headers={'If-None-Match': rows_etag}).status_code == 200
+    assert client.get(f'/api/plans/{plan_id}?tables=columnar',
+                      headers={'If-None-Match': columnar.headers['ETag']}).status_code == 304
+    section = client.get(f'/api/plans/{plan_id}/sections/skill_matrix?tables=columnar')
+    assert section.headers['ETag'] == f'"{plan_id}-0-skill_matrix-columnar"'
+    
+    updated = client.put(f'/api/plans/{plan_id}?tables=columnar', json={'title': 'Renamed'},
+                         headers={'If-Match': columnar.headers['ETag']})
+    assert updated.status_code == 200 and updated.headers['ETag'] == f'"{plan_id}-1-columnar"'
+
+
+def test_put_failing_on_a_later_section_moves_the_revision_past_the_written_ones(client, memory_db, monkeypatch):
+    plan_id = client.post('/api/plans', json={'title': 'Plan'}).json()['plan_id']
+    assert client.get(f'/api/plans/{plan_id}').headers['ETag'] == f'"{plan_id}-0"'
+    
+    write_plan_section = server.write_plan_section
+    async def failing_write(query, update, upsert=False):
+        if query['key'] == 'skill_matrix':
+            raise server.section_too_large()
+        return await write_plan_section(query, update, upsert)
+    monkeypatch.setattr(server, 'write_plan_section', failing_write)
+    body = {'risk_management': section_with_rows('new'), 'skill_matrix': section_with_rows('x')}
+    response = client.put(f'/api/plans/{plan_id}', json=body, headers={'If-Match': f'"{plan_id}-0"'})
+    assert response.status_code == 413
+    assert 'risk_management were saved' in response.json()['detail']
+    assert response.headers['ETag'] == f'"{plan_id}-1"'
+    
+    plan = client.get(f'/api/plans/{plan_id}')
+    assert plan.headers['ETag'] == f'"{plan_id}-1"'
+    assert plan.json()['risk_management']['tables'][0]['rows'] == [{'A': 'new'}]
+    monkeypatch.setattr(server, 'write_plan_section', write_plan_section)
+    retry = client.put(f'/api/plans/{plan_id}', json=body, headers={'If-Match': f'"{plan_id}-1"'})
+    assert retry.status_code == 200 and retry.headers['ETag'] == f'"{plan_id}-2"'
+
+
+def test_oversized_put_section_is_rejected_before_any_write(client, memory_db, monkeypatch):
+    plan_id = client.post('/api/plans', json={'title': 'Plan'}).json()['plan_id']
+    monkeypatch.setattr(server, 'PLAN_SECTION_MAX_BYTES', 1000)
+    body = {'risk_management': section_with_rows('small'), 'skill_matrix': section_with_rows('x' * 2000)}
+    assert client.put(f'/api/plans/{plan_id}', json=body).status_code == 413
+    plan = client.get(f'/api/plans/{plan_id}')
+    assert plan.headers['ETag'] == f'"{plan_id}-0"' and plan.json()['risk_management']['tables'] == []
+
+
+def test_put_clears_a_section_sent_as_null(client, memory_db):
+    plan_id = client.post('/api/plans', json={'title': 'Plan', 'risk_management': section_with_rows('x')}).json()['plan_id']
+    response = client.put(f'/api/plans/{plan_id}', json={'risk_management': None}, headers={'If-Match': f'"{plan_id}-0"'})
+    assert response.status_code == 200 and response.json()['risk_management'] is None
+    assert client.get(f'/api/plans/{plan_id}').json()['risk_management'] is None
+
+
+def test_field_projection_reads_only_the_requested_sections(client, memory_db):
+    plan_id = client.post('/api/plans', json={'title': 'Plan'}).json()['plan_id']
+    client.put(f'/api/plans/{plan_id}', json={'deliverables': section_with_rows('d1', 'd2')})
+    plan = client.get(f'/api/plans/{plan_id}', params={'fields': 'title,deliverables.tables'}).json()
+    assert plan == {'plan_id': plan_id, 'title': 'Plan', 'deliverables': {'tables': section_with_rows('d1', 'd2')['tables']}}
+
+
+def test_split_stored_plan_moves_inline_sections_out(client, memory_db):
+    legacy = server.plan_document(server.ProjectPlan(title='Legacy', risk_management=section_with_rows('1')))
+    legacy.pop('revision')
+    asyncio.run(server.db.plans.insert_one(legacy))
+    plan_id = legacy['plan_id']
+    before = client.get(f'/api/plans/{plan_id}').json()
+    
+    assert asyncio.run(server.split_stored_plan(plan_id))
+    header = asyncio.run(server.db.plans.find_one({'plan_id': plan_id}))
+    assert 'risk_management' not in header and 'risk_management' in header['section_keys']
+    section = asyncio.run(server.db.plan_sections.find_one({'plan_id': plan_id, 'key': 'risk_management'}))
+    assert section['data'] == section_with_rows('1')
+    assert client.get(f'/api/plans/{plan_id}').json() == before
+    assert not asyncio.run(server.split_stored_plan('missing'))
+
+
+def test_delete_row_is_a_single_write_and_revision(client, memory_db, monkeypatch):
+    plan_id = client.post('/api/plans', json={'title': 'Plan'}).json()['plan_id']
+    client.put(f'/api/plans/{plan_id}', json={'risk_management': section_with_rows('1', '2', '3')})
+    client.put(f'/api/plans/{plan_id}', json={'skill_matrix': section_with_rows('a')})
+    etag = client.get(f'/api/plans/{plan_id}').headers['ETag']
+    
+    writes = []
+    write_plan_section = server.write_plan_section
+    async def recording_write(query, update, upsert=False):
+        writes.append(update)
+        return await write_plan_section(query, update, upsert)
+    monkeypatch.setattr(server, 'write_plan_section', recording_write)
+    operation = {'op': 'delete_row', 'section': 'risk_management', 'table': 0, 'row': 1}
+    response = client.patch(f'/api/plans/{plan_id}', json={'operations': [operation]}, headers={'If-Match': etag})
+    assert response.status_code == 200 and response.json()['revision'] == 3
+    assert len(writes) == 1 and isinstance(writes[0], list)
+    section = client.get(f'/api/plans/{plan_id}/sections/risk_management').json()
+    assert section['tables'][0] == {'headers': ['A'], 'rows': [{'A': '1'}, {'A': '3'}]}
+    
+    # A row past the end is reported, not deleted
+    operation['row'] = 2
+    missing = client.patch(f'/api/plans/{plan_id}', json={'operations': [operation]}, headers={'If-Match': response.headers['ETag']})
+    assert missing.status_code == 422
+    
+    # Only the addressed table of a section changes
+    tables = [{'headers': ['A'], 'rows': [{'A': 'x'}, {'A': 'y'}]}, {'headers': ['B'], 'rows': [{'B': 'z'}]}]
+    client.put(f'/api/plans/{plan_id}', json={'deliverables': {'content': [], 'tables': tables, 'images': []}})
+    operation = {'op': 'delete_row', 'section': 'deliverables', 'table': 0, 'row': 0}
+    assert client.patch(f'/api/plans/{plan_id}', json={'operations': [operation]}).status_code == 200
+    assert client.get(f'/api/plans/{plan_id}/sections/deliverables').json()['tables'] == [
+        {'headers': ['A'], 'rows': [{'A': 'y'}]}, {'headers': ['B'], 'rows': [{'B': 'z'}]}
+    ]
+
+
+def png_bytes(colour, size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, colour).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_renditions_are_stored_apart_and_one_failing_image_skips_only_itself(client, memory_db, monkeypatch):
+    monkeypatch.setattr(server, 'UPLOAD_WORKERS', 0)
+    images = {'red': ('png', png_bytes('red')), 'blue': ('png', png_bytes('blue'))}
+    asyncio.run(server.store_plan_images('P1', images))
+    
+    update_one = memory_db.plan_image_renditions.update_one
+    async def failing_update_one(query, update, upsert=False):
+        if query['_id'].startswith('red:'):
+            raise server.DocumentTooLarge('too large')
+        return await update_one(query, update, upsert)
+    monkeypatch.setattr(memory_db.plan_image_renditions, 'update_one', failing_update_one)
+    asyncio.run(server.build_missing_renditions(['red', 'blue']))
+    
+    blue = asyncio.run(memory_db.plan_images.find_one({'_id': 'blue'}))
+    assert 'data' not in blue['renditions']['thumbnail'] and blue['width'] == 40
+    thumbnail = asyncio.run(memory_db.plan_image_renditions.find_one({'_id': 'blue:thumbnail'}))
+    response = client.get('/api/plans/P1/images/blue')
+    assert response.content == thumbnail['data']
+    assert response.headers['Cache-Control'].endswith('immutable')
+    # The failed image keeps serving its original until renditions are built
+    assert client.get('/api/plans/P1/images/red').content == images['red'][1]
+
+
+def workbook_bytes(*sheet_names):
+    wb = Workbook()
+    wb.active.title = sheet_names[0]
+    for name in sheet_names[1:]:
+        wb.create_sheet(name)
+    for ws in wb.worksheets:
+        ws.append([f'{ws.title} overview'])
+        ws.append(['ID', 'Description'])
+        ws.append(['1', 'Vendor delay'])
+        ws.append(['2', 'Scope change'])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def test_upload_job_runs_to_completion_with_sheet_progress(memory_db, monkeypatch):
+    monkeypatch.setattr(server, 'UPLOAD_WORKERS', 0)
+    # Progress of another job whose parse finished first stays queued for that job
+    progress_queue = server.queue.SimpleQueue()
+    progress_queue.put(('other-job', 'Elsewhere', 1))
+    monkeypatch.setattr(server, 'upload_progress_queue', progress_queue)
+    states = []
+    parse_upload = server.parse_upload
+    async def recording_parse_upload(content, job_id=None, profile=False):
+        states.append((await memory_db.upload_jobs.find_one({'job_id': job_id}))['state'])
+        return await parse_upload(content, job_id, profile)
+    monkeypatch.setattr(server, 'parse_upload', recording_parse_upload)
+    
+    async def scenario():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            files = {'file': ('plan.xlsx', workbook_bytes('Risk Management', 'Skill Matrix'))}
+            created = await client.post('/api/plans/upload/jobs', files=files, data={'title': 'Queued'})
+            assert created.status_code == 202 and created.json()['state'] == 'queued'
+            url = f"/api/plans/upload/jobs/{created.json()['job_id']}"
+            for _ in range(100):
+                job = (await client.get(url)).json()
+                if job['state'] in ('completed', 'failed'):
+                    return job
+                await asyncio.sleep(0.02)
+    
+    job = asyncio.run(scenario())
+    assert states == ['running']
+    assert job['state'] == 'completed' and job['plan_id']
+    assert job['sheets_done'] == ['Risk Management', 'Skill Matrix'] and job['sheets_total'] == 2
+    assert progress_queue.get_nowait() == ('other-job', 'Elsewhere', 1)
+
+
+def test_stale_upload_jobs_are_failed(client, memory_db):
+    stale = server.UploadJob(title='Stale', filename='plan.xlsx', state='running')
+    stale.heartbeat_at -= server.timedelta(seconds=server.UPLOAD_JOB_STALE_SECONDS + 1)
+    fresh = server.UploadJob(title='Fresh', filename='plan.xlsx', state='running')
+    asyncio.run(memory_db.upload_jobs.insert_many([stale.dict(), fresh.dict()]))
+    
+    job = client.get(f'/api/plans/upload/jobs/{stale.job_id}').json()
+    assert job['state'] == 'failed' and job['error'] == 'Upload was interrupted before it finished'
+    assert client.get(f'/api/plans/upload/jobs/{fresh.job_id}').json()['state'] == 'running'
+
+
+def test_take_plan_images_leaves_references_in_the_sections():
+    red = png_bytes('red')
+    sections = {
+        'risk_management': {'images': [{'image_id': 'r1', 'format': 'png', 'anchor': 'B2', 'data': red}]},
+        'skill_matrix': {'images': [{'image_id': 'r1', 'format': 'png', 'anchor': 'C4', 'data': red}]},
+        'deliverables': {'content': []},
+    }
+    assert server.take_plan_images(sections) == {'r1': ('png', red)}
+    assert sections['risk_management']['images'] == [{'image_id': 'r1', 'format': 'png', 'anchor': 'B2'}]
+    assert 'data' not in sections['skill_matrix']['images'][0]
+
+
+def test_plan_images_are_shared_and_released_with_their_last_plan(client, memory_db, monkeypatch):
+    monkeypatch.setattr(server, 'UPLOAD_WORKERS', 0)
+    first = client.post('/api/plans', json={'title': 'First'}).json()['plan_id']
+    second = client.post('/api/plans', json={'title': 'Second'}).json()['plan_id']
+    red, blue = ('png', png_bytes('red')), ('png', png_bytes('blue'))
+    asyncio.run(server.store_plan_images(first, {'red': red, 'blue': blue}))
+    asyncio.run(server.store_plan_images(second, {'red': red}))
+    asyncio.run(server.build_missing_renditions(['red', 'blue']))
+    
+    stored = asyncio.run(memory_db.plan_images.find({}, {'plan_ids': 1}).to_list(None))
+    assert sorted((image['_id'], sorted(image['plan_ids'])) for image in stored) == [
+        ('blue', [first]), ('red', sorted([first, second]))
+    ]
+    
+    assert client.delete(f'/api/plans/{first}').status_code == 200
+    assert asyncio.run(memory_db.plan_images.find_one({'_id': 'blue'})) is None
+    assert asyncio.run(memory_db.plan_image_renditions.find_one({'image_id': 'blue'})) is None
+    assert asyncio.run(memory_db.plan_images.find_one({'_id': 'red'}))['plan_ids'] == [second]
+    assert client.get(f'/api/plans/{first}/images/red').status_code == 404
+    assert client.get(f'/api/plans/{second}/images/red').status_code == 200
+
+
+def test_plan_image_is_served_with_an_etag_and_revalidated(client, memory_db, monkeypatch):
+    monkeypatch.setattr(server, 'UPLOAD_WORKERS', 0)
+    red = png_bytes('red', (400, 300))
+    asyncio.run(server.store_plan_images('P1', {'red': ('png', red)}))
+    
+    # Until renditions exist the original stands in, and may not be cached for good
+    fallback = client.get('/api/plans/P1/images/red')
+    assert fallback.content == red and fallback.headers['Cache-Control'] == 'no-cache'
+    assert fallback.headers['ETag'] == '"red-original"'
+    
+    asyncio.run(server.build_missing_renditions(['red']))
+    thumbnail = client.get('/api/plans/P1/images/red')
+    assert thumbnail.headers['ETag'] == '"red-thumbnail"'
+    assert Image.open(io.BytesIO(thumbnail.content)).size[0] <= server.IMAGE_THUMBNAIL_SIZE
+    revalidated = client.get('/api/plans/P1/images/red', headers={'If-None-Match': '"red-thumbnail"'})
+    assert revalidated.status_code == 304 and revalidated.content == b''
+    original = client.get('/api/plans/P1/images/red', params={'variant': 'original'})
+    assert original.content == red and original.headers['content-type'] == 'image/png'
+    assert client.get('/api/plans/P1/images/red', params={'variant': 'huge'}).status_code == 400
@@ -0,0 +1,172 @@
+import asyncio
+import io
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.drawing.image import Image as XLImage
+from PIL import Image
+
+import server
+from server import ParseCache, fingerprint_workbook, open_workbook, process_excel_data, process_sheet_content
+
+
+def make_workbook_bytes():
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Risk Management'
+    ws.append(['Risk register for the project, updated weekly'])
+    ws.append(['ID', 'Description', 'Probability'])
+    ws.append(['R1', 'Vendor delay', 0.5])
+    ws.append(['R2', 'Scope creep', 1])
+    ws.append(['NA', None, 3.25])
+
+    other = wb.create_sheet('Custom Notes')
+    other.append(['Back to TOC'])
+    png = io.BytesIO()
+    Image.new('RGB', (4, 3), 'red').save(png, format='PNG')
+    png.seek(0)
+    other.add_image(XLImage(png), 'B2')
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def test_single_parse_matches_pandas_reader():
+    content = make_workbook_bytes()
+    excel_data, workbook = open_workbook(content)
+    reference = pd.ExcelFile(io.BytesIO(content))
+
+    assert excel_data.sheet_names == reference.sheet_names
+    for sheet_name in reference.sheet_names:
+        expected = pd.read_excel(reference, sheet_name=sheet_name, header=None)
+        actual = excel_data.parse(sheet_name, header=None)
+        assert process_sheet_content(actual, sheet_name) == process_sheet_content(expected, sheet_name)
+
+
+def test_images_come_from_the_same_workbook():
+    excel_data, workbook = open_workbook(make_workbook_bytes())
+    plan = process_excel_data(excel_data, workbook)
+
+    images = plan['custom_notes']['images']
+    assert len(images) == 1
+    assert images[0]['format'] == 'png'
+    assert images[0]['anchor'] == 'B2'
+    assert 'images' not in plan['risk_management']
+    assert plan['risk_management']['tables'][0]['headers'] == ['ID', 'Description', 'Probability']
+
+
+def test_streaming_mode_matches_in_memory_mode():
+    content = make_workbook_bytes()
+    in_memory = process_excel_data(*open_workbook(content, streaming=False))
+    excel_data, workbook = open_workbook(content, streaming=True)
+    assert excel_data is None and workbook.read_only
+    streamed = process_excel_data(excel_data, workbook)
+    workbook.close()
+
+    assert streamed['custom_notes'] == in_memory['custom_notes']
+    assert streamed['risk_management']['tables'] == in_memory['risk_management']['tables']
+
+
+def test_sheet_fan_out_matches_sequential_processing():
+    content = make_workbook_bytes()
+    sequential = process_excel_data(*open_workbook(content))
+    excel_data, workbook = open_workbook(content, streaming=True)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        fanned_out = process_excel_data(excel_data, workbook, executor=executor, file_content=content)
+    workbook.close()
+
+    assert list(fanned_out) == list(sequential)
+    assert fanned_out == sequential
+
+
+def edited_workbook_bytes(content):
+    wb = load_workbook(io.BytesIO(content))
+    wb['Custom Notes'].append(['A brand new note that adds a shared string'])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def test_fingerprint_only_changes_for_edited_sheet():
+    content = make_workbook_bytes()
+    before = fingerprint_workbook(content)
+    after = fingerprint_workbook(edited_workbook_bytes(content))
+    assert before['Risk Management'] == after['Risk Management']
+    assert before['Custom Notes'] != after['Custom Notes']
+
+
+def test_parse_upload_reuses_cached_sheets(monkeypatch):
+    monkeypatch.setattr(server, 'UPLOAD_WORKERS', 0)
+    monkeypatch.setattr(server, 'parse_cache', ParseCache(10 * 1024 * 1024))
+    processed = []
+    original = server.process_workbook_sheet
+
+    def counting(excel_data, workbook, sheet_name):
+        processed.append(sheet_name)
+        return original(excel_data, workbook, sheet_name)
+
+    monkeypatch.setattr(server, 'process_workbook_sheet', counting)
+    content = make_workbook_bytes()
+    edited = edited_workbook_bytes(content)
+
+    first = asyncio.run(server.parse_upload(content))
+    assert processed == ['Risk Management', 'Custom Notes']
+    assert asyncio.run(server.parse_upload(content)) == first
+    assert processed == ['Risk Management', 'Custom Notes']
+
+    second = asyncio.run(server.parse_upload(edited))
+    assert processed[2:] == ['Custom Notes']
+    assert second['risk_management'] == first['risk_management']
+    assert len(second['custom_notes']['images']) == 1
+    assert server.parse_cache.stats['hits'] == 2
+
+
+def test_parse_cache_evicts_least_recently_used():
+    cache = ParseCache(max_bytes=600)
+    asyncio.run(cache.put('a', 'x' * 200))
+    asyncio.run(cache.put('b', 'y' * 200))
+    assert asyncio.run(cache.get('a')) == 'x' * 200
+    asyncio.run(cache.put('c', 'z' * 200))
+    assert asyncio.run(cache.get('b')) is None
+    assert asyncio.run(cache.get('a')) is not None
+    assert cache.stats['evictions'] == 1
+
+
+def test_exported_workbook_parses_back_to_the_same_plan():
+    excel_data, workbook = open_workbook(make_workbook_bytes())
+    plan = process_excel_data(excel_data, workbook)
+    images = {}
+    for section in plan.values():
+        for image in section.get('images') or []:
+            images[image['image_id']] = image.pop('data')
+
+    exported = io.BytesIO()
+    server.write_plan_workbook(plan, images, exported)
+    excel_data, workbook = open_workbook(exported.getvalue())
+    again = process_excel_data(excel_data, workbook)
+
+    for key in ('risk_management', 'custom_notes'):
+        assert again[key]['content'] == plan[key]['content']
+        assert again[key]['tables'] == plan[key]['tables']
+    assert [image['image_id'] for image in again['custom_notes']['images']] == list(images)
+    assert again['custom_notes']['images'][0]['anchor'] == 'B2'
+
+
+def test_sheets_named_after_plan_fields_become_their_own_sections():
+    wb = Workbook()
+    wb.active.title = 'Revision'
+    wb.active.append(['Revision log'])
+    for name in ('Title', 'Section Keys', 'Section Counts'):
+        wb.create_sheet(name).append([f'{name} notes'])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    
+    excel_data, workbook = open_workbook(buffer.getvalue())
+    plan_data = process_excel_data(excel_data, workbook)
+    assert {'revision_section', 'title_section', 'section_keys_section', 'section_counts_section'} <= set(plan_data)
+    assert plan_data['title_section']['metadata']['sheet_name'] == 'Title'
+    assert not {'revision', 'title', 'section_keys', 'section_counts'} & set(plan_data)
+    plan = server.ProjectPlan(title='Fields', **plan_data)
+    assert plan.revision == 0 and plan.title == 'Fields'
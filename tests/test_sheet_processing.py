@@ -0,0 +1,180 @@
+from itertools import count, islice
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from server import detect_table_structure, iter_sheet_content, process_sheet_content, process_sheet_rows
+
+
+def legacy_detect_table_structure(df, start_row=0):
+    """Row-by-row detector as it shipped before the single-pass layout"""
+    if len(df) < 2 or start_row >= len(df) - 1:
+        return None
+    for i in range(start_row, min(start_row + 5, len(df) - 1)):
+        row = df.iloc[i]
+        if row.notna().sum() >= 2:
+            data_rows = []
+            for j in range(i + 1, min(i + 10, len(df))):
+                if df.iloc[j].notna().sum() >= 2:
+                    data_rows.append(j)
+                elif len(data_rows) >= 2:
+                    break
+            if len(data_rows) >= 2:
+                return {
+                    'header_row': i,
+                    'data_start': i + 1,
+                    'data_end': data_rows[-1] + 1,
+                    'columns': row.dropna().tolist()
+                }
+    return None
+
+
+def legacy_process_sheet_content(df, sheet_name):
+    """Original process_sheet_content with only the table skip fixed"""
+    content, tables, current_section = [], [], []
+    i = 0
+    while i < len(df):
+        row = df.iloc[i]
+        row_data = []
+        for j in range(len(df.columns)):
+            value = row.iloc[j]
+            row_data.append(str(value).strip() if pd.notna(value) and str(value).strip() else '')
+        if any(row_data):
+            structure = legacy_detect_table_structure(df, i)
+            if structure and structure['header_row'] == i:
+                if current_section:
+                    content.append({'type': 'section', 'content': current_section})
+                    current_section = []
+                headers = structure['columns']
+                rows = []
+                for r in range(structure['data_start'], structure['data_end']):
+                    table_row = df.iloc[r]
+                    data = {}
+                    for col_idx, header in enumerate(headers):
+                        value = table_row.iloc[col_idx]
+                        data[header] = str(value).strip() if pd.notna(value) else ''
+                    if any(data.values()):
+                        rows.append(data)
+                if rows:
+                    tables.append({'headers': headers, 'rows': rows, 'position': i})
+                    content.append({'type': 'table', 'table_index': len(tables) - 1, 'position': i})
+                i = structure['data_end']
+                continue
+            cells = [cell for cell in row_data if cell]
+            row_text = ' '.join(cells)
+            if 'back to toc' in row_text.lower():
+                content.append({'type': 'navigation', 'content': row_text, 'position': i})
+            elif len(cells) == 1 and len(row_text) > 20:
+                current_section.append({'type': 'paragraph', 'content': row_text, 'position': i})
+            else:
+                current_section.append({'type': 'row', 'content': row_data, 'position': i})
+        i += 1
+    if current_section:
+        content.append({'type': 'section', 'content': current_section})
+    return {
+        'content': content,
+        'tables': tables,
+        'metadata': {'sheet_name': sheet_name, 'total_rows': len(df), 'processed_items': len(content)}
+    }
+
+
+def make_sheet(rows, width=4):
+    return pd.DataFrame([list(r) + [None] * (width - len(r)) for r in rows])
+
+
+SHEETS = {
+    'risk_register': make_sheet([
+        ['Risk Management'],
+        [None],
+        ['This section lists all risks identified for the project.'],
+        ['ID', 'Description', 'Owner', 'Status'],
+        ['R1', 'Vendor delay', 'PM', 'Open'],
+        ['R2', 'Scope creep', None, 'Closed'],
+        ['R3', 'Key staff leaves', 'HR', 'Open'],
+        [None],
+        ['Back to TOC'],
+    ]),
+    'two_tables': make_sheet([
+        ['Deliverable', 'Due'],
+        ['SRS', '2024-01-01'],
+        ['Design', '2024-02-01'],
+        [None],
+        ['Notes about the second table follow here'],
+        ['Name', 'Role', 'Skill'],
+        ['Ana', 'Dev', 'Python'],
+        [None, None, None],
+        ['Bo', 'QA', 'Selenium'],
+        ['Cy', 'Ops', 'Ansible'],
+    ]),
+    'gapped_header': make_sheet([
+        ['Version', 'Date', 'Author'],
+        ['Short'],
+        ['1.0', '2024-01-01', 'A'],
+        ['1.1', '2024-01-15', 'B'],
+        ['Trailing row', 'x'],
+        ['Single cell value'],
+    ]),
+    'no_tables': make_sheet([
+        ['Title', 'Project X'],
+        ['A paragraph that is long enough to count'],
+        ['short'],
+        ['Back to TOC', None],
+    ]),
+    'mixed_types': pd.DataFrame({
+        0: ['Item', 'Budget', 'Start', '  padded  ', 'Total'],
+        1: ['Value', 1.5, pd.Timestamp('2024-03-01'), '   ', 3.0],
+        2: [None, 2, None, np.nan, 7],
+    }),
+}
+
+
+@pytest.mark.parametrize('name', sorted(SHEETS))
+def test_matches_legacy_layout(name):
+    df = SHEETS[name]
+    assert process_sheet_content(df, name) == legacy_process_sheet_content(df, name)
+
+
+@pytest.mark.parametrize('name', sorted(SHEETS))
+def test_detect_table_structure_matches_legacy(name):
+    df = SHEETS[name]
+    for start in range(len(df)):
+        assert detect_table_structure(df, start) == legacy_detect_table_structure(df, start)
+
+
+def test_table_rows_are_not_emitted_twice():
+    result = process_sheet_content(SHEETS['risk_register'], 'Risk Management')
+    positions = [item['position'] for item in result['content'] if 'position' in item]
+    positions += [item['position'] for s in result['content'] if s['type'] == 'section' for item in s['content']]
+    assert len(result['tables']) == 1
+    assert not set(positions) & {4, 5, 6}
+
+
+def test_long_table_is_single_table():
+    df = pd.DataFrame(np.arange(60).reshape(20, 3).astype(str), columns=None)
+    result = process_sheet_content(df, 'Long')
+    assert len(result['tables']) == 1
+    assert len(result['tables'][0]['rows']) == 19
+
+
+def frame_rows(df):
+    return [tuple(None if pd.isna(v) else v for v in row) for row in df.itertuples(index=False)]
+
+
+@pytest.mark.parametrize('name', sorted(SHEETS))
+def test_streaming_matches_frame_processing(name):
+    df = SHEETS[name]
+    assert process_sheet_rows(iter(frame_rows(df)), name) == process_sheet_content(df, name)
+
+
+def test_streaming_reads_only_a_bounded_window():
+    pulled = []
+
+    def rows():
+        for i in count():
+            pulled.append(i)
+            yield ('A paragraph that is long enough to count',)
+
+    first = list(islice(iter_sheet_content(rows()), 3))
+    assert [item['position'] for item in first] == [0, 1, 2]
+    assert len(pulled) < 20